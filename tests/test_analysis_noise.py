@@ -0,0 +1,122 @@
+import unittest
+
+import numpy as np
+
+from ufotest.analysis.noise import pair_variance, pair_rms_noise, pixel_variance, rms_noise
+
+
+# HELPER FUNCTIONS
+# ================
+
+def loop_pair_variance(frame1: np.ndarray, frame2: np.ndarray) -> float:
+    """
+    This is the original pure python implementation of the pair variance which was used in "ufotest.tests.noise"
+    before the vectorized kernels were introduced. It serves as the reference for the regression tests.
+    """
+    frame1_mean = np.mean(frame1)
+    frame2_mean = np.mean(frame2)
+
+    row_count = len(frame1)
+    column_count = len(frame1[0])
+    squared_sum = 0
+    for i in range(row_count):
+        for j in range(column_count):
+            squared_sum += ((frame1[i][j] - frame1_mean) - (frame2[i][j] - frame2_mean)) ** 2
+
+    variance = squared_sum / (2 * row_count * column_count)
+    return variance
+
+
+def random_frame(height: int = 24, width: int = 32, seed: int = 0) -> np.ndarray:
+    random_state = np.random.RandomState(seed)
+    return random_state.randint(0, 4096, size=(height, width)).astype(np.uint16)
+
+
+# TESTCASES
+# =========
+
+class TestPairVariance(unittest.TestCase):
+
+    def test_matches_loop_implementation(self):
+        """
+        If the vectorized pair variance produces the same result as the original loop implementation
+        """
+        for seed in range(5):
+            frame1 = random_frame(seed=seed)
+            frame2 = random_frame(seed=seed + 100)
+
+            expected = loop_pair_variance(frame1, frame2)
+            self.assertAlmostEqual(expected, pair_variance(frame1, frame2), places=6)
+
+    def test_unsigned_frames_do_not_wrap_around(self):
+        """
+        If the calculation works with uint16 frames, where the second frame has larger values than the first. A naive
+        subtraction would wrap around in this case.
+        """
+        frame1 = np.zeros(shape=(4, 4), dtype=np.uint16)
+        frame2 = np.full(shape=(4, 4), fill_value=4000, dtype=np.uint16)
+        frame2[0, 0] = 0
+
+        expected = loop_pair_variance(frame1, frame2)
+        self.assertAlmostEqual(expected, pair_variance(frame1, frame2), places=6)
+
+    def test_block_wise_processing(self):
+        """
+        If the result is the same when the frame has to be processed in multiple row blocks
+        """
+        import ufotest.analysis.noise as noise
+
+        frame1 = random_frame(height=50, width=10, seed=1)
+        frame2 = random_frame(height=50, width=10, seed=2)
+        expected = pair_variance(frame1, frame2)
+
+        original = noise.BLOCK_PIXEL_COUNT
+        noise.BLOCK_PIXEL_COUNT = 30
+        try:
+            self.assertAlmostEqual(expected, noise.pair_variance(frame1, frame2), places=6)
+        finally:
+            noise.BLOCK_PIXEL_COUNT = original
+
+    def test_identical_frames_have_zero_variance(self):
+        frame = random_frame()
+        self.assertEqual(0, pair_variance(frame, frame))
+        self.assertEqual(0, pair_rms_noise(frame, frame))
+
+    def test_different_shapes_error(self):
+        with self.assertRaises(ValueError):
+            pair_variance(random_frame(10, 10), random_frame(10, 11))
+
+
+class TestPixelVariance(unittest.TestCase):
+
+    def test_matches_numpy_var(self):
+        """
+        If the per pixel variance is the same as the one computed by np.var over a stacked float array, which is how
+        "CalculateMultiNoiseTest" previously worked
+        """
+        frames = [random_frame(seed=seed) for seed in range(10)]
+        frame_array = np.stack(frames, axis=2).astype(np.float64)
+
+        expected = np.var(frame_array, axis=2)
+        np.testing.assert_allclose(expected, pixel_variance(frames), rtol=1e-9)
+        np.testing.assert_allclose(expected, pixel_variance(np.stack(frames)), rtol=1e-9)
+
+        expected_ddof = np.var(frame_array, axis=2, ddof=1)
+        np.testing.assert_allclose(expected_ddof, pixel_variance(frames, ddof=1), rtol=1e-9)
+
+    def test_works_with_generator(self):
+        frames = (random_frame(seed=seed) for seed in range(3))
+        variance = pixel_variance(frames)
+        self.assertEqual((24, 32), variance.shape)
+        self.assertEqual(np.float64, variance.dtype)
+
+    def test_no_frames_error(self):
+        with self.assertRaises(ValueError):
+            pixel_variance([])
+
+
+class TestRmsNoise(unittest.TestCase):
+
+    def test_scalar_and_array(self):
+        self.assertAlmostEqual(3.0, rms_noise(9.0))
+        self.assertAlmostEqual(2.0, rms_noise(np.array([[2.0, 6.0], [4.0, 4.0]])))
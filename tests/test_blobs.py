@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ufotest.ci.blobs import BlobStore
+
+
+# HELPER FUNCTIONS
+# ================
+
+def write_file(path: str, content: str, executable: bool = False) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode='w') as file:
+        file.write(content)
+
+    if executable:
+        os.chmod(path, 0o755)
+
+
+def read_file(path: str) -> str:
+    with open(path, mode='r') as file:
+        return file.read()
+
+
+# TESTCASES
+# =========
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = BlobStore(path=os.path.join(self.folder.name, 'blobs'))
+
+        self.repository_path = os.path.join(self.folder.name, 'repository')
+        write_file(os.path.join(self.repository_path, 'camera.bit'), 'bitfile')
+        write_file(os.path.join(self.repository_path, 'scripts', 'setup.sh'), 'echo "setup"', executable=True)
+        write_file(os.path.join(self.repository_path, 'scripts', 'copy.sh'), 'echo "setup"')
+        write_file(os.path.join(self.repository_path, '.git'), 'gitdir: /somewhere')
+        os.symlink('camera.bit', os.path.join(self.repository_path, 'latest.bit'))
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def count_blobs(self) -> int:
+        return sum(len(files) for _, _, files in os.walk(self.store.path))
+
+    def test_put_is_content_addressed(self):
+        bitfile_path = os.path.join(self.repository_path, 'camera.bit')
+        digest = self.store.put(bitfile_path)
+        self.assertEqual(digest, self.store.put(bitfile_path))
+        self.assertEqual('bitfile', read_file(self.store.get_blob_path(digest)))
+        self.assertEqual(1, self.count_blobs())
+
+        # The same content, but executable is a different blob
+        setup_digest = self.store.put(os.path.join(self.repository_path, 'scripts', 'setup.sh'))
+        copy_digest = self.store.put(os.path.join(self.repository_path, 'scripts', 'copy.sh'))
+        self.assertNotEqual(setup_digest, copy_digest)
+        self.assertTrue(os.access(self.store.get_blob_path(setup_digest), os.X_OK))
+
+    def test_link_tree_deduplicates_builds(self):
+        build_paths = [os.path.join(self.folder.name, 'builds', name) for name in ['build_1', 'build_2']]
+        for build_path in build_paths:
+            count = self.store.link_tree(self.repository_path, build_path, ignore=shutil.ignore_patterns('.git'))
+            self.assertEqual(3, count)
+
+        for build_path in build_paths:
+            self.assertEqual('echo "setup"', read_file(os.path.join(build_path, 'scripts', 'setup.sh')))
+            self.assertTrue(os.path.islink(os.path.join(build_path, 'latest.bit')))
+            self.assertFalse(os.path.exists(os.path.join(build_path, '.git')))
+
+        # Both builds share the same three blobs
+        self.assertEqual(3, self.count_blobs())
+        self.assertTrue(os.path.samefile(os.path.join(build_paths[0], 'camera.bit'),
+                                         os.path.join(build_paths[1], 'camera.bit')))
+
+    def test_collect_garbage(self):
+        build_paths = [os.path.join(self.folder.name, 'builds', name) for name in ['build_1', 'build_2']]
+        self.store.link_tree(self.repository_path, build_paths[0])
+        write_file(os.path.join(self.repository_path, 'camera.bit'), 'new bitfile')
+        self.store.link_tree(self.repository_path, build_paths[1])
+        self.assertEqual(5, self.count_blobs())
+
+        # All blobs are still referenced
+        self.assertEqual((0, 0), self.store.collect_garbage())
+
+        # Only the old bitfile is exclusive to the first build
+        shutil.rmtree(build_paths[0])
+        self.assertEqual((1, len('bitfile')), self.store.collect_garbage())
+        self.assertEqual(4, self.count_blobs())
+
+        shutil.rmtree(build_paths[1])
+        self.assertEqual(4, self.store.collect_garbage()[0])
+        self.assertListEqual([], os.listdir(self.store.path))
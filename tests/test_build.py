@@ -5,10 +5,11 @@ import os
 import datetime
 import shutil
 import unittest
+from unittest import mock
 
 from ufotest._testing import UfotestTestMixin
 from ufotest.config import get_path
-from ufotest.exceptions import IncompleteBuildError
+from ufotest.exceptions import IncompleteBuildError, BuildError
 from ufotest.ci.build import BuildContext, BuildLock, BuildRunner, BuildReport, BuildQueue
 
 # == UTILITY DEFINITIONS ==
@@ -116,6 +117,27 @@ class TestBuildContext(UfotestBuildTestMixin, unittest.TestCase):
         with BuildContext(**BUILD_CONTEXT_KWARGS, config=self.config) as build_context:
             self.assertIsInstance(build_context, BuildContext)
 
+    def test_lock_released_when_worktree_cleanup_fails(self):
+        """
+        If the build lock is released on exit, even if the removal of the build worktree fails
+        """
+        build_context = BuildContext(**BUILD_CONTEXT_KWARGS, config=self.config)
+        build_context.test_context = mock.MagicMock()
+        os.makedirs(build_context.folder_path)
+        os.makedirs(build_context.repository_path, exist_ok=True)
+        BuildLock.acquire()
+
+        def remove_worktree(mirror, path):
+            raise BuildError('git worktree prune failed')
+
+        try:
+            with mock.patch('ufotest.ci.build.GitMirror.remove_worktree', new=remove_worktree):
+                build_context.__exit__(None, None, None)
+        finally:
+            shutil.rmtree(build_context.repository_path)
+
+        self.assertFalse(BuildLock.is_locked())
+
 
 class TestBuildRunner(UfotestBuildTestMixin, unittest.TestCase):
 
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+import threading
+import multiprocessing
+from unittest import mock
+
+from ufotest._testing import UfotestTestMixin
+from ufotest.config import get_path
+from ufotest.ci.build import BuildQueue, BuildLock
+from ufotest.ci.build_queue import JsonQueueBackend, SqliteQueueBackend, QueueNotifier
+from ufotest.ci.build_queue import coalesce, ALWAYS, LATEST, EVERY_NTH
+from ufotest.exceptions import BuildCanceledError
+
+
+# HELPER FUNCTIONS
+# ================
+
+def create_build(commit: str, branch: str = 'main') -> dict:
+    return {
+        'repository': {'clone_url': 'https://github.com/the16thpythonist/ufo-mock.git'},
+        'ref': f'refs/heads/{branch}',
+        'commits': [commit]
+    }
+
+
+# TESTCASES
+# =========
+
+class TestCoalesce(unittest.TestCase):
+
+    def test_policies(self):
+        items = [create_build('a'), create_build('x', 'dev'), create_build('b'), create_build('c')]
+
+        self.assertEqual((0, []), coalesce(items, ALWAYS))
+        self.assertEqual((3, [0, 2]), coalesce(items, LATEST))
+        self.assertEqual((2, [0]), coalesce(items, EVERY_NTH, every=2))
+        # With fewer pending builds than n, the most recent one is built
+        self.assertEqual((3, [0, 2]), coalesce(items, EVERY_NTH, every=5))
+
+        with self.assertRaises(ValueError):
+            coalesce(items, 'sometimes')
+
+    def test_other_branch_is_not_dropped(self):
+        items = [create_build('x', 'dev'), create_build('a'), create_build('b')]
+        self.assertEqual((0, []), coalesce(items, LATEST))
+
+
+class TestQueueBackends(unittest.TestCase):
+
+    BACKENDS = {
+        JsonQueueBackend: 'build.queue',
+        SqliteQueueBackend: 'build_queue.db'
+    }
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def create_backend(self, backend_class):
+        return backend_class(os.path.join(self.folder.name, self.BACKENDS[backend_class]))
+
+    def test_push_and_pop_in_order(self):
+        for backend_class in self.BACKENDS.keys():
+            backend = self.create_backend(backend_class)
+            self.assertIsNone(backend.pop())
+
+            for index in range(3):
+                backend.push({'index': index})
+            self.assertEqual(3, len(backend))
+            self.assertListEqual([0, 1, 2], [item['index'] for item in backend.items()])
+
+            build = backend.pop()
+            self.assertEqual(0, build['index'])
+            self.assertLessEqual(build['enqueued'], time.time())
+            self.assertEqual(2, len(backend))
+
+    def test_stats(self):
+        for backend_class in self.BACKENDS.keys():
+            backend = self.create_backend(backend_class)
+            self.assertDictEqual({'depth': 0, 'wait_time': 0}, backend.stats())
+
+            backend.push({'index': 0})
+            time.sleep(0.05)
+            backend.push({'index': 1})
+
+            stats = backend.stats()
+            self.assertEqual(2, stats['depth'])
+            self.assertGreaterEqual(stats['wait_time'], 0.05)
+
+    def test_concurrent_push_and_pop(self):
+        for backend_class in self.BACKENDS.keys():
+            backend = self.create_backend(backend_class)
+            popped = []
+
+            def push_builds(offset: int):
+                # Every thread uses its own backend object, just like separate processes would
+                thread_backend = self.create_backend(backend_class)
+                for index in range(offset, 100, 4):
+                    thread_backend.push({'index': index})
+                    if index % 2:
+                        popped.append(thread_backend.pop()['index'])
+
+            threads = [threading.Thread(target=push_builds, args=(offset, )) for offset in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # No build may be lost or popped twice
+            remaining = [item['index'] for item in backend.items()]
+            self.assertEqual(50, len(popped))
+            self.assertListEqual(list(range(100)), sorted(popped + remaining))
+
+    def test_take_coalesced(self):
+        for backend_class in self.BACKENDS.keys():
+            backend = self.create_backend(backend_class)
+            self.assertEqual((None, []), backend.take(lambda items: coalesce(items, LATEST)))
+
+            for build in [create_build('a'), create_build('x', 'dev'), create_build('b')]:
+                backend.push(build)
+
+            build, dropped = backend.take(lambda items: coalesce(items, LATEST))
+            self.assertListEqual(['b'], build['commits'])
+            self.assertListEqual([['a']], [item['commits'] for item in dropped])
+            self.assertListEqual([['x']], [item['commits'] for item in backend.items()])
+
+    def test_json_backend_reads_old_queue_file(self):
+        backend = self.create_backend(JsonQueueBackend)
+        with open(backend.path, mode='w') as file:
+            json.dump([{'ref': 'refs/heads/main'}], file)
+
+        self.assertEqual(1, backend.stats()['depth'])
+        build = backend.pop()
+        self.assertEqual('refs/heads/main', build['ref'])
+        self.assertIn('enqueued', build)
+
+        with open(backend.path, mode='r') as file:
+            self.assertListEqual([], json.load(file))
+
+
+class TestQueueNotifier(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'build.notify')
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_notify_without_listener(self):
+        # This must not block or raise an error
+        QueueNotifier(self.path).notify()
+
+    def test_wait_for_notification(self):
+        with QueueNotifier(self.path) as notifier:
+            self.assertFalse(notifier.wait(0.01))
+
+            # Multiple notifications are consumed at once
+            for _ in range(3):
+                QueueNotifier(self.path).notify()
+            self.assertTrue(notifier.wait(1))
+            self.assertFalse(notifier.wait(0.01))
+
+            timer = threading.Timer(0.05, QueueNotifier(self.path).notify)
+            timer.start()
+            start_time = time.time()
+            self.assertTrue(notifier.wait(10))
+            self.assertLess(time.time() - start_time, 5)
+            timer.join()
+
+
+class TestBuildQueue(UfotestTestMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.config.data['ci']['coalesce_policy'] = ALWAYS
+        self.config.data['ci']['cancel_superseded'] = False
+
+    def tearDown(self) -> None:
+        while not BuildQueue.is_empty():
+            BuildQueue.pop()
+
+        if BuildLock.is_locked():
+            BuildLock.release()
+
+    def test_push_and_pop(self):
+        self.assertTrue(BuildQueue.is_empty())
+        with self.assertRaises(IndexError):
+            BuildQueue.pop()
+
+        BuildQueue.push({'ref': 'refs/heads/main'})
+        self.assertFalse(BuildQueue.is_empty())
+        self.assertEqual(1, BuildQueue.stats()['depth'])
+        self.assertEqual('refs/heads/main', BuildQueue.pop()['ref'])
+
+    def test_legacy_queue_is_imported(self):
+        """
+        If the pending builds of the "build.queue" file of an older installation are moved into the sqlite queue
+        """
+        legacy_path = get_path(BuildQueue.QUEUE_FILE_NAME)
+        with open(legacy_path, mode='w') as file:
+            json.dump([create_build('a'), {**create_build('b'), 'enqueued': 100.0}], file)
+
+        self.assertEqual(2, BuildQueue.stats()['depth'])
+        self.assertFalse(os.path.exists(legacy_path))
+
+        self.assertListEqual(['a'], BuildQueue.pop()['commits'])
+        build = BuildQueue.pop()
+        self.assertListEqual(['b'], build['commits'])
+        self.assertEqual(100.0, build['enqueued'])
+
+    def test_worker_is_woken_up_by_push(self):
+        from ufotest.ci.server import BuildWorker
+
+        # A timeout this long would let the test fail, if the worker was not woken up by the notification
+        worker = BuildWorker(timeout=60)
+        processed = []
+
+        def process(build_request: dict):
+            processed.append(build_request)
+            worker.running = False
+
+        worker.process = process
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+
+        time.sleep(0.1)
+        BuildQueue.push({'ref': 'refs/heads/main'})
+        thread.join(timeout=10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(processed))
+        self.assertEqual('refs/heads/main', processed[0]['ref'])
+
+    def test_coalesced_builds_are_recorded(self):
+        self.config.data['ci']['coalesce_policy'] = LATEST
+        for commit in ['a', 'b', 'c']:
+            BuildQueue.push(create_build(commit))
+
+        self.assertListEqual(['c'], BuildQueue.pop()['commits'])
+        self.assertTrue(BuildQueue.is_empty())
+
+        records = BuildQueue.get_superseded(limit=2)
+        self.assertListEqual(['b', 'a'], [record['commit'] for record in records])
+        self.assertTrue(all(record['superseded_by'] == 'c' and record['reason'] == 'coalesced' for record in records))
+
+    def test_is_superseded(self):
+        running = create_build('a')
+        self.assertFalse(BuildQueue.is_superseded(running))
+
+        BuildQueue.push(create_build('b'))
+        self.assertFalse(BuildQueue.is_superseded(running))
+
+        self.config.data['ci']['coalesce_policy'] = LATEST
+        self.assertTrue(BuildQueue.is_superseded(running))
+        self.assertFalse(BuildQueue.is_superseded(create_build('x', 'dev')))
+
+        self.config.data['ci']['coalesce_policy'] = EVERY_NTH
+        self.config.data['ci']['coalesce_every'] = 2
+        self.assertFalse(BuildQueue.is_superseded(running))
+        BuildQueue.push(create_build('c'))
+        self.assertTrue(BuildQueue.is_superseded(running))
+
+    def test_process_handles_cancel(self):
+        """
+        If a cancel, which arrives outside of the build context, does not escape from the build worker
+        """
+        from ufotest.ci.server import BuildWorker
+
+        worker = BuildWorker(timeout=60)
+        build_report = object()
+        worker.run_build = lambda build_request: build_report
+
+        def send_report_mails(build_request, report):
+            raise BuildCanceledError('The build has been superseded by a more recent build request')
+
+        worker.send_report_mails = send_report_mails
+        worker.process(create_build('a'))
+
+    def test_cancel_superseded_build(self):
+        from ufotest.ci.server import BuildWorker
+
+        self.config.data['ci']['coalesce_policy'] = LATEST
+        worker = BuildWorker(timeout=60)
+        # This replaces the actual build, which runs in the child process and would take forever
+        worker.process = lambda build_request: time.sleep(60)
+
+        results = []
+        with BuildQueue.get_notifier() as notifier:
+            thread = threading.Thread(
+                target=lambda: results.append(worker.process_cancellable(create_build('a'), notifier))
+            )
+            thread.start()
+
+            time.sleep(0.2)
+            BuildQueue.push(create_build('b'))
+            thread.join(timeout=20)
+
+        self.assertFalse(thread.is_alive())
+        self.assertListEqual([False], results)
+        record = BuildQueue.get_superseded(limit=1)[0]
+        self.assertEqual('a', record['commit'])
+        self.assertEqual('canceled', record['reason'])
+
+    def test_stopped_worker_cancels_build(self):
+        """
+        If the build child process is terminated as well, when the process of the build worker is stopped
+        """
+        from ufotest.ci.server import BuildWorker
+
+        worker = BuildWorker(timeout=60)
+        worker.process = lambda build_request: time.sleep(60)
+
+        # This simulates the KeyboardInterrupt, into which the worker process turns the SIGTERM of the supervisor
+        with BuildQueue.get_notifier() as notifier, \
+                mock.patch('multiprocessing.connection.wait', side_effect=KeyboardInterrupt()):
+            start_time = time.time()
+            with self.assertRaises(KeyboardInterrupt):
+                worker.process_cancellable(create_build('a'), notifier)
+
+        self.assertLess(time.time() - start_time, 20)
+        self.assertListEqual([], multiprocessing.active_children())
@@ -1,9 +1,34 @@
+import os
+import sys
+import tempfile
 import unittest
-from ufotest._testing import UfotestTestMixin
+import subprocess
+from ufotest._testing import UfotestTestMixin, benchmark
 
 import numpy as np
 
 from ufotest.camera import AbstractCamera, MockCamera, import_raw, InternalDictMixin
+from ufotest.camera import map_raw, iter_raw_frames
+
+# This script is executed in a separate process to measure the peak memory usage (VmHWM) of computing the pixel variance
+# over all the frames of a raw file. The first argument is the path, the second argument decides between reading the
+# whole file with "import_raw" and lazily iterating a memory map with "iter_raw_frames".
+RSS_BENCHMARK_SCRIPT = """
+import sys
+from ufotest.analysis.noise import pixel_variance
+from ufotest.camera import import_raw, iter_raw_frames
+
+path, mode, width, height = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+if mode == 'read':
+    pixel_variance(import_raw(path, None, width, height))
+else:
+    pixel_variance(iter_raw_frames(path, width, height))
+
+with open('/proc/self/status') as file:
+    for line in file:
+        if line.startswith('VmHWM'):
+            print(int(line.split()[1]))
+"""
 
 
 class TestInternalDictMixin(unittest.TestCase):
@@ -84,6 +109,43 @@ class TestInternalDictMixin(unittest.TestCase):
         self.assertEqual(10, local.values['a'])
 
 
+class TestAbstractCamera(unittest.TestCase):
+
+    class CountingCamera(AbstractCamera):
+        """
+        A minimal camera implementation, whose frames are filled with the number of the frame.
+        """
+        def __init__(self):
+            AbstractCamera.__init__(self, None)
+            self.count = 0
+
+        def get_frame(self) -> np.ndarray:
+            self.count += 1
+            return np.full(shape=(4, 6), fill_value=self.count, dtype=np.uint16)
+
+    def test_default_get_frames(self):
+        """
+        If the default implementation of get_frames collects the given number of frames into a single array
+        """
+        camera = self.CountingCamera()
+        frames = camera.get_frames(3)
+        self.assertEqual((3, 4, 6), frames.shape)
+        self.assertEqual(np.uint16, frames.dtype)
+        self.assertListEqual([1, 2, 3], frames[:, 0, 0].tolist())
+
+    def test_default_stream_frames(self):
+        """
+        If the default implementation of stream_frames yields the given number of frames or infinitely many
+        """
+        camera = self.CountingCamera()
+        self.assertEqual(5, len(list(camera.stream_frames(5))))
+
+        stream = camera.stream_frames()
+        for _ in range(10):
+            next(stream)
+        self.assertEqual(15, camera.count)
+
+
 
 
 class TestMockCamera(UfotestTestMixin, unittest.TestCase):
@@ -122,3 +184,88 @@ class TestMockCamera(UfotestTestMixin, unittest.TestCase):
         frame = mock_camera.get_frame()
         self.assertIsInstance(frame, np.ndarray)
         self.assertNotEqual(0, frame[0, 0])
+
+
+class TestRawImport(unittest.TestCase):
+
+    WIDTH = 64
+    HEIGHT = 32
+    COUNT = 5
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'frames.raw')
+
+        random_state = np.random.RandomState(0)
+        self.frames = random_state.randint(0, 4096, size=(self.COUNT, self.HEIGHT, self.WIDTH)).astype(np.uint16)
+        self.frames.tofile(self.path)
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_import_raw(self):
+        frames = import_raw(self.path, 2, self.WIDTH, self.HEIGHT)
+        np.testing.assert_array_equal(self.frames[:2], frames)
+
+        frames = import_raw(self.path, None, self.WIDTH, self.HEIGHT)
+        np.testing.assert_array_equal(self.frames, frames)
+
+    def test_import_raw_memory_mapped(self):
+        frames = import_raw(self.path, 3, self.WIDTH, self.HEIGHT, memory_map=True)
+        self.assertIsInstance(frames, np.memmap)
+        self.assertEqual((3, self.HEIGHT, self.WIDTH), frames.shape)
+        np.testing.assert_array_equal(self.frames[:3], frames)
+
+    def test_map_raw(self):
+        frames = map_raw(self.path, self.WIDTH, self.HEIGHT)
+        self.assertEqual(self.COUNT, len(frames))
+        np.testing.assert_array_equal(self.frames[2], frames[2])
+
+        # On default the map is read only
+        with self.assertRaises(ValueError):
+            frames[0, 0, 0] = 0
+
+        with self.assertRaises(ValueError):
+            map_raw(self.path, self.WIDTH, self.HEIGHT, n=self.COUNT + 1)
+
+    def test_map_raw_copy_on_write(self):
+        frames = map_raw(self.path, self.WIDTH, self.HEIGHT, copy_on_write=True)
+        frames[0] = 0
+        self.assertEqual(0, np.max(frames[0]))
+        del frames
+
+        # The file itself must not have been modified
+        np.testing.assert_array_equal(self.frames, import_raw(self.path, None, self.WIDTH, self.HEIGHT))
+
+    def test_iter_raw_frames(self):
+        frames = list(iter_raw_frames(self.path, self.WIDTH, self.HEIGHT))
+        self.assertEqual(self.COUNT, len(frames))
+        # The views of already consumed frames still have to be valid
+        np.testing.assert_array_equal(self.frames, np.stack(frames))
+
+        frames = list(iter_raw_frames(self.path, self.WIDTH, self.HEIGHT, n=2, copy=True))
+        self.assertEqual(2, len(frames))
+        self.assertNotIsInstance(frames[0], np.memmap)
+        np.testing.assert_array_equal(self.frames[:2], np.stack(frames))
+
+    @benchmark
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'requires the /proc filesystem')
+    def test_benchmark_peak_memory(self):
+        """
+        Compares the peak memory usage of computing the pixel variance over a multi frame dump which is either read
+        completely or iterated lazily from the memory map.
+        """
+        width, height, count = 512, 512, 40
+        path = os.path.join(self.folder.name, 'large.raw')
+        np.zeros(shape=(count, height, width), dtype=np.uint16).tofile(path)
+
+        peaks = {}
+        for mode in ['read', 'map']:
+            output = subprocess.check_output(
+                [sys.executable, '-c', RSS_BENCHMARK_SCRIPT, path, mode, str(width), str(height)],
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+            peaks[mode] = int(output.decode().strip())
+
+        # The file itself has a size of 20 MB, reading it completely has to show up in the peak memory
+        self.assertLess(peaks['map'], peaks['read'])
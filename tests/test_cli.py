@@ -172,3 +172,51 @@ class TestInstallCommands(UfotestCliTestMixin, unittest.TestCase):
 
         json_file_path = os.path.join(self.install_folder_path, 'install.json')
         self.assertFalse(os.path.exists(json_file_path))
+
+
+class TestCiCommands(UfotestCliTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestCiCommands, self).setUp()
+
+        # On default, the archive folder is not part of the installation folder. The worker processes of the recompile
+        # command are forked, so they also use this temporary archive folder.
+        self.archive_path = self.config.data['tests']['archive']
+        self.config.data['tests']['archive'] = os.path.join(self.folder_path, 'archive')
+        shutil.rmtree(self.config.get_archive_path(), ignore_errors=True)
+        os.mkdir(self.config.get_archive_path())
+
+    def tearDown(self):
+        self.config.data['tests']['archive'] = self.archive_path
+
+    def create_report(self, report: dict) -> str:
+        folder_path = os.path.join(self.config.get_archive_path(), report['name'])
+        os.mkdir(folder_path)
+        with open(os.path.join(folder_path, 'report.json'), mode='w') as file:
+            json.dump(report, file)
+
+        return folder_path
+
+    # -- test methods for "ci recompile"
+
+    def test_recompile_skips_broken_report(self):
+        """
+        If "ci recompile" still recompiles all the other reports, when the template of one of the reports is broken,
+        both with worker processes and without
+        """
+        from tests.test_testing import create_legacy_report
+        from ufotest.testing import HTMLTemplateMixin
+
+        folder_paths = [self.create_report(create_legacy_report(f'test_run_{index}')) for index in range(2)]
+        broken_report = create_legacy_report('test_run_broken')
+        broken_report[HTMLTemplateMixin.TEMPLATE_FIELD_NAME] = '{% if %}'
+        self.create_report(broken_report)
+
+        for workers in ['0', '2']:
+            result = self.cli_runner.invoke(cli, ['ci', 'recompile', '--force', '--workers', workers])
+            self.assertExitCodeZero(result)
+            self.assertIn('test_run_broken', result.output)
+            self.assertIn('TemplateSyntaxError', result.output)
+            self.assertIn('Recompiled 2 test reports', result.output)
+            for folder_path in folder_paths:
+                self.assertTrue(os.path.exists(os.path.join(folder_path, 'report.html')))
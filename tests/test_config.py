@@ -6,6 +6,7 @@ import tempfile
 
 from unittest import TestCase
 from ufotest.config import get_path, DEFAULT_PATH
+from ufotest._testing import UfotestTestMixin
 
 
 class TestGetPath(TestCase):
@@ -41,3 +42,31 @@ class TestGetPath(TestCase):
         # Cleaning up to not influence other tests
         temp_folder.cleanup()
         del os.environ['UFOTEST_PATH']
+
+
+class TestConfig(UfotestTestMixin, TestCase):
+
+    def test_contains_nested_keys(self) -> None:
+        """
+        If the "in" operator works with a list of nested keys
+        """
+        self.assertIn(['tests', 'suites'], self.config)
+        self.assertIn(('tests', 'suites', 'mock'), self.config)
+        self.assertNotIn(['tests', 'unknown'], self.config)
+        # "mock" is a list and not a dict, so there cannot be any keys below it
+        self.assertNotIn(['tests', 'suites', 'mock', 'key'], self.config)
+
+    def test_get_data_or_default(self) -> None:
+        self.assertListEqual(['mock'], self.config.get_data_or_default(['tests', 'suites', 'mock'], []))
+        self.assertEqual(10, self.config.get_data_or_default(['tests', 'unknown'], 10))
+
+    def test_nested_options_take_effect(self) -> None:
+        """
+        If a nested option, which is set within the config, is actually returned instead of the default
+        """
+        original_workers = self.config.data['tests'].get('workers')
+        self.config.data['tests']['workers'] = 1
+        try:
+            self.assertEqual(1, self.config.get_data_or_default(['tests', 'workers'], 4))
+        finally:
+            self.config.data['tests']['workers'] = original_workers
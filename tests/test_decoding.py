@@ -0,0 +1,141 @@
+import os
+import re
+import glob
+import tempfile
+import unittest
+from typing import List, Optional
+
+import numpy as np
+
+from ufotest.exceptions import FrameDecodingError
+from ufotest.decoding import (decode_frames,
+                              decode_frame,
+                              decode_file,
+                              unpack_12bit,
+                              frame_word_count,
+                              FRAME_FOOTER_WORD,
+                              FRAME_HEADER_WORDS,
+                              FRAME_FOOTER_WORDS)
+
+# Pairs of raw DMA dumps and the corresponding output of ipedec can be placed into this folder to check the parity of
+# the numpy decoder with ipedec. The dumps need to be named "{name}_{width}x{height}.out" and the ipedec output has to
+# be the file with the same name and ".raw" appended (which is what ipedec produces on default).
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'decoding')
+
+
+# HELPER FUNCTIONS
+# ================
+
+def encode_frame(frame: np.ndarray, row_order: Optional[List[int]] = None) -> bytes:
+    """
+    Encodes the given uint16 *frame* into the raw transfer format with plain python integer operations. This is the
+    reference for the vectorized decoder.
+    """
+    height, width = frame.shape
+    row_order = list(range(height)) if row_order is None else row_order
+
+    words = [(0x5 << 28) | ((i + 1) << 24) for i in range(FRAME_HEADER_WORDS)]
+    for row in row_order:
+        words.append((0xc0 << 24) | (2 << 20) | (row << 8))
+
+        pixels = [int(value) for value in frame[row]]
+        pixels += [0] * (-len(pixels) % 8)
+        bits = ''.join(format(pixel, '012b') for pixel in pixels)
+        words += [int(bits[i:i + 32], 2) for i in range(0, len(bits), 32)]
+
+    words += [FRAME_FOOTER_WORD] * FRAME_FOOTER_WORDS
+    return np.array(words, dtype='<u4').tobytes()
+
+
+def random_frame(height: int = 6, width: int = 20, seed: int = 0) -> np.ndarray:
+    random_state = np.random.RandomState(seed)
+    return random_state.randint(0, 4096, size=(height, width)).astype(np.uint16)
+
+
+# TESTCASES
+# =========
+
+class TestDecoding(unittest.TestCase):
+
+    def test_unpack_12bit(self):
+        # The three words 0xABCDEF01 0x23456789 0xABCDEF01 contain the eight 12 bit values written out below
+        words = np.array([[0xABCDEF01, 0x23456789, 0xABCDEF01]], dtype=np.uint32)
+        expected = [0xABC, 0xDEF, 0x012, 0x345, 0x678, 0x9AB, 0xCDE, 0xF01]
+        self.assertListEqual(expected, unpack_12bit(words, 8)[0].tolist())
+        self.assertListEqual(expected[:5], unpack_12bit(words, 5)[0].tolist())
+
+    def test_decode_single_frame(self):
+        frame = random_frame()
+        data = encode_frame(frame)
+        self.assertEqual(frame_word_count(20, 6) * 4, len(data))
+
+        decoded = decode_frame(data, 20, 6)
+        self.assertEqual(np.uint16, decoded.dtype)
+        np.testing.assert_array_equal(frame, decoded)
+
+    def test_decode_rows_out_of_order(self):
+        frame = random_frame()
+        decoded = decode_frame(encode_frame(frame, row_order=[3, 1, 0, 5, 4, 2]), 20, 6)
+        np.testing.assert_array_equal(frame, decoded)
+
+    def test_decode_multiple_frames(self):
+        frames = [random_frame(seed=seed) for seed in range(4)]
+        data = b''.join(encode_frame(frame) for frame in frames)
+
+        decoded = decode_frames(data, 20, 6)
+        self.assertEqual((4, 6, 20), decoded.shape)
+        np.testing.assert_array_equal(np.stack(frames), decoded)
+
+        # The decoder accepts any buffer and can write into a preallocated array
+        out = np.zeros((4, 6, 20), dtype=np.uint16)
+        result = decode_frames(memoryview(bytearray(data)), 20, 6, out=out)
+        self.assertIs(out, result)
+        np.testing.assert_array_equal(np.stack(frames), out)
+
+    def test_decode_file(self):
+        frames = [random_frame(seed=seed) for seed in range(2)]
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'frame.out')
+            with open(path, mode='wb') as file:
+                file.write(b''.join(encode_frame(frame) for frame in frames))
+
+            np.testing.assert_array_equal(np.stack(frames), decode_file(path, 20, 6))
+
+    def test_incomplete_data_error(self):
+        data = encode_frame(random_frame())
+        with self.assertRaises(FrameDecodingError):
+            decode_frame(data[:-8], 20, 6)
+
+        with self.assertRaises(FrameDecodingError):
+            decode_frame(data[:-1], 20, 6)
+
+        with self.assertRaises(FrameDecodingError):
+            decode_frame(b'', 20, 6)
+
+    def test_invalid_markers_error(self):
+        data = bytearray(encode_frame(random_frame()))
+        words = np.frombuffer(data, dtype='<u4')
+
+        for index in [0, FRAME_HEADER_WORDS, len(words) - 1]:
+            corrupted = words.copy()
+            corrupted[index] = 0
+            with self.assertRaises(FrameDecodingError):
+                decode_frame(corrupted.tobytes(), 20, 6)
+
+    def test_duplicate_row_error(self):
+        frame = random_frame()
+        with self.assertRaises(FrameDecodingError):
+            decode_frame(encode_frame(frame, row_order=[0, 1, 2, 3, 4, 4]), 20, 6)
+
+    def test_parity_with_ipedec_fixtures(self):
+        """
+        If the numpy decoder produces bit-exact the same frames as ipedec for the captured fixture files
+        """
+        fixture_paths = glob.glob(os.path.join(FIXTURE_PATH, '*.out'))
+        if not fixture_paths:
+            self.skipTest(f'No captured frame dumps in "{FIXTURE_PATH}", see the README.rst of that folder')
+
+        for path in fixture_paths:
+            width, height = map(int, re.search(r'_(\d+)x(\d+)\.out$', path).groups())
+            expected = np.fromfile(f'{path}.raw', dtype=np.uint16).reshape((-1, height, width))
+            np.testing.assert_array_equal(expected, decode_file(path, width, height))
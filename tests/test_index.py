@@ -0,0 +1,294 @@
+import os
+import json
+import datetime
+import sqlite3
+import tempfile
+import unittest
+import threading
+import multiprocessing
+import functools
+from unittest import mock
+from types import SimpleNamespace
+
+from ufotest.index import ReportIndex, TEST, BUILD, SUMMARY_KEYS
+
+
+# HELPER FUNCTIONS
+# ================
+
+def write_report(folder_path: str, index: int) -> dict:
+    """
+    Creates a new report folder with a minimal report.json file within the given *folder_path*. The start time of the
+    report is *index* minutes after a fixed reference time.
+    """
+    start = datetime.datetime(2021, 7, 1) + datetime.timedelta(minutes=index)
+    report = {
+        'name': f'report_{index}',
+        'folder_name': f'report_{index}',
+        'start_iso': start.isoformat(),
+        'test_count': 1,
+        'result_dicts': {'test': {'name': 'test'}}
+    }
+
+    report_folder_path = os.path.join(folder_path, f'report_{index}')
+    os.mkdir(report_folder_path)
+    with open(os.path.join(report_folder_path, 'report.json'), mode='w') as file:
+        json.dump(report, file)
+
+    return report
+
+
+# TESTCASES
+# =========
+
+class TestReportIndex(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.archive_path = os.path.join(self.folder.name, 'archive')
+        self.builds_path = os.path.join(self.folder.name, 'builds')
+        os.mkdir(self.archive_path)
+        os.mkdir(self.builds_path)
+
+        # The index only needs these two methods of the config
+        self.config = SimpleNamespace(
+            get_archive_path=lambda: self.archive_path,
+            get_builds_path=lambda: self.builds_path
+        )
+        self.index_path = os.path.join(self.folder.name, 'reports.db')
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def create_index(self) -> ReportIndex:
+        return ReportIndex(path=self.index_path, config=self.config)
+
+    def test_existing_reports_are_indexed_on_creation(self):
+        # The reports are written in random order, the index has to sort them anyways
+        for index in [3, 1, 4, 0, 2]:
+            write_report(self.archive_path, index)
+        write_report(self.builds_path, 10)
+        # A folder of an unfinished test run does not contain a report yet
+        os.mkdir(os.path.join(self.archive_path, 'unfinished'))
+
+        report_index = self.create_index()
+        self.assertEqual(5, report_index.count(TEST))
+        self.assertEqual(1, report_index.count(BUILD))
+
+        reports = report_index.query(TEST)
+        self.assertListEqual([f'report_{i}' for i in [4, 3, 2, 1, 0]], [report['name'] for report in reports])
+
+    def test_add_and_remove(self):
+        report_index = self.create_index()
+        self.assertEqual(0, report_index.count(TEST))
+
+        report = write_report(self.archive_path, 0)
+        folder_path = os.path.join(self.archive_path, 'report_0')
+        report_index.add(TEST, folder_path, report)
+        self.assertListEqual([report], report_index.query(TEST))
+
+        # Adding the same folder again replaces the existing entry
+        report['name'] = 'changed'
+        report_index.add(TEST, folder_path, report)
+        self.assertListEqual(['changed'], [report['name'] for report in report_index.query(TEST)])
+
+        report_index.remove(TEST, folder_path)
+        self.assertEqual(0, report_index.count(TEST))
+
+    def test_pagination(self):
+        reports = [write_report(self.archive_path, index) for index in range(25)]
+        report_index = self.create_index()
+
+        page = report_index.query(TEST, limit=10)
+        self.assertListEqual(reports[:-11:-1], page)
+
+        page = report_index.query(TEST, limit=10, offset=10)
+        self.assertListEqual(reports[-11:-21:-1], page)
+
+        # The start time of the last report can be used as the cursor for the next page
+        page = report_index.query(TEST, limit=10, before=page[-1]['start_iso'])
+        self.assertListEqual(reports[4::-1], page)
+        self.assertEqual(5, report_index.count(TEST, before=reports[5]['start_iso']))
+
+    def test_rebuild(self):
+        # Reports which are added to the folders manually, are not automatically added to an existing index
+        report_index = self.create_index()
+        self.assertEqual(0, report_index.count(TEST))
+        write_report(self.archive_path, 0)
+        write_report(self.builds_path, 1)
+        self.assertEqual(0, report_index.count(TEST))
+
+        counts = report_index.rebuild()
+        self.assertDictEqual({TEST: 1, BUILD: 1}, counts)
+        self.assertEqual(1, report_index.count(BUILD))
+
+    def test_concurrent_access(self):
+        report_index = self.create_index()
+        reports = [write_report(self.archive_path, index) for index in range(20)]
+
+        def add_reports(offset: int):
+            for report in reports[offset::4]:
+                report_index.add(TEST, os.path.join(self.archive_path, report['name']), report)
+                report_index.query(TEST, limit=5)
+
+        threads = [threading.Thread(target=add_reports, args=(offset, )) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(20, report_index.count(TEST))
+
+    def test_summaries(self):
+        reports = [write_report(self.archive_path, index) for index in range(3)]
+        report_index = self.create_index()
+
+        summaries = report_index.query(TEST, summary=True)
+        self.assertEqual(3, len(summaries))
+        for report, summary in zip(reports[::-1], summaries):
+            self.assertTrue(set(summary.keys()).issubset(SUMMARY_KEYS[TEST]))
+            self.assertEqual(report['name'], summary['name'])
+            # The large result dicts are not part of the summary
+            self.assertNotIn('result_dicts', summary)
+
+    def test_page(self):
+        reports = [write_report(self.archive_path, index) for index in range(25)]
+        report_index = self.create_index()
+
+        page = report_index.page(TEST, page=1, limit=10)
+        self.assertEqual(25, page['count'])
+        self.assertEqual(3, page['pages'])
+        self.assertListEqual([report['name'] for report in reports[:-11:-1]],
+                             [report['name'] for report in page['reports']])
+
+        # Following the cursor yields the same pages as the page numbers
+        page = report_index.page(TEST, limit=10, before=page['next'])
+        self.assertEqual(2, page['page'])
+        self.assertEqual(page['reports'], report_index.page(TEST, page=2, limit=10)['reports'])
+
+        page = report_index.page(TEST, limit=10, before=page['next'])
+        self.assertEqual(3, page['page'])
+        self.assertEqual(5, len(page['reports']))
+        self.assertIsNone(page['next'])
+
+        # A page beyond the last one is simply empty
+        page = report_index.page(TEST, page=4, limit=10)
+        self.assertListEqual([], page['reports'])
+        self.assertIsNone(page['next'])
+
+    def test_page_with_equal_start_times(self):
+        """
+        If reports with the same start time are not skipped, when they fall across the boundary of two pages
+        """
+        for index in range(5):
+            report = write_report(self.archive_path, index)
+            report['start_iso'] = datetime.datetime(2021, 7, 1).isoformat()
+            with open(os.path.join(self.archive_path, f'report_{index}', 'report.json'), mode='w') as file:
+                json.dump(report, file)
+        report_index = self.create_index()
+
+        names = []
+        page = report_index.page(TEST, limit=2)
+        names += [report['name'] for report in page['reports']]
+        while page['next']:
+            page = report_index.page(TEST, limit=2, before=page['next'])
+            names += [report['name'] for report in page['reports']]
+
+        self.assertListEqual([f'report_{i}' for i in [4, 3, 2, 1, 0]], names)
+        self.assertEqual(3, page['page'])
+
+    def test_outdated_schema_is_rebuilt(self):
+        write_report(self.archive_path, 0)
+        report_index = self.create_index()
+        self.assertEqual(1, report_index.count(TEST))
+
+        with report_index.connect() as connection:
+            connection.execute('PRAGMA user_version = 1')
+
+        write_report(self.archive_path, 1)
+        self.assertEqual(2, report_index.count(TEST))
+
+    def test_broken_reports_are_skipped(self):
+        write_report(self.archive_path, 0)
+        write_report(self.builds_path, 1)
+        contents = {'truncated': '{"name": "trunc', 'invalid': 'not json', 'no_start': '{"name": "no_start"}'}
+        for name, content in contents.items():
+            os.mkdir(os.path.join(self.archive_path, name))
+            with open(os.path.join(self.archive_path, name, 'report.json'), mode='w') as file:
+                file.write(content)
+
+        report_index = self.create_index()
+        self.assertEqual(1, report_index.count(TEST))
+        self.assertEqual(1, report_index.count(BUILD))
+        self.assertDictEqual({TEST: 1, BUILD: 1}, report_index.rebuild())
+
+    def test_failed_rebuild_is_rolled_back(self):
+        write_report(self.archive_path, 0)
+        report_index = self.create_index()
+        with report_index.connect() as connection:
+            connection.execute('PRAGMA user_version = 1')
+
+        with mock.patch.object(ReportIndex, '_rebuild', side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                report_index.count(TEST)
+
+        # The existing database is neither removed nor left without its table
+        self.assertTrue(os.path.exists(self.index_path))
+        connection = sqlite3.connect(self.index_path)
+        try:
+            self.assertEqual(1, connection.execute('PRAGMA user_version').fetchone()[0])
+            self.assertEqual(1, connection.execute('SELECT COUNT(*) FROM reports').fetchone()[0])
+        finally:
+            connection.close()
+
+    def test_concurrent_processes_rebuild(self):
+        """
+        If multiple processes, like the workers of gunicorn, can open an outdated index at the same time
+        """
+        for index in range(50):
+            write_report(self.archive_path, index)
+        report_index = self.create_index()
+        with report_index.connect() as connection:
+            connection.execute('PRAGMA user_version = 1')
+
+        def count_reports():
+            for _ in range(5):
+                assert self.create_index().count(TEST) == 50
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=count_reports) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+
+        self.assertListEqual([0] * 4, [process.exitcode for process in processes])
+        self.assertEqual(50, report_index.count(TEST))
+
+    def test_api(self):
+        from ufotest.ci.server import server
+
+        for index in range(5):
+            write_report(self.archive_path, index)
+
+        # The server module uses the global config, whose plugin manager is only created by the CLI
+        config = SimpleNamespace(
+            pm=SimpleNamespace(apply_filter=lambda hook_name, value, *args, **kwargs: value),
+            get_data_or_default=lambda keys, default: default
+        )
+        index_class = functools.partial(ReportIndex, path=self.index_path, config=self.config)
+        with mock.patch('ufotest.ci.server.ReportIndex', new=lambda config: index_class()), \
+                mock.patch('ufotest.ci.server.CONFIG', new=config):
+            client = server.test_client()
+
+            response = client.get('/api/archive?limit=2')
+            self.assertEqual(200, response.status_code)
+            data = response.get_json()
+            self.assertEqual(5, data['count'])
+            self.assertListEqual(['report_4', 'report_3'], [report['name'] for report in data['reports']])
+
+            response = client.get('/api/archive', query_string={'limit': 2, 'before': data['next']})
+            self.assertListEqual(['report_2', 'report_1'], [report['name'] for report in response.get_json()['reports']])
+
+            self.assertEqual(0, client.get('/api/builds').get_json()['count'])
+            self.assertEqual(400, client.get('/api/archive?page=first').status_code)
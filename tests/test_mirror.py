@@ -0,0 +1,123 @@
+import os
+import time
+import tempfile
+import unittest
+import subprocess
+
+from ufotest._testing import benchmark, log_benchmark
+from ufotest.ci.mirror import GitMirror
+from ufotest.exceptions import BuildError
+
+
+# HELPER FUNCTIONS
+# ================
+
+def git(path: str, *args: str) -> str:
+    completed_process = subprocess.run(
+        ['git', '-c', 'user.name=ufotest', '-c', 'user.email=ufotest@example.com', *args],
+        cwd=path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True
+    )
+    return completed_process.stdout.decode().strip()
+
+
+# TESTCASES
+# =========
+
+class TestGitMirror(unittest.TestCase):
+    """
+    The tests use a local bare repository as the "remote" repository, which is updated by pushing commits from a
+    separate working copy.
+    """
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.remote_path = os.path.join(self.folder.name, 'ufo-mock.git')
+        self.work_path = os.path.join(self.folder.name, 'work')
+        self.mirror_path = os.path.join(self.folder.name, 'mirrors', 'ufo-mock.git')
+
+        git(self.folder.name, 'init', '--bare', '--initial-branch', 'main', self.remote_path)
+        git(self.folder.name, 'clone', self.remote_path, self.work_path)
+        git(self.work_path, 'checkout', '-b', 'main')
+        self.commit('camera.bit', 'version 1')
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def commit(self, name: str, content: str) -> str:
+        with open(os.path.join(self.work_path, name), mode='w') as file:
+            file.write(content)
+
+        git(self.work_path, 'add', name)
+        git(self.work_path, 'commit', '-m', content)
+        git(self.work_path, 'push', 'origin', 'main')
+        return git(self.work_path, 'rev-parse', 'HEAD')
+
+    def create_mirror(self) -> GitMirror:
+        return GitMirror(f'file://{self.remote_path}', path=self.mirror_path)
+
+    def test_checkout_commit(self):
+        mirror = self.create_mirror()
+        self.assertFalse(mirror.exists())
+        mirror.update()
+        self.assertTrue(mirror.exists())
+
+        commit = mirror.resolve('FETCH_HEAD', branch='main')
+        self.assertEqual(git(self.work_path, 'rev-parse', 'HEAD'), commit)
+
+        worktree_path = os.path.join(self.folder.name, 'ufo-mock')
+        mirror.add_worktree(worktree_path, commit)
+        with open(os.path.join(worktree_path, 'camera.bit')) as file:
+            self.assertEqual('version 1', file.read())
+
+        mirror.remove_worktree(worktree_path)
+        self.assertFalse(os.path.exists(worktree_path))
+        # The same path can be used for the worktree of the next build
+        mirror.add_worktree(worktree_path, commit)
+
+    def test_update_only_fetches_new_commits(self):
+        mirror = self.create_mirror()
+        mirror.update()
+        first_commit = mirror.resolve('FETCH_HEAD', branch='main')
+        # This object must not be cloned again by the update
+        marker_path = os.path.join(self.mirror_path, 'ufotest.marker')
+        open(marker_path, mode='w').close()
+
+        second_commit = self.commit('camera.bit', 'version 2')
+        self.assertEqual(first_commit, mirror.resolve('FETCH_HEAD', branch='main'))
+
+        mirror.update()
+        self.assertTrue(os.path.exists(marker_path))
+        self.assertEqual(second_commit, mirror.resolve('FETCH_HEAD', branch='main'))
+        # Older commits can still be checked out by their hash
+        self.assertEqual(first_commit, mirror.resolve(first_commit[:8]))
+
+        worktree_path = os.path.join(self.folder.name, 'ufo-mock')
+        mirror.add_worktree(worktree_path, first_commit)
+        with open(os.path.join(worktree_path, 'camera.bit')) as file:
+            self.assertEqual('version 1', file.read())
+
+    def test_unknown_commit(self):
+        mirror = self.create_mirror()
+        mirror.update()
+        with self.assertRaises(BuildError):
+            mirror.resolve('0' * 40)
+
+    @benchmark
+    def test_benchmark_update(self):
+        """
+        Compares the time of the initial clone of the mirror with the time of an update, after a new commit has been
+        pushed. With a local repository of this size, the absolute times are not really meaningful.
+        """
+        mirror = self.create_mirror()
+        start_time = time.time()
+        mirror.update()
+        clone_duration = time.time() - start_time
+
+        self.commit('camera.bit', 'version 2')
+        start_time = time.time()
+        mirror.update()
+        fetch_duration = time.time() - start_time
+
+        log_benchmark('mirror update', {'clone': clone_duration, 'fetch': fetch_duration})
@@ -0,0 +1,275 @@
+import unittest
+
+from ufotest._testing import UfotestTestMixin
+from ufotest.camera import UfoCamera
+from ufotest.exceptions import PciError
+from ufotest.pci import (PciSession,
+                        PciCommand,
+                        ShellPciBackend,
+                        MockPciBackend,
+                        RegisterFile,
+                        RegisterRead,
+                        RegisterSnapshot,
+                        parse_register_output)
+
+
+class TestShellPciBackend(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.backend = ShellPciBackend()
+        self.session = PciSession(self.backend)
+
+    def tearDown(self) -> None:
+        self.session.close()
+
+    def test_execute_single_commands(self):
+        """
+        If commands are executed immediately outside of a batch and if their output and exit code are captured
+        """
+        # The output is exactly the same as if the command would be executed in its own process
+        command = self.session.execute('echo "hello world"')
+        self.assertIsInstance(command, PciCommand)
+        self.assertTrue(command.done)
+        self.assertTrue(command.success)
+        self.assertEqual('hello world\n', command.stdout)
+
+        # Output without a trailing newline and output on stderr
+        command = self.session.execute('printf "no newline"')
+        self.assertEqual('no newline', command.stdout)
+
+        command = self.session.execute('echo "error" >&2; (exit 3)')
+        self.assertEqual(3, command.exit_code)
+        self.assertEqual('error\n', command.stdout)
+
+    def test_single_process_for_all_commands(self):
+        """
+        If all the commands are executed by the same shell process
+        """
+        for i in range(20):
+            command = self.session.execute(f'echo {i}')
+            self.assertEqual(f'{i}\n', command.stdout)
+
+        self.assertEqual(1, self.backend.spawn_count)
+
+    def test_batch(self):
+        """
+        If commands within a batch are only executed at the end of the batch and in the correct order
+        """
+        with self.session.batch():
+            first = self.session.execute('echo 1')
+            self.session.sleep(0.01)
+            second = self.session.execute('echo 2; echo 3')
+            self.assertFalse(first.done)
+
+        self.assertEqual('1\n', first.stdout)
+        self.assertEqual('2\n3\n', second.stdout)
+
+    def test_restart_after_shell_exited(self):
+        self.session.execute('echo 1')
+        # "exit" terminates the persistent shell itself, so the marker can never be read
+        with self.assertRaises(PciError):
+            self.session.execute('exit 0')
+
+        command = self.session.execute('echo 2')
+        self.assertEqual('2\n', command.stdout)
+        self.assertEqual(2, self.backend.spawn_count)
+
+
+class TestMockPciBackend(unittest.TestCase):
+
+    def test_write_and_read_registers(self):
+        backend = MockPciBackend()
+        session = PciSession(backend)
+
+        session.write('0x9000', '0x1f')
+        session.write('9010', 'ff')
+        self.assertDictEqual({0x9000: 0x1f, 0x9010: 0xff}, backend.registers)
+
+        command = session.read('9000', 1)
+        self.assertEqual('9000:  0000001f\n', command.stdout)
+
+        command = session.read('9000', 6)
+        self.assertEqual('9000:  0000001f  00000000  00000000  00000000\n9010:  000000ff  00000000\n', command.stdout)
+
+    def test_batch_is_executed_once(self):
+        backend = MockPciBackend()
+        session = PciSession(backend)
+
+        with session.batch():
+            session.write('9000', '1')
+            # Nested batches are merged into the outer batch
+            with session.batch():
+                session.write('9000', '2')
+            session.read('9000', 1)
+
+        self.assertEqual(1, backend.execute_count)
+        self.assertEqual(3, len(backend.history))
+        self.assertEqual(2, backend.registers[0x9000])
+
+
+class TestUfoCameraPciSession(UfotestTestMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.backend = MockPciBackend()
+        self.config.pm.register_filter('ufo_camera_pci_backend', lambda value: self.backend, 1000)
+        self.camera = UfoCamera(self.config)
+
+    def tearDown(self) -> None:
+        del self.config.pm.filters['ufo_camera_pci_backend']
+
+    def test_camera_uses_session(self):
+        self.assertIs(self.backend, self.camera.pci.backend)
+
+        self.assertTrue(self.camera.pci_write('9000', 'abc'))
+        self.assertEqual(0xabc, self.backend.registers[0x9000])
+        self.assertEqual('9000:  00000abc\n', self.camera.pci_read('9000', 1))
+
+    def test_request_frames_is_one_batch(self):
+        self.camera.request_frames(3)
+        self.assertEqual(1, self.backend.execute_count)
+
+        trigger_writes = [command for command in self.backend.history if command == 'pci -w 0x9040 0x80000209']
+        self.assertEqual(3, len(trigger_writes))
+        # Every frame uses the complete trigger sequence of the original frame script
+        status_reads = [command for command in self.backend.history if command == 'pci -r 9070 -s 4']
+        self.assertEqual(3, len(status_reads))
+        self.assertEqual(0x80000201, self.backend.registers[0x9040])
+
+    def test_exposure_time_sweep(self):
+        """
+        An exposure time sweep only needs one round trip to the backend per exposure time
+        """
+        for exposure_time in range(0, 101, 5):
+            self.camera.set_prop('exposure_time', exposure_time)
+
+        self.assertEqual(21, self.backend.execute_count)
+        self.assertEqual(41550, self.backend.registers[0x9000])
+
+
+class TestRegisterFile(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.backend = MockPciBackend({0x9050: 0xffff0000, 0x9058: 0x11110000})
+        self.registers = RegisterFile(PciSession(self.backend))
+
+    def test_parse_register_output(self):
+        output = '9050:  ffff0000  00000000  11110000  00000000\n9060:  00000001  0000000a\n'
+        self.assertListEqual([0xffff0000, 0, 0x11110000, 0, 1, 10], parse_register_output(output))
+        self.assertListEqual([], parse_register_output(''))
+
+    def test_read_returns_integers(self):
+        read = self.registers.read(0x9050, 4)
+        self.assertTrue(read.done)
+        self.assertListEqual([0xffff0000, 0, 0x11110000, 0], read.values)
+        self.assertEqual(0xffff0000, read.value)
+
+        # String addresses are supported as well
+        self.assertEqual(0x11110000, self.registers.read('9058').value)
+
+    def test_read_within_batch(self):
+        with self.registers.batch():
+            self.registers.write(0x9000, 42)
+            read = self.registers.read(0x9000)
+            with self.assertRaises(PciError):
+                read.value
+
+        self.assertEqual(42, read.value)
+        self.assertEqual(1, self.backend.execute_count)
+
+    def test_consecutive_writes_are_merged(self):
+        with self.registers.batch():
+            for value in range(10):
+                self.registers.write(0x9000, value)
+            self.registers.write(0x9010, 1)
+
+        self.assertListEqual(['pci -w 0x9000 0x00000009', 'pci -w 0x9010 0x00000001'], self.backend.history)
+        self.assertEqual(9, self.registers.merge_count)
+        self.assertEqual(9, self.backend.registers[0x9000])
+
+    def test_writes_are_not_merged_across_other_commands(self):
+        with self.registers.batch():
+            self.registers.write(0x9000, 1)
+            self.registers.sleep(0.1)
+            self.registers.write(0x9000, 2)
+            read = self.registers.read(0x9000)
+            self.registers.write(0x9000, 3)
+
+        self.assertEqual(5, len(self.backend.history))
+        self.assertEqual(2, read.value)
+        self.assertEqual(0, self.registers.merge_count)
+
+    def test_writes_are_not_merged_if_disabled(self):
+        with self.registers.batch():
+            self.registers.write(0x9040, 0x201, merge=False)
+            self.registers.write(0x9040, 0x209, merge=False)
+            self.registers.write(0x9040, 0x201)
+
+        self.assertEqual(3, len(self.backend.history))
+
+    def test_writes_are_not_merged_across_batches(self):
+        for value in [1, 2]:
+            with self.registers.batch():
+                self.registers.write(0x9000, value)
+
+        self.assertEqual(2, len(self.backend.history))
+        self.assertEqual(2, self.backend.execute_count)
+
+    def test_failed_read_raises_error(self):
+        command = PciCommand('pci -r 9000 -s 1')
+        command.exit_code, command.stdout = 1, 'Error: device not found\n'
+        with self.assertRaises(PciError):
+            RegisterRead(0x9000, 1, command).values
+
+        command.exit_code, command.stdout = 0, '9000:  00000001\n'
+        with self.assertRaises(PciError):
+            RegisterRead(0x9000, 4, command).values
+
+
+class TestRegisterSnapshot(unittest.TestCase):
+
+    def test_snapshot_addresses(self):
+        snapshot = RegisterSnapshot(0x9000, [1, 2, 3, 4, 5], timestamp=0)
+        self.assertEqual(1, snapshot[0x9000])
+        self.assertEqual(5, snapshot['9010'])
+        self.assertIn(0x900c, snapshot)
+        self.assertNotIn(0x9014, snapshot)
+        self.assertIsNone(snapshot.get(0x9014))
+        self.assertGreater(snapshot.age, 0)
+
+
+class TestUfoCameraSnapshot(UfotestTestMixin, unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.backend = MockPciBackend({0x9050: 0x0ffff000, 0x9058: 0x11110000})
+        self.config.pm.register_filter('ufo_camera_pci_backend', lambda value: self.backend, 1000)
+        self.camera = UfoCamera(self.config)
+        self.camera.snapshot_ttl = 60
+
+    def tearDown(self) -> None:
+        del self.config.pm.filters['ufo_camera_pci_backend']
+
+    def test_poll_uses_register_values(self):
+        self.assertTrue(self.camera.poll())
+
+        self.backend.registers[0x9058] = 0
+        self.camera.refresh_snapshot()
+        self.assertFalse(self.camera.poll())
+
+    def test_snapshot_is_cached(self):
+        for _ in range(10):
+            self.assertTrue(self.camera.poll())
+        self.assertEqual(1, self.backend.execute_count)
+
+        # Only once the snapshot is older than the ttl, the registers are read again
+        self.camera.snapshot.timestamp -= 61
+        self.camera.poll()
+        self.assertEqual(2, self.backend.execute_count)
+
+        snapshot = self.camera.refresh_snapshot()
+        self.assertEqual(3, self.backend.execute_count)
+        self.assertIs(snapshot, self.camera.get_snapshot())
+        self.assertEqual(UfoCamera.SNAPSHOT_SIZE, len(snapshot.registers))
+
+    def test_poll_failed_read(self):
+        self.backend.execute_command = lambda command: (1, 'Error: no device\n')
+        self.assertFalse(self.camera.poll())
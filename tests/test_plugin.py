@@ -1,8 +1,9 @@
 import os
+import time
 import tempfile
 import unittest
 
-from ufotest._testing import UfotestTestMixin
+from ufotest._testing import UfotestTestMixin, benchmark, log_benchmark
 from ufotest.plugin import PluginManager
 from ufotest.hooks import Action, Filter
 
@@ -66,6 +67,52 @@ class TestPluginManager(unittest.TestCase):
         filtered_value = pm.apply_filter('modify_list', value)
         self.assertEquals([1, 2], filtered_value)
 
+    def test_unregistering_callbacks_works(self):
+        pm = PluginManager()
+
+        def append_one(value: list):
+            value.append(1)
+            return value
+
+        pm.register_filter('modify_list', append_one)
+        pm.register_action('modify_list', append_one)
+        self.assertEqual([1], pm.apply_filter('modify_list', []))
+
+        self.assertTrue(pm.unregister_filter('modify_list', append_one))
+        self.assertFalse(pm.unregister_filter('modify_list', append_one))
+        self.assertEqual([], pm.apply_filter('modify_list', []))
+        self.assertNotIn('modify_list', pm.filters)
+
+        # Deleting the hook from the dict directly has to discard the dispatch tuple as well
+        del pm.actions['modify_list']
+        value = []
+        pm.do_action('modify_list', value)
+        self.assertEqual([], value)
+
+    def test_dispatch_order(self):
+        """
+        If the callbacks are dispatched in the order of their priority and the dispatch tuple is only computed when
+        the callbacks of a hook change
+        """
+        pm = PluginManager()
+        for name, priority in [('a', 5), ('b', 20), ('c', 10), ('d', 20)]:
+            pm.register_filter('order', lambda value, name=name: value + [name], priority=priority)
+
+        # Callbacks with the same priority keep the order of their registration
+        self.assertListEqual(['b', 'd', 'c', 'a'], pm.apply_filter('order', []))
+        dispatch = pm.filters.dispatch['order']
+        pm.apply_filter('order', [])
+        self.assertIs(dispatch, pm.filters.dispatch['order'])
+
+        pm.register_filter('order', lambda value: value + ['e'], priority=15)
+        self.assertListEqual(['b', 'd', 'e', 'c', 'a'], pm.apply_filter('order', []))
+
+        # Invoking a hook without callbacks does not create an entry for it
+        self.assertEqual(1, pm.apply_filter('no_callbacks', 1))
+        pm.do_action('no_callbacks')
+        self.assertNotIn('no_callbacks', pm.filters)
+        self.assertNotIn('no_callbacks', pm.actions)
+
     def test_import_plugin_by_path_works(self):
 
         with tempfile.TemporaryDirectory() as folder_path:
@@ -88,6 +135,52 @@ class TestPluginManager(unittest.TestCase):
             self.assertEquals(125, module.CONSTANT)
 
 
+class TestHookDispatchBenchmark(unittest.TestCase):
+    """
+    Micro benchmarks for the overhead of invoking hooks. The absolute values are not meaningful, these tests are mainly
+    a tool to compare the dispatch with the previous implementation, which sorted the callbacks with every invocation.
+    """
+    ITERATIONS = 20000
+
+    @staticmethod
+    def apply_filter_sorted(pm: PluginManager, hook_name: str, value):
+        # The previous implementation of "PluginManager.apply_filter"
+        if hook_name in pm.filters.keys():
+            callback_specs = sorted(pm.filters[hook_name], key=lambda spec: spec['priority'], reverse=True)
+            callbacks = [spec['callback'] for spec in callback_specs]
+            for callback in callbacks:
+                value = callback(value)
+
+        return value
+
+    def measure(self, function, *args) -> float:
+        start_time = time.perf_counter()
+        for _ in range(self.ITERATIONS):
+            function(*args)
+
+        return (time.perf_counter() - start_time) / self.ITERATIONS
+
+    @benchmark
+    def test_benchmark_dispatch(self):
+        pm = PluginManager()
+        for index in range(10):
+            pm.register_filter('ten_callbacks', lambda value: value, priority=index)
+            pm.register_action('ten_callbacks', lambda: None, priority=index)
+        pm.register_filter('one_callback', lambda value: value)
+
+        durations = {
+            'no-op action':             self.measure(pm.do_action, 'no_callbacks'),
+            'no-op filter':             self.measure(pm.apply_filter, 'no_callbacks', 1),
+            'one filter':               self.measure(pm.apply_filter, 'one_callback', 1),
+            'ten filters':              self.measure(pm.apply_filter, 'ten_callbacks', 1),
+            'ten actions':              self.measure(pm.do_action, 'ten_callbacks'),
+            'one filter (sorted)':      self.measure(self.apply_filter_sorted, pm, 'one_callback', 1),
+            'ten filters (sorted)':     self.measure(self.apply_filter_sorted, pm, 'ten_callbacks', 1),
+        }
+        log_benchmark('hook dispatch', durations)
+        self.assertLess(durations['one filter'], durations['one filter (sorted)'])
+
+
 class TestHookDecorators(UfotestTestMixin, unittest.TestCase):
 
     def test_action_decorator(self):
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from ufotest.progress import ProgressBus, ProgressReader
+from ufotest.progress import RUN_STARTED, TEST_STARTED, FRAME_ACQUIRED, TEST_FINISHED, RUN_FINISHED
+
+
+# TESTCASES
+# =========
+
+class TestProgressBus(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'progress.jsonl')
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def read_events(self):
+        with open(self.path, mode='r') as file:
+            return [json.loads(line) for line in file.read().splitlines()]
+
+    def test_events_are_written(self):
+        bus = ProgressBus(interval=0.01)
+        # Events are ignored while the bus is not started
+        bus.emit(TEST_STARTED, name='ignored')
+
+        bus.start(run='run_1', path=self.path, url='http://localhost/archive/run_1')
+        bus.emit(TEST_STARTED, name='single_frame')
+        for _ in range(5):
+            bus.emit(FRAME_ACQUIRED, count=2)
+        bus.emit(TEST_FINISHED, name='single_frame', exit_code=0, duration=1.0)
+        bus.stop()
+
+        events = self.read_events()
+        self.assertListEqual([RUN_STARTED, TEST_STARTED, FRAME_ACQUIRED, TEST_FINISHED, RUN_FINISHED],
+                             [event['type'] for event in events])
+        self.assertEqual('http://localhost/archive/run_1', events[0]['url'])
+        self.assertEqual(10, events[2]['count'])
+        self.assertTrue(all(event['run'] == 'run_1' for event in events))
+        ids = [event['id'] for event in events]
+        self.assertListEqual(sorted(ids), ids)
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_buffer_is_bounded(self):
+        # With this interval, nothing is written before the bus is stopped
+        bus = ProgressBus(size=3, interval=60)
+        bus.start(run='run_1', path=self.path)
+        for index in range(10):
+            bus.emit(TEST_STARTED, name=f'test_{index}')
+        self.assertEqual(3, len(bus.events))
+        bus.stop()
+
+        events = self.read_events()
+        self.assertListEqual(['test_8', 'test_9'], [event['name'] for event in events[:-1]])
+        self.assertEqual(8, events[-1]['dropped'])
+
+
+class TestProgressReader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'progress.jsonl')
+        self.bus = ProgressBus(interval=0.01)
+
+    def tearDown(self) -> None:
+        self.bus.stop()
+        self.folder.cleanup()
+
+    def test_poll_new_events(self):
+        reader = ProgressReader(path=self.path, interval=0.01)
+        self.assertListEqual([], reader.poll())
+
+        self.bus.start(run='run_1', path=self.path)
+        self.bus.emit(TEST_STARTED, name='single_frame')
+        self.bus.stop()
+        events = reader.poll()
+        self.assertEqual(3, len(events))
+        self.assertListEqual([], reader.poll())
+
+        # A new run replaces the file, which the reader has to notice
+        self.bus.start(run='run_2', path=self.path)
+        self.bus.stop()
+        events = reader.poll()
+        self.assertListEqual(['run_2', 'run_2'], [event['run'] for event in events])
+
+        self.assertListEqual(events[1:], reader.read(after=events[0]['id']))
+
+    def test_wait(self):
+        reader = ProgressReader(path=self.path, interval=0.01)
+        start_time = time.time()
+        self.assertListEqual([], reader.wait(timeout=0.1))
+        self.assertLess(time.time() - start_time, 1)
+
+        self.bus.start(run='run_1', path=self.path)
+        events = reader.wait(timeout=5)
+        self.assertEqual(RUN_STARTED, events[0]['type'])
+
+    def test_server_routes(self):
+        from ufotest.ci.server import server
+
+        self.bus.start(run='run_1', path=self.path)
+        self.bus.emit(TEST_STARTED, name='single_frame')
+        self.bus.stop()
+        events = ProgressReader(path=self.path).read()
+
+        with mock.patch('ufotest.ci.server.ProgressReader', new=lambda: ProgressReader(path=self.path)), \
+                mock.patch('ufotest.ci.server.PROGRESS_TIMEOUT', new=0.2):
+            client = server.test_client()
+
+            response = client.get(f'/api/progress?after={events[0]["id"]}&timeout=0')
+            self.assertEqual(200, response.status_code)
+            self.assertListEqual(events[1:], response.get_json()['events'])
+
+            response = client.get('/progress/stream', headers={'Last-Event-ID': str(events[1]['id'])})
+            self.assertEqual('text/event-stream', response.mimetype)
+            data = response.get_data(as_text=True)
+            self.assertIn(f'id: {events[2]["id"]}\n', data)
+            self.assertNotIn(f'id: {events[1]["id"]}\n', data)
+
+            response = client.get('/api/progress?after=abc')
+            self.assertEqual(400, response.status_code)
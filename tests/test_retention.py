@@ -0,0 +1,136 @@
+import os
+import json
+import tarfile
+import datetime
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from ufotest.index import ReportIndex, TEST, BUILD
+from ufotest.usage import DiskUsageTracker, ARCHIVE
+from ufotest.retention import RetentionPolicy, ArchiveCollector, KEEP, COMPACT, DELETE
+from ufotest.retention import compact_folder, is_compacted, COMPACTED_FILE_NAME
+
+NOW = datetime.datetime(2021, 7, 1, 12, 0, 0)
+
+
+# HELPER FUNCTIONS
+# ================
+
+def create_summary(days: float, failing: bool = False) -> dict:
+    return {
+        'start_iso': (NOW - datetime.timedelta(days=days)).isoformat(),
+        'test_count': 10,
+        'successful_count': 5 if failing else 10
+    }
+
+
+def create_test_folder(folder_path: str, summary: dict) -> None:
+    os.makedirs(os.path.join(folder_path, 'figures'))
+    with open(os.path.join(folder_path, 'report.json'), mode='w') as file:
+        json.dump({**summary, 'folder_name': os.path.basename(folder_path)}, file)
+    with open(os.path.join(folder_path, 'report.html'), mode='w') as file:
+        file.write('<html></html>')
+    with open(os.path.join(folder_path, 'figures', 'frame.png'), mode='wb') as file:
+        file.write(bytes(10000))
+
+
+# TESTCASES
+# =========
+
+class TestRetentionPolicy(unittest.TestCase):
+
+    def test_recent_reports_are_kept(self):
+        policy = RetentionPolicy(keep_last=2, compact_after_days=30)
+        summaries = [create_summary(days) for days in [100, 200, 300]]
+        self.assertListEqual([KEEP, KEEP, COMPACT], policy.decide(TEST, summaries, now=NOW))
+
+        summaries = [create_summary(days) for days in [1, 2, 3, 10]]
+        self.assertListEqual([KEEP] * 4, policy.decide(TEST, summaries, now=NOW))
+
+    def test_one_report_per_day(self):
+        policy = RetentionPolicy(keep_last=0, compact_after_days=30, keep_failing_days=90)
+        summaries = [
+            create_summary(40.1),
+            create_summary(40.2),
+            create_summary(40.3, failing=True),
+            create_summary(100.1),
+            create_summary(100.2, failing=True),
+            create_summary(100.3),
+        ]
+        self.assertListEqual(
+            [COMPACT, DELETE, COMPACT, COMPACT, DELETE, DELETE],
+            policy.decide(TEST, summaries, now=NOW)
+        )
+
+    def test_delete_after_days(self):
+        policy = RetentionPolicy(keep_last=1, compact_after_days=30, delete_after_days=365)
+        summaries = [create_summary(days) for days in [400, 500, 40]]
+        self.assertListEqual([KEEP, DELETE, COMPACT], policy.decide(BUILD, summaries, now=NOW))
+
+
+class TestCompactFolder(unittest.TestCase):
+
+    def test_compact_folder(self):
+        with tempfile.TemporaryDirectory() as path:
+            folder_path = os.path.join(path, 'run')
+            create_test_folder(folder_path, create_summary(0))
+            self.assertFalse(is_compacted(folder_path))
+
+            compact_folder(folder_path)
+            self.assertTrue(is_compacted(folder_path))
+            self.assertSetEqual({'report.json', 'report.html', COMPACTED_FILE_NAME}, set(os.listdir(folder_path)))
+            with tarfile.open(os.path.join(folder_path, COMPACTED_FILE_NAME)) as tarball:
+                self.assertIn('figures/frame.png', tarball.getnames())
+
+
+class TestArchiveCollector(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = self.folder.name
+        for name in ['archive', 'builds', 'static']:
+            os.mkdir(os.path.join(self.path, name))
+
+        self.config = SimpleNamespace(
+            get_path=lambda: self.path,
+            get_archive_path=lambda: os.path.join(self.path, 'archive'),
+            get_builds_path=lambda: os.path.join(self.path, 'builds')
+        )
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def test_collect(self):
+        index = ReportIndex(path=os.path.join(self.path, 'reports.db'), config=self.config)
+        tracker = DiskUsageTracker(path=os.path.join(self.path, 'usage.db'), config=self.config)
+        archive_path = self.config.get_archive_path()
+        # Noon, so that the reports of the same day are not split up by midnight
+        now = datetime.datetime.combine(datetime.date.today(), datetime.time(12))
+        # Three reports from today and three reports from the same day 40 days ago
+        for days, name in [(0, 'run_1'), (0.01, 'run_2'), (0.02, 'run_3'),
+                           (40, 'run_4'), (40.01, 'run_5'), (40.02, 'run_6')]:
+            folder_path = os.path.join(archive_path, name)
+            summary = {**create_summary(0), 'start_iso': (now - datetime.timedelta(days=days)).isoformat()}
+            create_test_folder(folder_path, summary)
+            index.add(TEST, folder_path, summary)
+
+        policy = RetentionPolicy(keep_last=1, compact_after_days=30)
+        collector = ArchiveCollector(config=self.config, policy=policy, index=index, tracker=tracker)
+
+        results = collector.collect(dry_run=True, collect_blobs=False)
+        self.assertEqual(6, len(os.listdir(archive_path)))
+        self.assertEqual({KEEP: 3, COMPACT: 1, DELETE: 2, 'freed': 0}, results[TEST])
+
+        tracker.refresh()
+        archive_size = tracker.totals()[ARCHIVE]
+
+        results = collector.collect(collect_blobs=False)
+        self.assertSetEqual({'run_1', 'run_2', 'run_3', 'run_4'}, set(os.listdir(archive_path)))
+        self.assertTrue(is_compacted(os.path.join(archive_path, 'run_4')))
+        self.assertEqual(4, index.count(TEST))
+        self.assertEqual(archive_size - results[TEST]['freed'], tracker.totals()[ARCHIVE])
+
+        # The compacted report is not compacted again
+        results = collector.collect(collect_blobs=False)
+        self.assertEqual({KEEP: 4, COMPACT: 0, DELETE: 0, 'freed': 0}, results[TEST])
@@ -1,18 +1,46 @@
 """
 Unittests for the testing functionality of ufotest.
 """
+import os
+import time
 import inspect
+import tempfile
+import logging
 import unittest
+import threading
 import json
+import datetime
+from types import SimpleNamespace
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
 
 from ufotest.config import CONFIG
-from ufotest.util import random_string
+from ufotest.util import random_string, get_template, HTMLTemplateMixin
 from ufotest.testing import (TestRunner,
                              TestContext,
                              AbstractTest,
-                             TestReport)
-from ufotest.testing import ImageTestResult, MessageTestResult, AssertionTestResult, CombinedTestResult
-from ufotest._testing import UfotestTestMixin
+                             TestReport,
+                             TestSuite,
+                             FigureRenderer,
+                             FigureSpec,
+                             REPORT_SCHEMA_VERSION,
+                             migrate_report,
+                             recompile_report,
+                             get_recompile_fingerprint,
+                             RECOMPILED,
+                             UNCHANGED,
+                             FILTERED)
+from ufotest.testing import (ImageTestResult,
+                             FigureTestResult,
+                             MessageTestResult,
+                             AssertionTestResult,
+                             DictTestResult,
+                             DictListTestResult,
+                             CombinedTestResult)
+from ufotest.index import TEST
+from ufotest._testing import UfotestTestMixin, benchmark, log_benchmark
 
 
 # HELPER FUNCTIONS
@@ -25,6 +53,75 @@ def get_message_test_result(exit_code: int = 0):
     )
 
 
+def create_line_figure(values: list) -> plt.Figure:
+    fig, ax = plt.subplots(nrows=1, ncols=1)
+    ax.plot(values)
+    return fig
+
+
+def create_broken_figure() -> plt.Figure:
+    raise ValueError('broken figure')
+
+
+def create_legacy_dict(result) -> dict:
+    """
+    Returns the dict of the given *result* in the format of the report schema version 1, which contained the template
+    string and the rendered html of every (nested) result.
+    """
+    data = result.to_dict()
+    data.pop(HTMLTemplateMixin.TEMPLATE_REFERENCE_FIELD_NAME, None)
+    data[HTMLTemplateMixin.TEMPLATE_FIELD_NAME] = result.get_html_template_string()
+    data['html'] = result.to_html()
+    if isinstance(result, CombinedTestResult):
+        data['result_dicts'] = [create_legacy_dict(test_result) for test_result in result.test_results]
+
+    return data
+
+
+def create_results() -> dict:
+    return {
+        'message':      MessageTestResult(0, 'Hello World'),
+        'dict':         DictTestResult(1, {'frames': 10, 'errors': 2}),
+        'dict_list':    DictListTestResult(0, {'a': {'_title': 'Script A', 'path': '/a.sh'}}),
+        'image':        ImageTestResult(0, '/tmp/image.png', 'my description', '/archive/report'),
+        'combined':     CombinedTestResult(
+            MessageTestResult(0, 'Nested'),
+            CombinedTestResult(DictTestResult(0, {'depth': 2}))
+        )
+    }
+
+
+def create_legacy_report(name: str = 'test_run', start_iso: str = '2021-07-01T12:00:00') -> dict:
+    """
+    Returns the dict of a test report in the format of the report schema version 1.
+    """
+    results = create_results()
+    result_dicts = {test_name: create_legacy_dict(result) for test_name, result in results.items()}
+    # The dict list result used to render its template file into a new template string
+    result_dicts['dict_list'][HTMLTemplateMixin.TEMPLATE_FIELD_NAME] = get_template(
+        'dict_list_test_result.html'
+    ).render({'this': results['dict_list']})
+
+    return {
+        HTMLTemplateMixin.TEMPLATE_FIELD_NAME: TestReport.get_class_html_template_string(),
+        'platform':             'Linux',
+        'version':              '1.2.0',
+        'sensor':               '2048 x 2048 pixels',
+        'name':                 name,
+        'folder_name':          name,
+        'folder_path':          f'/tmp/{name}',
+        'start':                '01.07.2021 12:00',
+        'start_iso':            start_iso,
+        'end':                  '01.07.2021 12:10',
+        'duration':             10,
+        'test_count':           len(results),
+        'successful_count':     len(results) - 1,
+        'success_ratio':        0.8,
+        'test_descriptions':    {test_name: f'The {test_name} test' for test_name in results},
+        'result_dicts':         result_dicts
+    }
+
+
 # TESTCASES
 # =========
 
@@ -99,6 +196,171 @@ class TestTestRunner(UfotestTestMixin, unittest.TestCase):
             #self.assertEqual(0, test_report.error_count)
 
 
+class TestTestSuite(UfotestTestMixin, unittest.TestCase):
+
+    DURATION = 0.2
+
+    def setUp(self) -> None:
+        self.original_workers = self.config.data['tests'].get('workers')
+        self.config.data['tests']['workers'] = 4
+
+        # The suite only needs these attributes of the test runner. A real runner would set up the camera.
+        self.test_runner = SimpleNamespace(
+            logger=logging.getLogger('test'),
+            config=self.config,
+            context=None,
+            camera=None,
+            camera_lock=threading.Lock()
+        )
+
+        self.camera_users = []
+        self.max_camera_users = 0
+
+    def tearDown(self) -> None:
+        self.config.data['tests']['workers'] = self.original_workers
+
+    def create_test_class(self, test_name: str, camera: bool, pyplot: bool = False):
+        test_case = self
+
+        class SleepTest(AbstractTest):
+
+            name = test_name
+            requires_camera = camera
+            uses_pyplot = pyplot
+
+            def run(self):
+                if TestSuite.is_serial(self.__class__):
+                    test_case.camera_users.append(self.name)
+                    test_case.max_camera_users = max(test_case.max_camera_users, len(test_case.camera_users))
+                time.sleep(test_case.DURATION)
+                if TestSuite.is_serial(self.__class__):
+                    test_case.camera_users.remove(self.name)
+
+                return MessageTestResult(0, self.name)
+
+        return SleepTest
+
+    def test_results_in_suite_order(self):
+        tests = [
+            self.create_test_class('camera_1', True),
+            self.create_test_class('other_1', False),
+            self.create_test_class('camera_2', True),
+            self.create_test_class('other_2', False),
+            self.create_test_class('other_3', False),
+        ]
+        test_suite = TestSuite(self.test_runner, tests, 'mixed')
+
+        start_time = time.time()
+        results = test_suite.execute_all()
+        duration = time.time() - start_time
+
+        self.assertListEqual(['camera_1', 'other_1', 'camera_2', 'other_2', 'other_3'], list(results.keys()))
+        self.assertListEqual(list(results.keys()), [result.message for result in results.values()])
+
+        # The camera tests are never executed at the same time, but the others run in parallel to them
+        self.assertEqual(1, self.max_camera_users)
+        self.assertLess(duration, 4 * self.DURATION)
+
+    def test_pyplot_tests_not_parallel(self):
+        tests = [
+            self.create_test_class('camera_1', True),
+            self.create_test_class('pyplot_1', False, pyplot=True),
+            self.create_test_class('pyplot_2', False, pyplot=True),
+            self.create_test_class('other_1', False),
+        ]
+        test_suite = TestSuite(self.test_runner, tests, 'pyplot')
+
+        results = test_suite.execute_all()
+        self.assertListEqual(['camera_1', 'pyplot_1', 'pyplot_2', 'other_1'], list(results.keys()))
+        # The tests which use pyplot are never executed at the same time as a camera test or each other
+        self.assertEqual(1, self.max_camera_users)
+
+    def test_sequential_with_single_worker(self):
+        self.config.data['tests']['workers'] = 1
+        tests = [self.create_test_class(f'other_{i}', False) for i in range(3)]
+        test_suite = TestSuite(self.test_runner, tests, 'sequential')
+
+        start_time = time.time()
+        results = test_suite.execute_all()
+        self.assertGreaterEqual(time.time() - start_time, 3 * self.DURATION)
+        self.assertEqual(3, len(results))
+
+
+class TestFigureRenderer(UfotestTestMixin, unittest.TestCase):
+
+    PNG_SIGNATURE = b'\x89PNG'
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        # The worker processes need a valid working directory, which may have been removed by previous tests
+        try:
+            self.original_cwd = os.getcwd()
+        except FileNotFoundError:
+            self.original_cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(self.folder.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self.original_cwd)
+        self.folder.cleanup()
+
+    def assertPngFile(self, path: str):
+        with open(path, mode='rb') as file:
+            self.assertEqual(self.PNG_SIGNATURE, file.read(4))
+
+    def test_render_in_background(self):
+        renderer = FigureRenderer(workers=2)
+        try:
+            paths = [os.path.join(self.folder.name, f'{i}.png') for i in range(3)]
+            futures = [renderer.render(create_line_figure([1, 2, i]), path) for i, path in enumerate(paths)]
+            # The figures are closed right after they have been submitted
+            self.assertEqual(0, len(plt.get_fignums()))
+
+            spec_path = os.path.join(self.folder.name, 'spec.png')
+            renderer.render(FigureSpec(create_line_figure, [3, 2, 1]), spec_path)
+
+            self.assertDictEqual({}, renderer.wait())
+            self.assertTrue(all(future.done() for future in futures))
+            for path in paths + [spec_path]:
+                self.assertPngFile(path)
+        finally:
+            renderer.shutdown()
+
+    def test_render_synchronously(self):
+        renderer = FigureRenderer(workers=0)
+        path = os.path.join(self.folder.name, 'figure.png')
+        future = renderer.render(create_line_figure([1, 2, 3]), path)
+
+        self.assertTrue(future.done())
+        self.assertPngFile(path)
+
+    def test_render_error(self):
+        renderer = FigureRenderer(workers=1)
+        try:
+            path = os.path.join(self.folder.name, 'broken.png')
+            future = renderer.render(FigureSpec(create_broken_figure), path)
+
+            errors = renderer.wait()
+            self.assertListEqual([path], list(errors.keys()))
+            self.assertIsInstance(future.exception(), ValueError)
+        finally:
+            renderer.shutdown()
+
+    def test_figure_test_result(self):
+        # The result only needs these attributes of the test context
+        test_context = SimpleNamespace(
+            get_path=lambda *paths: os.path.join(self.folder.name, *paths),
+            relative_url='archive/test',
+            figure_renderer=FigureRenderer(workers=1)
+        )
+        try:
+            result = FigureTestResult(0, test_context, create_line_figure([1, 2, 3]), 'description')
+            self.assertEqual(result.figure_path, result.wait())
+            self.assertTrue(result.rendered)
+            self.assertPngFile(result.file_path)
+        finally:
+            test_context.figure_renderer.shutdown()
+
+
 class TestTestReport(UfotestTestMixin, unittest.TestCase):
 
     def test_construction(self):
@@ -192,6 +454,122 @@ class TestAssertionTestResult(UfotestTestMixin, unittest.TestCase):
         self.assertEqual(1, test_result.error_count)
 
 
+class TestTestReportSave(UfotestTestMixin, unittest.TestCase):
+
+    FIGURE_COUNT = 20
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        try:
+            self.original_cwd = os.getcwd()
+        except FileNotFoundError:
+            self.original_cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(self.folder.name)
+
+        self.renderer = FigureRenderer(workers=2)
+        # Starting the worker processes takes some time, which should not be part of the measurements
+        self.renderer.render(FigureSpec(create_line_figure, [1, 2, 3]), os.path.join(self.folder.name, 'warmup.png'))
+        self.renderer.wait()
+
+    def tearDown(self) -> None:
+        self.renderer.shutdown()
+        os.chdir(self.original_cwd)
+        self.folder.cleanup()
+
+    def create_report(self, name: str) -> TestReport:
+        folder_path = os.path.join(self.folder.name, name)
+        os.mkdir(folder_path)
+        start_datetime = datetime.datetime.now()
+        test_context = SimpleNamespace(
+            config=self.config,
+            platform='Linux',
+            version='2.0.0',
+            name=name,
+            folder_name=name,
+            folder_path=folder_path,
+            relative_url=f'archive/{name}',
+            start_datetime=start_datetime,
+            end_datetime=start_datetime + datetime.timedelta(minutes=10),
+            hardware_version='1', firmware_version='1', sensor_version='1',
+            figure_renderer=self.renderer,
+            logger=logging.getLogger('test'),
+            get_path=lambda *parts: os.path.join(folder_path, *parts),
+            results={},
+            tests={}
+        )
+        for index in range(self.FIGURE_COUNT):
+            spec = FigureSpec(create_line_figure, list(range(index, index + 10000)))
+            test_context.results[f'test_{index}'] = CombinedTestResult(
+                FigureTestResult(0, test_context, spec, f'Figure {index}'),
+                DictTestResult(0, {'index': index, 'frames': 100})
+            )
+            test_context.tests[f'test_{index}'] = SimpleNamespace(description=f'The test {index}')
+
+        return TestReport(test_context)
+
+    def test_save(self):
+        with mock.patch('ufotest.testing.ReportIndex') as report_index_class, \
+                mock.patch('ufotest.testing.DiskUsageTracker'):
+            report_index = report_index_class.return_value
+            report = self.create_report('report')
+            report.save(report.folder_path)
+
+        for name, content in [('report.html', report.to_html()), ('report.json', report.to_json())]:
+            with open(os.path.join(report.folder_path, name), mode='r') as file:
+                self.assertEqual(content, file.read())
+        report_index.add.assert_called_with(TEST, report.folder_path, report.to_dict())
+        self.assertTrue(all(os.path.exists(result.test_results[0].file_path) for result in report.results.values()))
+
+    def test_failed_write_is_not_indexed(self):
+        def write_file(path: str, content: str):
+            if path.endswith('report.json'):
+                raise OSError('No space left on device')
+            with open(path, mode='w') as file:
+                file.write(content)
+
+        with mock.patch('ufotest.testing.ReportIndex') as report_index_class, \
+                mock.patch('ufotest.testing.DiskUsageTracker'), \
+                mock.patch('ufotest.testing.write_file', new=write_file):
+            report = self.create_report('report')
+            with self.assertRaises(OSError):
+                report.save(report.folder_path)
+
+        report_index_class.return_value.add.assert_not_called()
+
+    @benchmark
+    def test_benchmark_save(self):
+        """
+        Compares the time it takes to save a report with many figures, which are still being rendered, with the
+        previous implementation, which first waited for all the figures and then rendered and wrote each output after
+        the other.
+        """
+        def save_sequentially(report: TestReport, folder_path: str):
+            report.context.figure_renderer.wait()
+            for name, content in [('report.md', report.to_markdown()),
+                                  ('report.html', report.to_html()),
+                                  ('report.json', report.to_json())]:
+                with open(os.path.join(folder_path, name), mode='w') as file:
+                    file.write(content)
+            report_index.add(TEST, folder_path, report.to_dict())
+
+        durations = {}
+        with mock.patch('ufotest.testing.ReportIndex') as report_index_class, \
+                mock.patch('ufotest.testing.DiskUsageTracker'):
+            report_index = report_index_class.return_value
+
+            start_time = time.time()
+            report = self.create_report('before')
+            save_sequentially(report, report.folder_path)
+            durations['before'] = time.time() - start_time
+
+            start_time = time.time()
+            report = self.create_report('after')
+            report.save(report.folder_path)
+            durations['after'] = time.time() - start_time
+
+        log_benchmark('save report', durations)
+
+
 class TestImageTestResult(unittest.TestCase):
 
     def setUp(self):
@@ -291,3 +669,129 @@ class TestCombinedTestResult(unittest.TestCase):
         self.assertIsInstance(html, str)
         self.assertNotEqual(html, '')
         self.assertIn('Hello', html)
+
+
+class TestReportSchema(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG.reload()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_result_dicts_reference_templates(self):
+        for name, result in create_results().items():
+            data = json.loads(json.dumps(result.to_dict()))
+            self.assertDictEqual(result.get_template_reference(), data['_template'])
+            self.assertNotIn('_html_template', data)
+            self.assertNotIn('html', data)
+            # Rendering from the loaded dict has to produce exactly the same html as the instance itself
+            self.assertEqual(result.to_html(), HTMLTemplateMixin.html_from_dict(data), name)
+
+        with self.assertRaises(KeyError):
+            HTMLTemplateMixin.html_from_dict({'_template': {'name': 'ufotest.plugin.Missing', 'version': 1}})
+
+    def test_migrated_report_renders_the_same(self):
+        legacy_report = create_legacy_report()
+        legacy_html = HTMLTemplateMixin.html_from_dict(legacy_report)
+
+        report = TestReport.migrate_dict(json.loads(json.dumps(legacy_report)))
+        self.assertEqual(REPORT_SCHEMA_VERSION, report['schema_version'])
+        self.assertEqual(legacy_html, HTMLTemplateMixin.html_from_dict(report))
+
+        report_json = json.dumps(report)
+        self.assertNotIn('"html"', report_json)
+        self.assertLess(len(report_json), len(json.dumps(legacy_report)) / 2)
+        # The pre-rendered template of the dict list result is not the template of the class anymore
+        self.assertIn('_html_template', report['result_dicts']['dict_list'])
+        self.assertIn('_template', report['result_dicts']['combined']['result_dicts'][1]['result_dicts'][0])
+
+    def test_migrate_report_folder(self):
+        folder_path = os.path.join(self.folder.name, 'test_run')
+        os.mkdir(folder_path)
+        json_path = os.path.join(folder_path, 'report.json')
+        with open(json_path, mode='w') as file:
+            json.dump(create_legacy_report(), file)
+
+        report = migrate_report(folder_path)
+        with open(json_path, mode='r') as file:
+            self.assertDictEqual(report, json.load(file))
+
+        # The report already uses the current schema
+        self.assertIsNone(migrate_report(folder_path))
+
+        # The report html is rendered on demand, if it does not exist
+        from ufotest.ci.server import server
+        with mock.patch('ufotest.ci.server.ARCHIVE_PATH', new=self.folder.name):
+            response = server.test_client().get('/archive/test_run/report.html')
+            self.assertEqual(200, response.status_code)
+            self.assertIn('Hello World', response.get_data(as_text=True))
+
+
+class TestRecompileReport(unittest.TestCase):
+
+    def setUp(self):
+        CONFIG.reload()
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def create_archive(self, count: int) -> list:
+        folder_paths = []
+        report = TestReport.migrate_dict(create_legacy_report())
+        for index in range(count):
+            folder_path = os.path.join(self.folder.name, f'test_run_{index:04d}')
+            os.mkdir(folder_path)
+            with open(os.path.join(folder_path, 'report.json'), mode='w') as file:
+                json.dump({**report, 'start_iso': f'2021-07-{index % 28 + 1:02d}T12:00:00'}, file)
+            folder_paths.append(folder_path)
+
+        return folder_paths
+
+    def test_unchanged_reports_are_skipped(self):
+        folder_path = self.create_archive(1)[0]
+        fingerprint = get_recompile_fingerprint(CONFIG)
+
+        self.assertEqual(RECOMPILED, recompile_report(folder_path, fingerprint))
+        with open(os.path.join(folder_path, 'report.html'), mode='r') as file:
+            self.assertIn('Hello World', file.read())
+        self.assertEqual(UNCHANGED, recompile_report(folder_path, fingerprint))
+        self.assertEqual(RECOMPILED, recompile_report(folder_path, fingerprint, force=True))
+        self.assertEqual(FILTERED, recompile_report(folder_path, fingerprint, since='2021-08-01T00:00:00'))
+
+        # A different url changes the fingerprint
+        CONFIG['ci']['port'] = '8901'
+        self.assertNotEqual(fingerprint, get_recompile_fingerprint(CONFIG))
+        self.assertEqual(RECOMPILED, recompile_report(folder_path, get_recompile_fingerprint(CONFIG)))
+
+    @benchmark
+    def test_benchmark_recompile(self):
+        """
+        Recompiles a synthetic archive once serially, once with a process pool and once more, when nothing has changed.
+        """
+        folder_paths = self.create_archive(200)
+        fingerprint = get_recompile_fingerprint(CONFIG)
+
+        durations = {}
+        start_time = time.time()
+        for folder_path in folder_paths:
+            recompile_report(folder_path, fingerprint, force=True)
+        durations['serial'] = time.time() - start_time
+
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(recompile_report, folder_paths, [fingerprint] * len(folder_paths),
+                                        [None] * len(folder_paths), [True] * len(folder_paths)))
+        durations['parallel'] = time.time() - start_time
+        self.assertListEqual([RECOMPILED] * len(folder_paths), results)
+
+        start_time = time.time()
+        results = [recompile_report(folder_path, fingerprint) for folder_path in folder_paths]
+        durations['unchanged'] = time.time() - start_time
+        self.assertListEqual([UNCHANGED] * len(folder_paths), results)
+
+        log_benchmark('recompile reports', durations)
+        self.assertLess(durations['unchanged'], durations['serial'])
+
@@ -0,0 +1,237 @@
+import os
+import time
+import stat
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from ufotest._testing import UfotestTestMixin, benchmark, log_benchmark
+from ufotest.camera import UfoCamera
+from ufotest.exceptions import PciError
+from ufotest.transport import FileFrameTransport, PipeFrameTransport, FRAME_TRANSPORTS
+
+# These are replacements for the "pci" and "ipedec" commands, which replay a previously recorded frame dump. The dump
+# used in these tests is already a decoded .raw image, which is why the fake "ipedec" only needs to copy the data.
+FAKE_PCI = """#!/bin/sh
+for last; do :; done
+if [ "$2" = "dma0" ]; then
+    cat "{dump_path}" >> "$last"
+fi
+exit {exit_code}
+"""
+
+FAKE_IPEDEC = """#!/bin/sh
+cp "$5" "$5.raw"
+"""
+
+
+class TestFrameTransport(UfotestTestMixin, unittest.TestCase):
+
+    WIDTH = 128
+    HEIGHT = 96
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.bin_path = os.path.join(self.folder.name, 'bin')
+        os.mkdir(self.bin_path)
+
+        # -- recording a frame dump
+        random_state = np.random.RandomState(1)
+        self.frame = random_state.randint(0, 4096, size=(self.HEIGHT, self.WIDTH)).astype(np.uint16)
+        self.dump_path = os.path.join(self.folder.name, 'dump.raw')
+        self.frame.tofile(self.dump_path)
+
+        self.write_command('pci', FAKE_PCI.format(dump_path=self.dump_path, exit_code=0))
+        self.write_command('ipedec', FAKE_IPEDEC)
+
+        self.original_path = os.environ['PATH']
+        os.environ['PATH'] = f'{self.bin_path}:{self.original_path}'
+
+        camera_data = self.config.data['camera'][self.config.data['camera']['model']]
+        self.original_dimensions = camera_data['sensor_width'], camera_data['sensor_height']
+        camera_data['sensor_width'], camera_data['sensor_height'] = self.WIDTH, self.HEIGHT
+
+    def tearDown(self) -> None:
+        os.environ['PATH'] = self.original_path
+
+        camera_data = self.config.data['camera'][self.config.data['camera']['model']]
+        camera_data['sensor_width'], camera_data['sensor_height'] = self.original_dimensions
+
+        self.folder.cleanup()
+
+    def write_command(self, name: str, content: str):
+        path = os.path.join(self.bin_path, name)
+        with open(path, mode='w') as file:
+            file.write(content)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+    def create_camera(self, transport_class) -> UfoCamera:
+        camera = UfoCamera(self.config)
+        camera.data_path = os.path.join(self.folder.name, 'frame')
+        camera.frame_path = camera.data_path + '.raw'
+        camera.transport = transport_class(camera)
+        return camera
+
+    # -- The actual test cases
+
+    def test_transports_are_registered(self):
+        self.assertIs(FileFrameTransport, FRAME_TRANSPORTS['file'])
+        self.assertIs(PipeFrameTransport, FRAME_TRANSPORTS['pipe'])
+
+    def test_file_transport_returns_recorded_frame(self):
+        camera = self.create_camera(FileFrameTransport)
+        self.assertEqual('file', camera.get_prop('frame_transport'))
+
+        frame = camera.get_frame()
+        np.testing.assert_array_equal(self.frame, frame)
+
+    def test_pipe_transport_returns_recorded_frame(self):
+        camera = self.create_camera(PipeFrameTransport)
+        self.assertEqual('pipe', camera.get_prop('frame_transport'))
+
+        # Receiving multiple frames makes sure that the reused buffer does not accumulate the data of previous frames
+        for _ in range(3):
+            frame = camera.get_frame()
+            np.testing.assert_array_equal(self.frame, frame)
+
+    def test_pipe_transport_grows_buffer(self):
+        camera = self.create_camera(PipeFrameTransport)
+        camera.transport.buffer = bytearray(10)
+
+        frame = camera.get_frame()
+        np.testing.assert_array_equal(self.frame, frame)
+
+    def test_pipe_transport_writes_into_preallocated_frame(self):
+        camera = self.create_camera(PipeFrameTransport)
+        out = np.zeros(shape=(self.HEIGHT, self.WIDTH), dtype=np.uint16)
+
+        camera.request_frame()
+        frame = camera.transport.receive(out)
+        self.assertIs(out, frame)
+        np.testing.assert_array_equal(self.frame, out)
+
+        with self.assertRaises(ValueError):
+            camera.transport.receive(np.zeros(shape=(10, 10), dtype=np.uint16))
+
+    def test_pipe_transport_large_stderr(self):
+        """
+        If the pipe transport does not block, when pci writes more than a pipe buffer to stderr
+        """
+        self.write_command('pci', (
+            '#!/bin/sh\n'
+            'head -c 262144 /dev/zero >&2\n'
+            + FAKE_PCI.format(dump_path=self.dump_path, exit_code=0).split('\n', 1)[1]
+        ))
+        camera = self.create_camera(PipeFrameTransport)
+
+        frames = []
+        thread = threading.Thread(target=lambda: frames.append(camera.get_frame()), daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        np.testing.assert_array_equal(self.frame, frames[0])
+
+    def test_pipe_transport_needs_pci(self):
+        with mock.patch.dict(self.config.data['camera'], {'frame_transport': 'pipe'}), \
+                mock.patch('shutil.which', return_value=None):
+            camera = UfoCamera(self.config)
+            self.assertIsInstance(camera.transport, FileFrameTransport)
+
+    def test_pipe_transport_pci_error(self):
+        self.write_command('pci', FAKE_PCI.format(dump_path=self.dump_path, exit_code=1))
+        camera = self.create_camera(PipeFrameTransport)
+
+        with self.assertRaises(PciError):
+            camera.get_frame()
+
+    def test_pipe_transport_pci_error_message(self):
+        """
+        If the error message of a failed pci command is taken from stdout, where pci writes its messages, even when
+        they are mixed into the DMA data
+        """
+        self.write_command('pci', (
+            '#!/bin/sh\n'
+            'if [ "$2" = "dma0" ]; then\n'
+            f'    head -c 1000 "{self.dump_path}"\n'
+            '    printf "\\nError reading DMA: timeout\\n"\n'
+            '    exit 1\n'
+            'fi\n'
+        ))
+        camera = self.create_camera(PipeFrameTransport)
+
+        with self.assertRaises(PciError) as context:
+            camera.get_frame()
+        self.assertEqual('Error reading DMA: timeout', str(context.exception))
+
+        # A message on stderr is still preferred
+        self.assertEqual('stderr', PipeFrameTransport.error_message(b'stderr\nmore', b'stdout', 1))
+        self.assertEqual('pci exited with code 2', PipeFrameTransport.error_message(b'', b'', 2))
+
+    def test_numpy_decoder(self):
+        # For the numpy decoder, the fake pci command has to replay a dump in the actual raw transfer format
+        from tests.test_decoding import encode_frame
+        with open(self.dump_path, mode='wb') as file:
+            file.write(encode_frame(self.frame))
+
+        for transport_class in [FileFrameTransport, PipeFrameTransport]:
+            camera = self.create_camera(transport_class)
+            camera.transport.decoder = 'numpy'
+            frame = camera.get_frame()
+            np.testing.assert_array_equal(self.frame, frame)
+
+    def test_get_frames_in_bursts(self):
+        # The fake pci command replays the whole dump for every DMA readout. A dump with two frames thus simulates a
+        # burst of two frames.
+        frames = np.stack([self.frame, self.frame[::-1]])
+        frames.tofile(self.dump_path)
+
+        for transport_class in [FileFrameTransport, PipeFrameTransport]:
+            camera = self.create_camera(transport_class)
+            camera.BURST_SIZE = 2
+
+            result = camera.get_frames(4)
+            self.assertEqual((4, self.HEIGHT, self.WIDTH), result.shape)
+            np.testing.assert_array_equal(np.concatenate([frames, frames]), result)
+
+            streamed = list(camera.stream_frames(4))
+            self.assertEqual(4, len(streamed))
+            np.testing.assert_array_equal(result, np.stack(streamed))
+
+    def test_file_transport_is_default(self):
+        camera = UfoCamera(self.config)
+        self.assertIsInstance(camera.transport, FileFrameTransport)
+
+    def test_pipe_transport_is_opt_in(self):
+        with mock.patch.dict(self.config.data['camera'], {'frame_transport': 'pipe'}):
+            camera = UfoCamera(self.config)
+            self.assertIsInstance(camera.transport, PipeFrameTransport)
+
+    def test_fallback_if_transport_not_available(self):
+        with mock.patch.dict(self.config.data['camera'], {'frame_transport': 'pipe'}), \
+                mock.patch.object(PipeFrameTransport, 'is_available', return_value=False):
+            camera = UfoCamera(self.config)
+            self.assertIsInstance(camera.transport, FileFrameTransport)
+
+    @benchmark
+    def test_benchmark_transports(self):
+        """
+        Replays the recorded frame dump with both transports and compares the average time per frame. The absolute
+        values are not really meaningful here, because the fake commands do not have to talk to any hardware. This
+        mainly serves as a tool to compare the overhead of the transports themselves.
+        """
+        frame_count = 5
+        times = {}
+        for transport_class in [FileFrameTransport, PipeFrameTransport]:
+            camera = self.create_camera(transport_class)
+            # The fixed sleeps after every frame would otherwise dominate the measured times
+            camera.acknowledge_frame = lambda: None
+            start_time = time.time()
+            for _ in range(frame_count):
+                frame = camera.transport.receive()
+            times[transport_class.name] = (time.time() - start_time) / frame_count
+            np.testing.assert_array_equal(self.frame, frame)
+
+        log_benchmark('frame transports', times)
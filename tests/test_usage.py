@@ -0,0 +1,150 @@
+import os
+import time
+import sqlite3
+import tempfile
+import unittest
+import multiprocessing
+from unittest import mock
+from types import SimpleNamespace
+
+from ufotest.usage import DiskUsageTracker, ARCHIVE, BUILDS, STATIC, BLOBS, OTHER
+
+
+# HELPER FUNCTIONS
+# ================
+
+def write_file(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, mode='wb') as file:
+        file.write(bytes(size))
+
+
+# TESTCASES
+# =========
+
+class TestDiskUsageTracker(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = self.folder.name
+        self.archive_path = os.path.join(self.path, 'archive')
+        self.builds_path = os.path.join(self.path, 'builds')
+        for name in ['archive', 'builds', 'static']:
+            os.mkdir(os.path.join(self.path, name))
+
+        self.config = SimpleNamespace(
+            get_path=lambda: self.path,
+            get_archive_path=lambda: self.archive_path,
+            get_builds_path=lambda: self.builds_path
+        )
+
+    def tearDown(self) -> None:
+        self.folder.cleanup()
+
+    def create_tracker(self) -> DiskUsageTracker:
+        return DiskUsageTracker(path=os.path.join(self.path, 'usage.db'), config=self.config)
+
+    def test_existing_folders_are_measured_on_creation(self):
+        write_file(os.path.join(self.archive_path, 'run_1', 'report.json'), 100)
+        write_file(os.path.join(self.archive_path, 'run_2', 'figures', 'plot.png'), 200)
+        write_file(os.path.join(self.builds_path, 'build_1', 'repository', 'camera.bit'), 1000)
+        write_file(os.path.join(self.path, 'static', 'base.css'), 10)
+        write_file(os.path.join(self.path, 'config.toml'), 5)
+
+        tracker = self.create_tracker()
+        self.assertDictEqual({ARCHIVE: 300, BUILDS: 1000, STATIC: 10, BLOBS: 0, OTHER: 5}, tracker.totals())
+        self.assertEqual(1315, tracker.total())
+
+    def test_record_and_remove(self):
+        tracker = self.create_tracker()
+        self.assertEqual(0, tracker.total())
+
+        run_path = os.path.join(self.archive_path, 'run_1')
+        write_file(os.path.join(run_path, 'report.json'), 100)
+        self.assertEqual(100, tracker.record(ARCHIVE, run_path))
+        self.assertEqual(100, tracker.totals()[ARCHIVE])
+
+        # Recording the same folder again replaces the previous size instead of adding to it
+        write_file(os.path.join(run_path, 'report.html'), 50)
+        tracker.record(ARCHIVE, run_path)
+        self.assertEqual(150, tracker.totals()[ARCHIVE])
+
+        tracker.remove(run_path)
+        self.assertEqual(0, tracker.totals()[ARCHIVE])
+
+    def test_refresh_only_measures_changed_entries(self):
+        write_file(os.path.join(self.builds_path, 'build_1', 'report.json'), 100)
+        write_file(os.path.join(self.builds_path, 'build_2', 'report.json'), 100)
+        tracker = self.create_tracker()
+        self.assertEqual(200, tracker.totals()[BUILDS])
+
+        # Nothing has changed, so nothing has to be measured
+        self.assertDictEqual({BUILDS: 0}, tracker.refresh(BUILDS))
+
+        # The mtime resolution of some file systems is rather coarse
+        time.sleep(0.01)
+        write_file(os.path.join(self.builds_path, 'build_2', 'report.html'), 50)
+        write_file(os.path.join(self.builds_path, 'build_3', 'report.json'), 100)
+        os.remove(os.path.join(self.builds_path, 'build_1', 'report.json'))
+        os.rmdir(os.path.join(self.builds_path, 'build_1'))
+
+        # build_1 was removed, build_2 was modified and build_3 is new
+        self.assertDictEqual({BUILDS: 3}, tracker.refresh(BUILDS))
+        self.assertEqual(250, tracker.totals()[BUILDS])
+
+    def test_rebuild(self):
+        tracker = self.create_tracker()
+        # A file which is modified deeper within an entry is not noticed by a refresh, but by a rebuild
+        write_file(os.path.join(self.archive_path, 'run_1', 'figures', 'plot.png'), 100)
+        tracker.refresh()
+        write_file(os.path.join(self.archive_path, 'run_1', 'figures', 'plot.png'), 300)
+
+        totals = tracker.rebuild()
+        self.assertEqual(300, totals[ARCHIVE])
+
+    def test_hard_links_are_counted_once(self):
+        blob_path = os.path.join(self.path, 'blobs', 'ab', 'cdef')
+        write_file(blob_path, 100)
+        for name in ['build_1', 'build_2']:
+            os.makedirs(os.path.join(self.builds_path, name))
+            os.link(blob_path, os.path.join(self.builds_path, name, 'camera.bit'))
+
+        tracker = self.create_tracker()
+        totals = tracker.totals()
+        self.assertEqual(100, totals[BLOBS])
+        self.assertEqual(0, totals[BUILDS])
+
+    def test_outdated_database_in_multiple_processes(self):
+        """
+        If multiple processes, like the workers of gunicorn, can open an outdated database at the same time and a
+        failed rebuild does not discard the existing database
+        """
+        write_file(os.path.join(self.archive_path, 'run_1', 'report.json'), 100)
+        tracker = self.create_tracker()
+        with tracker.connect() as connection:
+            connection.execute('PRAGMA user_version = 1')
+
+        with mock.patch.object(DiskUsageTracker, '_rebuild', side_effect=RuntimeError()):
+            with self.assertRaises(RuntimeError):
+                tracker.totals()
+
+        # The failed rebuild is rolled back, so the records of the previous schema still exist
+        connection = sqlite3.connect(tracker.path)
+        try:
+            self.assertEqual(1, connection.execute('PRAGMA user_version').fetchone()[0])
+            self.assertLess(0, connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0])
+        finally:
+            connection.close()
+
+        def measure():
+            for _ in range(5):
+                assert self.create_tracker().totals()[ARCHIVE] == 100
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=measure) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+
+        self.assertListEqual([0] * 4, [process.exitcode for process in processes])
@@ -3,9 +3,15 @@ import json
 import os
 import tempfile
 import shutil
+import time
+from typing import List
+from unittest import mock
 
+from jinja2 import Environment
+
+from ufotest._testing import benchmark, log_benchmark
 from ufotest.config import CONFIG
-from ufotest.util import HTMLTemplateMixin
+from ufotest.util import HTMLTemplateMixin, TemplateCache
 from ufotest.util import format_byte_size, get_folder_size
 
 
@@ -94,6 +100,101 @@ class TestHTMLTemplateMixin(unittest.TestCase):
         self.assertEqual(expected_html, html)
 
 
+class TestTemplateCache(unittest.TestCase):
+
+    def test_least_recently_used_templates_are_evicted(self):
+        environment = Environment()
+        cache = TemplateCache(size=2)
+
+        template_a = cache.get(environment, '{{ 1 }}')
+        cache.get(environment, '{{ 2 }}')
+        self.assertIs(template_a, cache.get(environment, '{{ 1 }}'))
+        # Now "{{ 2 }}" is the least recently used template
+        cache.get(environment, '{{ 3 }}')
+        self.assertListEqual(['{{ 1 }}', '{{ 3 }}'], list(cache.templates.keys()))
+        self.assertEqual((1, 3), (cache.hits, cache.misses))
+
+        # A new environment invalidates all the templates of the previous one
+        other_environment = Environment()
+        template = cache.get(other_environment, '{{ 1 }}')
+        self.assertIs(other_environment, template.environment)
+        self.assertEqual(1, len(cache.templates))
+
+    def create_archive(self, archive_path: str, report_count: int) -> None:
+        """
+        Creates a synthetic archive of *report_count* report json files within *archive_path*.
+        """
+        from ufotest.testing import MessageTestResult, DictTestResult, CombinedTestResult
+
+        report_template = (
+            '<html><body>'
+            '{% for name, result_dict in this.result_dicts.items() %}'
+            '<h2>{{ name }}</h2>{{ result_dict|html_from_dict }}'
+            '{% endfor %}'
+            '</body></html>'
+        )
+        for index in range(report_count):
+            result_dicts = {
+                f'test_{number}': CombinedTestResult(
+                    MessageTestResult(0, f'Report {index} test {number}'),
+                    DictTestResult(0, {'index': index, 'number': number})
+                ).to_dict()
+                for number in range(10)
+            }
+            folder_path = os.path.join(archive_path, f'report_{index:03d}')
+            os.mkdir(folder_path)
+            with open(os.path.join(folder_path, 'report.json'), mode='w') as file:
+                json.dump({'_html_template': report_template, 'result_dicts': result_dicts}, file)
+
+    def recompile_archive(self, archive_path: str) -> List[str]:
+        """
+        Renders the html of all the reports within *archive_path*, the same way the "ci recompile" command does.
+        """
+        htmls = []
+        for folder in sorted(os.listdir(archive_path)):
+            with open(os.path.join(archive_path, folder, 'report.json'), mode='r') as file:
+                htmls.append(HTMLTemplateMixin.html_from_dict(json.load(file)))
+
+        return htmls
+
+    def test_recompile_archive_uses_cache(self):
+        cache = TemplateCache()
+        with tempfile.TemporaryDirectory() as archive_path, mock.patch('ufotest.util.TEMPLATE_CACHE', new=cache):
+            self.create_archive(archive_path, 5)
+
+            htmls = self.recompile_archive(archive_path)
+            self.assertIn('Report 4 test 9', htmls[-1])
+            # Only the first use of each distinct template string is a miss
+            misses, renders = cache.misses, cache.hits + cache.misses
+            self.assertLess(misses, renders)
+
+            # The second time, all the templates are already compiled
+            self.assertListEqual(htmls, self.recompile_archive(archive_path))
+            self.assertEqual(misses, cache.misses)
+            self.assertEqual(2 * renders, cache.hits + cache.misses)
+
+    @benchmark
+    def test_benchmark_recompile_archive(self):
+        """
+        Recompiles a synthetic archive of report json files, the same way the "ci recompile" command does, once without
+        and once with the template cache and compares the durations.
+        """
+        with tempfile.TemporaryDirectory() as archive_path:
+            self.create_archive(archive_path, 50)
+
+            durations = {}
+            for name, cache in [('uncached', TemplateCache(size=0)), ('cached', TemplateCache())]:
+                with mock.patch('ufotest.util.TEMPLATE_CACHE', new=cache):
+                    start_time = time.time()
+                    htmls = self.recompile_archive(archive_path)
+                    durations[name] = time.time() - start_time
+
+                self.assertIn('Report 49 test 9', htmls[-1])
+
+            log_benchmark('recompile archive', durations)
+            self.assertLess(durations['cached'], durations['uncached'])
+
+
 class TestFolderByteSizeFunctions(unittest.TestCase):
 
     def test_format_byte_size_basic(self):
@@ -0,0 +1,125 @@
+import time
+import json
+import socket
+import threading
+import unittest
+import urllib.request
+from unittest import mock
+
+from ufotest._testing import UfotestTestMixin
+from ufotest.ci.wsgi import (AbstractServingBackend,
+                             FlaskServingBackend,
+                             GunicornServingBackend,
+                             CIServerSupervisor,
+                             SERVING_BACKENDS,
+                             get_serving_backend_class)
+
+
+# HELPER FUNCTIONS
+# ================
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# TESTCASES
+# =========
+
+class TestServingBackends(unittest.TestCase):
+
+    def test_get_serving_backend_class(self):
+        self.assertIs(FlaskServingBackend, get_serving_backend_class('flask'))
+
+        with self.assertRaises(KeyError):
+            get_serving_backend_class('apache')
+
+        with mock.patch.object(GunicornServingBackend, 'module', new='ufotest_not_installed'):
+            with self.assertRaises(ImportError):
+                get_serving_backend_class('gunicorn')
+
+        # If none of the optional servers is installed, the development server is used
+        with mock.patch('importlib.util.find_spec', new=lambda name: None):
+            self.assertIs(FlaskServingBackend, get_serving_backend_class('auto'))
+
+    def test_webhooks_are_not_blocked_by_slow_requests(self):
+        from ufotest.ci.server import server
+
+        port = get_free_port()
+        backend = FlaskServingBackend()
+
+        def slow_report_page(kind):
+            time.sleep(1)
+            raise ValueError('slow')
+
+        with mock.patch('ufotest.ci.server.get_report_page', new=slow_report_page), \
+                mock.patch('ufotest.ci.server.BuildQueue') as build_queue:
+            thread = threading.Thread(target=backend.serve, args=(server, '127.0.0.1', port), daemon=True)
+            thread.start()
+            url = f'http://127.0.0.1:{port}'
+            for _ in range(50):
+                try:
+                    urllib.request.urlopen(f'{url}/favicon.ico', timeout=1)
+                    break
+                except OSError as error:
+                    if getattr(error, 'code', None) is not None:
+                        break
+                    time.sleep(0.1)
+
+            slow_thread = threading.Thread(target=lambda: self.assertRaises(OSError, urllib.request.urlopen,
+                                                                            f'{url}/archive'))
+            slow_thread.start()
+            time.sleep(0.1)
+
+            start_time = time.time()
+            request = urllib.request.Request(f'{url}/push/github', data=json.dumps({'ref': 'main'}).encode(),
+                                             headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=5) as response:
+                self.assertEqual(200, response.status)
+            push_duration = time.time() - start_time
+
+            slow_thread.join()
+            self.assertLess(push_duration, 0.5)
+            build_queue.push.assert_called_once_with({'ref': 'main'})
+
+
+class TestCIServerSupervisor(UfotestTestMixin, unittest.TestCase):
+
+    def test_build_worker_is_managed(self):
+        states = []
+
+        class RecordingServingBackend(AbstractServingBackend):
+
+            def serve(self, app, host, port):
+                # Giving the worker process the time to start up
+                time.sleep(0.5)
+                states.append(supervisor.worker_process.is_alive())
+
+        with mock.patch.dict(SERVING_BACKENDS, {'recording': RecordingServingBackend}):
+            supervisor = CIServerSupervisor(None, '127.0.0.1', 8030, backend='recording', workers=1, threads=1,
+                                            config=self.config)
+            start_time = time.time()
+            supervisor.run()
+
+        self.assertListEqual([True], states)
+        self.assertFalse(supervisor.worker_process.is_alive())
+        # The worker was stopped by the event and not only terminated after the shutdown timeout
+        self.assertLess(time.time() - start_time, supervisor.shutdown_timeout)
+        self.assertEqual(0, supervisor.worker_process.exitcode)
+
+    def test_stop_worker_does_not_wait_forever(self):
+        """
+        If the supervisor kills the build worker, when it does not exit after being terminated
+        """
+        supervisor = CIServerSupervisor(None, '127.0.0.1', 8030, backend='flask', workers=1, threads=1,
+                                        config=self.config)
+        supervisor.shutdown_timeout = 0.1
+        supervisor.worker_process = mock.MagicMock()
+        supervisor.worker_process.is_alive.return_value = True
+
+        supervisor.stop_worker()
+        supervisor.worker_process.terminate.assert_called_once()
+        supervisor.worker_process.kill.assert_called_once()
+        self.assertListEqual([mock.call(0.1), mock.call(0.1), mock.call()],
+                             supervisor.worker_process.join.call_args_list)
@@ -4,13 +4,32 @@ with the testing functionality implemented *for* ufotest.
 """
 import tempfile
 import os
+import logging
 import unittest
+from typing import Dict
 
 from unittest import TestCase
 
 from ufotest.util import init_install, get_path
 from ufotest.config import Config
 
+#: This decorator marks the benchmark tests. These compare the durations (or memory usage) of different implementations,
+#: which depend on the load of the machine, so they are skipped on default. To run them, the environment variable
+#: "UFOTEST_BENCHMARK" has to be set: UFOTEST_BENCHMARK=1 python -m pytest tests
+benchmark = unittest.skipUnless(os.environ.get('UFOTEST_BENCHMARK'), 'benchmark, set UFOTEST_BENCHMARK=1 to run it')
+
+BENCHMARK_LOGGER = logging.getLogger('ufotest.benchmark')
+
+
+def log_benchmark(name: str, durations: Dict[str, float]) -> None:
+    """
+    Logs the *durations* (in seconds) which were measured by the benchmark *name*. To see them, pytest has to be run
+    with the option "--log-cli-level=INFO".
+
+    :returns: void
+    """
+    BENCHMARK_LOGGER.info('%s: %s', name, ', '.join(f'{key}={value * 1000:.3f} ms' for key, value in durations.items()))
+
 
 class UfotestTestMixin(object):
     """
@@ -0,0 +1,137 @@
+"""
+This module contains the numerical kernels which are used to calculate the noise characteristics of the camera from
+the frames it produces.
+
+**DESIGN CHOICE**
+
+Previously the variance of a frame pair was computed with a pure python double loop over every single pixel. For the
+20 MPixel sensor this took minutes for a single pair, which is why some of the noise test cases even needed process
+pools to finish in reasonable time. The functions in this module are vectorized with numpy instead. They all accumulate
+in float64 but they never create a widened float copy of the whole (uint16) input frames at once. Instead the frames are
+processed in blocks of rows, which keeps the additional memory bounded by the size of a single block.
+
+These functions only depend on numpy. They are deliberately kept free of any ufotest config or camera dependency so
+that they can be used on arbitrary arrays and within worker processes.
+"""
+from typing import Iterable, Union
+
+import numpy as np
+
+#: The number of pixels which is processed at once by the block-wise kernels. This bounds the size of the temporary
+#: float64 arrays which have to be created during a calculation (4M pixels -> 32 MB).
+BLOCK_PIXEL_COUNT = 4 * 1024 ** 2
+
+
+def _iter_row_blocks(height: int, width: int, block_pixel_count: int = BLOCK_PIXEL_COUNT):
+    """
+    Yields slice objects which partition the row range of a frame with the given *height* and *width* into consecutive
+    blocks, such that each block contains at most *block_pixel_count* pixels (but at least one row).
+    """
+    rows_per_block = max(1, block_pixel_count // max(1, width))
+    for start in range(0, height, rows_per_block):
+        yield slice(start, min(start + rows_per_block, height))
+
+
+def pair_variance(frame1: np.ndarray, frame2: np.ndarray) -> float:
+    """
+    Given two frame arrays of the same dimensions and from the same camera under the same conditions *frame1* and
+    *frame2*, this function calculates the variance of the difference of those frames as described by the photon
+    transfer method:
+
+    var = \\sum_{i}^{N} ((I_1i - M1) - (I_2i - M2))^2 / 2 N
+
+    :param frame1: The first of the two independent(!) frames
+    :param frame2: The second frame. Has to have the same shape as the first one.
+
+    :raises ValueError: If the two frames do not have the same shape
+
+    :returns float: The variance
+    """
+    if frame1.shape != frame2.shape:
+        raise ValueError(f'The two frames for the pair variance need to have the same shape, but the given frames have '
+                         f'the shapes {frame1.shape} and {frame2.shape}')
+
+    frame1 = np.atleast_2d(frame1)
+    frame2 = np.atleast_2d(frame2)
+    height, width = frame1.shape[0], int(np.prod(frame1.shape[1:]))
+    pixel_count = height * width
+
+    # "dtype" only sets the accumulator type here, numpy does not create a float copy of the frame to compute the mean
+    mean_difference = np.mean(frame1, dtype=np.float64) - np.mean(frame2, dtype=np.float64)
+
+    squared_sum = 0.0
+    for rows in _iter_row_blocks(height, width):
+        # Subtracting with an explicit float64 output type is important: The frames are usually unsigned integers and
+        # the difference would otherwise wrap around
+        difference = np.subtract(frame1[rows], frame2[rows], dtype=np.float64).ravel()
+        difference -= mean_difference
+        squared_sum += float(np.dot(difference, difference))
+
+    return squared_sum / (2 * pixel_count)
+
+
+def pair_rms_noise(frame1: np.ndarray, frame2: np.ndarray) -> float:
+    """
+    Calculates the rms noise of the camera from the two independent frames *frame1* and *frame2*. This is the square
+    root of the pair variance.
+
+    :returns float: The rms noise
+    """
+    return float(np.sqrt(pair_variance(frame1, frame2)))
+
+
+def pixel_variance(frames: Union[np.ndarray, Iterable[np.ndarray]], ddof: int = 0) -> np.ndarray:
+    """
+    Calculates the pixel specific variance over multiple *frames*. The result is a float64 array with the dimensions
+    of a single frame, where each element is the variance of the corresponding pixel over all the frames.
+
+    *frames* may either be a three dimensional array, where the first axis is the frame index (n, height, width) or
+    any iterable of two dimensional frame arrays. In the latter case, the frames are consumed one after another, which
+    means that a generator can be passed and the frames never have to be held in memory all at the same time. The
+    variance is accumulated with Welford's online algorithm, which is numerically stable.
+
+    :param frames: The frames of which to compute the per pixel variance
+    :param ddof: The delta degrees of freedom. The divisor used in the calculation is N - ddof where N is the number
+        of frames. Default is 0, which matches the default of np.var
+
+    :raises ValueError: If no frames are given or if the frames have different shapes
+
+    :returns: The array of per-pixel variances
+    """
+    count = 0
+    mean = None
+    squared_sum = None
+    for frame in frames:
+        if mean is None:
+            mean = np.zeros(frame.shape, dtype=np.float64)
+            squared_sum = np.zeros(frame.shape, dtype=np.float64)
+        elif frame.shape != mean.shape:
+            raise ValueError(f'All frames for the pixel variance need to have the same shape. Expected {mean.shape} '
+                             f'but got {frame.shape}')
+
+        count += 1
+        # Since "mean" is float64 the subtraction already yields a float64 result, the frame is not copied beforehand
+        delta = np.subtract(frame, mean)
+        mean += delta / count
+        delta *= np.subtract(frame, mean)
+        squared_sum += delta
+
+    if count == 0:
+        raise ValueError('At least one frame is required to calculate the pixel variance')
+
+    if count - ddof <= 0:
+        return np.zeros(mean.shape, dtype=np.float64)
+
+    squared_sum /= (count - ddof)
+    return squared_sum
+
+
+def rms_noise(variance: Union[float, np.ndarray]) -> float:
+    """
+    Calculates the rms noise value from a given *variance*. The variance may either be a single value (for example the
+    result of "pair_variance") or an array of pixel specific variances (the result of "pixel_variance"). In the later
+    case the noise is the square root of the mean variance.
+
+    :returns float: The rms noise
+    """
+    return float(np.sqrt(np.mean(variance, dtype=np.float64)))
@@ -4,11 +4,13 @@ A module containing the functionality related to interacting with the camera
 import os
 import re
 import time
+import mmap
 import copy
 import functools
+import threading
 import subprocess
 from abc import abstractmethod
-from typing import Optional, Any, List, Dict
+from typing import Optional, Any, List, Dict, Iterator
 
 import shutil
 import click
@@ -19,6 +21,9 @@ from ufotest.config import CONFIG, Config, get_path
 from ufotest.util import execute_command, get_command_output, execute_script, run_command, get_version
 from ufotest.util import cprint, cresult, cparams
 from ufotest.exceptions import PciError, FrameDecodingError
+from ufotest.progress import PROGRESS, FRAME_ACQUIRED
+from ufotest.transport import AbstractFrameTransport, FileFrameTransport, FRAME_TRANSPORTS
+from ufotest.pci import PciSession, ShellPciBackend, RegisterFile, RegisterSnapshot
 
 
 class AbstractCamera(object):
@@ -91,6 +96,46 @@ class AbstractCamera(object):
         """
         raise NotImplementedError
 
+    def get_frames(self, n: int) -> np.ndarray:
+        """
+        Returns *n* frames from the camera as a three dimensional numpy array of the shape (n, height, width).
+
+        The default implementation simply collects the frames from "stream_frames". Cameras which are able to acquire
+        multiple frames at once should overwrite "stream_frames" and possibly this method as well.
+
+        :param n: The number of frames to acquire
+
+        :returns: The array of frames
+        """
+        frames = None
+        for index, frame in enumerate(self.stream_frames(n)):
+            if frames is None:
+                frames = np.empty(shape=(n, *frame.shape), dtype=frame.dtype)
+            frames[index] = frame
+
+        return frames
+
+    def stream_frames(self, n: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        A generator, which yields frames from the camera as they arrive. If *n* is given, exactly that many frames are
+        yielded, otherwise the generator runs indefinitely.
+
+        **DESIGN CHOICE**
+
+        Every call to "get_frame" runs the full request/receive/decode cycle of the camera, including all of its fixed
+        waiting times. Test cases which need many frames should use this method or "get_frames" instead, because a
+        camera implementation can request the frames in bursts here and thus only has to pay these costs once per
+        burst. The default implementation falls back to calling "get_frame" for every frame though.
+
+        :param n: The number of frames to yield. None for an infinite stream.
+
+        :returns: A generator of frame arrays
+        """
+        count = 0
+        while n is None or count < n:
+            yield self.get_frame()
+            count += 1
+
     # -- manipulating internal properties
 
     @abstractmethod
@@ -215,9 +260,21 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
         'exposure_time': 1,
         'hardware_version': '-',
         'firmware_version': '-',
-        'sensor_version': '-'
+        'sensor_version': '-',
+        'frame_transport': '-'
     }
 
+    #: The maximum number of frames which are requested from the camera at once. All the frames of a burst have to be
+    #: held in memory at the same time, so this should not be too large for the big sensors.
+    #: It has not yet been verified on the hardware, that the camera buffers multiple requested frames until they are
+    #: received. Until then, every frame is requested and received on its own.
+    BURST_SIZE = 1
+
+    #: The range of registers which is read for a register snapshot. This is the same range which is also displayed by
+    #: the status script.
+    SNAPSHOT_ADDRESS = 0x9000
+    SNAPSHOT_SIZE = 120
+
     def __init__(self, config: Config):
         # The InternalDictMixin provides a default implementation for the property management of the camera class. On
         # default getting and setting will modify the values of the internal "values" dict. For specific properties
@@ -234,6 +291,24 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
         self.data_path = os.path.join(self.tmp_path, 'frame')
         self.frame_path = self.data_path + '.raw'
 
+        # All the register accesses are done through this session, which keeps a single shell process alive for all
+        # the pci commands instead of spawning a new one for every single access. See "ufotest.pci".
+        pci_backend = self.config.pm.apply_filter('ufo_camera_pci_backend', value=ShellPciBackend())
+        self.pci = PciSession(pci_backend)
+        # The register file offers the same register access in terms of integer addresses and values
+        self.registers = RegisterFile(self.pci)
+
+        # Previously every single poll invoked the whole status script. Now the status is derived from a snapshot of the
+        # register values, which is cached for "snapshot_ttl" seconds. The lock makes sure that concurrent polls (the
+        # web server for example) do not read the registers multiple times at once.
+        self.snapshot_ttl: float = self.config.get_data_or_default(['camera', 'snapshot_ttl'], 2.0)
+        self.snapshot: Optional[RegisterSnapshot] = None
+        self.snapshot_lock = threading.Lock()
+
+        # The frame transport is the object which actually implements how the data of a requested frame gets from the
+        # camera into a numpy array. There are several possible ways, see "ufotest.transport".
+        self.transport = self.create_transport()
+
     # -- AbstractCamera --
     # The following methods are the abstract methods which have to be implemented for AbstractCamera
 
@@ -244,42 +319,80 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
 
         The process of retrieving a frame can be roughly outlined like this. Using the command line interface of
         "pcitool" specific registers are set, which instruct the camera to acquire a frame. The data of this frame is
-        then saved as a raw bytestream. By using the command line interface of ipedecode this frame is decoded into the
-        RAW image format, which is then loaded into a numpy array and returned.
+        then received as a raw bytestream. By using the command line interface of ipedecode this frame is decoded into
+        the RAW image format, which is then loaded into a numpy array and returned. How exactly the data is moved
+        between these steps depends on the frame transport of the camera.
 
         :return: np.ndarray
         """
         self.request_frame()
-        self.receive_frame()
-        self.decode_frame()
+        frame = self.transport.receive()
+        PROGRESS.emit(FRAME_ACQUIRED, count=1)
+        return frame
 
-        # At this point, if everything worked out as it should, the frame data resides in the file references by
-        # self.frame_path as a .raw file. Now we only need to interpret this file as a numpy array and return that.
-        frames = import_raw(self.frame_path, 1, self.config.get_sensor_width(), self.config.get_sensor_height())
-        frame_array = frames[0]
-        return frame_array
+    def get_frames(self, n: int) -> np.ndarray:
+        """
+        Returns *n* frames from the camera as an array of the shape (n, height, width). The frames are requested in
+        bursts of at most BURST_SIZE frames, which are received and decoded at once directly into the result array.
+
+        :param n: The number of frames to acquire
+
+        :raises PciError: If there is any problem with receiving the frames
+        :raises FrameDecodingError: If there is any problem during the decoding process
+
+        :returns: The array of frames
+        """
+        frames = np.empty(shape=(n, self.config.get_sensor_height(), self.config.get_sensor_width()), dtype=np.uint16)
+        for start in range(0, n, self.BURST_SIZE):
+            stop = min(start + self.BURST_SIZE, n)
+            self.request_frames(stop - start)
+            self.transport.receive_frames(stop - start, out=frames[start:stop])
+            PROGRESS.emit(FRAME_ACQUIRED, count=stop - start)
+
+        return frames
+
+    def stream_frames(self, n: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        A generator which yields *n* frames (or infinitely many if *n* is None). The frames are requested in bursts of
+        at most BURST_SIZE frames. The next burst is only requested once all frames of the previous burst have been
+        consumed.
+
+        :raises PciError: If there is any problem with receiving the frames
+        :raises FrameDecodingError: If there is any problem during the decoding process
+
+        :returns: A generator of frame arrays
+        """
+        count = 0
+        while n is None or count < n:
+            burst_size = self.BURST_SIZE if n is None else min(self.BURST_SIZE, n - count)
+            self.request_frames(burst_size)
+            # Each burst is received into a new array, so the yielded frames stay valid after the next burst
+            frames = self.transport.receive_frames(burst_size)
+            PROGRESS.emit(FRAME_ACQUIRED, count=burst_size)
+            yield from frames
+            count += burst_size
 
     def poll(self) -> bool:
         """
         Returns whether or not the camera can be used.
 
+        The status is derived from a snapshot of the camera registers. A snapshot which is not older than
+        "snapshot_ttl" seconds is reused, so calling this method repeatedly does not access the camera every time. Use
+        "refresh_snapshot" to force a new readout.
+
         :return: bool
         """
-        result = self.config.sm.invoke('status')
-        output = result['stdout']
-
-        if self.config.verbose():
-            cprint(output)
-
-        # This method will parse the string output of the status script and return a dict, whose keys are the register
-        # identifiers and the values are lists with 4 items which are the string versions of the 8 hex values each
-        # that make up the register value.
-        registers = self.parse_status_to_dict(output)
+        try:
+            snapshot = self.get_snapshot()
+        except PciError as error:
+            if self.config.verbose():
+                cprint(f'Could not read the camera registers: {error}')
+            return False
 
         # I am using the very simple method michele has taught me and I am only checking the 9050 register for the
         # occurrence of the very specific bit sequences ffff and 1111 which tell that frames should be able to be
-        # taken!
-        status = 'ffff' in registers['9050'][0] and '1111' in registers['9050'][2]
+        # taken! (9058 is the third register of the 9050 line of the status output)
+        status = 'ffff' in f'{snapshot.get(0x9050, 0):08x}' and '1111' in f'{snapshot.get(0x9058, 0):08x}'
 
         return status
 
@@ -310,6 +423,9 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
         time.sleep(0.5)
         self.config.sm.invoke('reset')
 
+        # The set up changes the status of the camera, so a previous snapshot is not valid anymore
+        self.snapshot = None
+
     def tear_down(self):
         pass
 
@@ -328,14 +444,85 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
         self._set_exposure_time(hex_value)
 
     def _set_exposure_time(self, hex_value: str):
-        self.pci_write('9000', hex_value)
-        time.sleep(0.1)
-        self.pci_read('9010', 1)
-        time.sleep(0.1)
+        with self.registers.batch():
+            self.registers.write(0x9000, hex_value)
+            self.registers.sleep(0.1)
+            self.registers.read(0x9010)
+            self.registers.sleep(0.1)
+
+    def get_frame_transport(self) -> str:
+        return self.transport.name
+
+    # -- Register snapshots --
+
+    def get_snapshot(self, max_age: Optional[float] = None) -> RegisterSnapshot:
+        """
+        Returns a snapshot of the status registers of the camera. If the most recent snapshot is not older than
+        *max_age* seconds it is returned directly, otherwise a new snapshot is read from the camera.
+
+        :param max_age: The max age in seconds of a snapshot which may be reused. Defaults to the "camera.snapshot_ttl"
+            config option. 0 forces a new readout.
+
+        :raises PciError: If the registers cannot be read
+
+        :returns: The RegisterSnapshot
+        """
+        max_age = self.snapshot_ttl if max_age is None else max_age
+        with self.snapshot_lock:
+            if self.snapshot is None or self.snapshot.age >= max_age:
+                self.snapshot = self.read_snapshot()
+
+            return self.snapshot
+
+    def refresh_snapshot(self) -> RegisterSnapshot:
+        """
+        Reads a new snapshot of the status registers from the camera, independent of the age of the cached one.
+
+        :raises PciError: If the registers cannot be read
+
+        :returns: The new RegisterSnapshot
+        """
+        return self.get_snapshot(max_age=0)
+
+    def read_snapshot(self) -> RegisterSnapshot:
+        """
+        Reads the status registers of the camera and returns them as a new snapshot. These are the same registers,
+        which are also displayed by the status script.
+
+        :raises PciError: If the registers cannot be read
+
+        :returns: The new RegisterSnapshot
+        """
+        read = self.registers.read(self.SNAPSHOT_ADDRESS, self.SNAPSHOT_SIZE)
+        if self.config.verbose():
+            cprint(read.command.stdout)
+
+        return RegisterSnapshot(self.SNAPSHOT_ADDRESS, read.values)
 
     # -- Helper methods --
     # These methods wrap camera specific functionality which is required to implement the more top level behavior
 
+    def create_transport(self) -> AbstractFrameTransport:
+        """
+        Creates the frame transport object which is used to receive the frames from the camera. The transport is
+        selected by its name with the "camera.frame_transport" config option. This choice can be overwritten with the
+        "ufo_camera_transport_class" filter hook. If the chosen transport is not available on the system, the camera
+        falls back to the FileFrameTransport.
+
+        :returns: The transport object
+        """
+        transport_name = self.config.get_data_or_default(['camera', 'frame_transport'], 'file')
+        transport_class = FRAME_TRANSPORTS.get(transport_name, FileFrameTransport)
+        transport_class = self.config.pm.apply_filter('ufo_camera_transport_class', value=transport_class)
+
+        transport = transport_class(self)
+        if not transport.is_available():
+            if self.config.verbose():
+                cprint(f'Frame transport "{transport.name}" is not available. Falling back to the file transport')
+            transport = FileFrameTransport(self)
+
+        return transport
+
     def parse_status_to_dict(self, status_output: str) -> Dict[str, List[str]]:
         # This regex pattern parses the output of the status script. The success of this is strongly coupled with how
         # this output is generated! So this would be subject to change should the output ever change format!
@@ -407,50 +594,78 @@ class UfoCamera(InternalDictMixin, AbstractCamera):
             stdout = result['stdout']
             raise PciError(stdout[:stdout.find('\n')])
 
+        self.acknowledge_frame()
+
+    def acknowledge_frame(self):
+        """
+        Performs the register operations which have to be done after the data of a frame was received.
+
+        :return: void
+        """
         # I have no clue what this does, but it is also done in micheles script.
-        time.sleep(0.1)
-        pci_read('9050', '12')
-        time.sleep(0.1)
+        with self.registers.batch():
+            self.registers.sleep(0.1)
+            self.registers.read(0x9050, 12)
+            self.registers.sleep(0.1)
 
     def request_frame(self):
         """
         Writes the necessary registers of the camera to indicate that a new frame is requested
 
+        :return: void
+        """
+        self.request_frames(1)
+
+    def request_frames(self, count: int):
+        """
+        Writes the necessary registers of the camera to request a burst of *count* frames. The data of all these frames
+        can then be received at once.
+
+        :param count: The number of frames to request
+
         :return: void
         """
         # At this point I have no clue, what these instructions specifically do. I just imitated the relevant
-        # section from micheles bash script for requesting frames.
-        pci_write('0x9040', '0x80000201')
-        pci_write('0x9040', '0x80000209')
-        time.sleep(0.1)
-        pci_read('9070', '4')
-        pci_write('0x9040', '0x80000201')
-        time.sleep(0.01)
+        # section from micheles bash script for requesting frames. For a burst, this exact trigger sequence is repeated
+        # for every single frame, since it is the only one which is known to work with the firmware.
+        # All of these register accesses are sent to the pci session as one batch. Every single write to 9040 toggles
+        # the trigger, which is why these writes must not be combined.
+        with self.registers.batch():
+            for _ in range(count):
+                self.registers.write(0x9040, 0x80000201, merge=False)
+                self.registers.write(0x9040, 0x80000209, merge=False)
+                self.registers.sleep(0.1)
+                self.registers.read(0x9070, 4)
+                self.registers.write(0x9040, 0x80000201, merge=False)
+                self.registers.sleep(0.01)
 
     def pci_write(self, addr: str, value: str) -> bool:
         """
         Uses the "pci" command to write a new value to the given register address of the FPGA. Returns the boolean
         value of whether or not the write operation was successful.
 
+        Within a batch of the pci session, the write is only queued and this method always returns True.
+
         :param addr: The string representation of the register address to write to
         :param value: The actual value to write to the register
 
         :return: boolean
         """
-        pci_command = f'pci -w {addr} {value}'
-        result = self.execute_command(pci_command)
-        return not bool(result['exit_code'])
+        command = self.pci.write(addr, value)
+        return not command.done or command.success
 
     def pci_read(self, addr: str, size: int) -> str:
         """
         Uses the "pci" command to perform a register readout operation of the FPGA at the given address and with the
         given size. Returns the string output of the console command.
 
+        Within a batch of the pci session, the read is only queued and this method returns an empty string. To access
+        the parsed integer result of a read, also within a batch, use "self.registers.read" instead.
+
         :return: string
         """
-        pci_command = 'pci -r {} -s {}'.format(addr, str(size))
-        result = self.execute_command(pci_command)
-        return result['stdout']
+        command = self.pci.read(addr, size)
+        return command.stdout if command.done else ''
 
     def execute_command(self, command: str, cwd: Optional[str] = None) -> dict:
         """
@@ -564,8 +779,28 @@ class MockCamera(InternalDictMixin, AbstractCamera):
         frame_array = self.add_gaussian_noise(frame_array, exposure_time)
         """
 
+        PROGRESS.emit(FRAME_ACQUIRED, count=1)
         return frame_array.astype(np.uint16)
 
+    def get_frames(self, n: int) -> np.ndarray:
+        width = self.config.get_sensor_width()
+        height = self.config.get_sensor_height()
+        frame_array = self.resize_image(width, height).astype(np.uint16)
+
+        PROGRESS.emit(FRAME_ACQUIRED, count=n)
+        return np.repeat(frame_array[np.newaxis, :, :], n, axis=0)
+
+    def stream_frames(self, n: Optional[int] = None) -> Iterator[np.ndarray]:
+        width = self.config.get_sensor_width()
+        height = self.config.get_sensor_height()
+        frame_array = self.resize_image(width, height).astype(np.uint16)
+
+        count = 0
+        while n is None or count < n:
+            PROGRESS.emit(FRAME_ACQUIRED, count=1)
+            yield frame_array.copy()
+            count += 1
+
     def poll(self):
         return self.enabled
 
@@ -608,12 +843,114 @@ def pci_read(addr: str, size):
     return value
 
 
-def import_raw(path: str, n: int, sensor_width: int, sensor_height: int):
-    image = np.fromfile(path, dtype=np.uint16, count=sensor_width * sensor_height * n)
-    image = image.reshape((n, sensor_height, sensor_width))
+def import_raw(path: str, n: Optional[int], sensor_width: int, sensor_height: int, memory_map: bool = False):
+    """
+    Imports *n* frames with the dimensions *sensor_width* x *sensor_height* from the .raw file at *path* and returns
+    them as an uint16 array of the shape (n, height, width).
+
+    On default the whole content is read into memory. If *memory_map* is True, the file is memory mapped instead (see
+    "map_raw"), which means that the frames are only loaded from the file once they are actually accessed.
+
+    :param path: The string path of the .raw file
+    :param n: The number of frames to import. If None, all the frames in the file are imported.
+    :param sensor_width: The width of a frame in pixels
+    :param sensor_height: The height of a frame in pixels
+    :param memory_map: Whether to return a memory mapped array instead of reading the file
+
+    :returns: The array of frames
+    """
+    if memory_map:
+        return map_raw(path, sensor_width, sensor_height, n=n)
+
+    count = -1 if n is None else sensor_width * sensor_height * n
+    image = np.fromfile(path, dtype=np.uint16, count=count)
+    image = image.reshape((-1 if n is None else n, sensor_height, sensor_width))
     return image
 
 
+def map_raw(path: str,
+            sensor_width: int,
+            sensor_height: int,
+            n: Optional[int] = None,
+            copy_on_write: bool = False) -> np.memmap:
+    """
+    Memory maps the .raw file at *path* as an uint16 array of the shape (n, height, width).
+
+    **DESIGN CHOICE**
+
+    "import_raw" reads the whole file into memory, which is not feasible for large multi frame dumps: A few hundred
+    frames of the 20 MPixel sensor already need multiple GB of RAM. The memory mapped array on the other hand only
+    loads those parts of the file into memory, which are actually accessed. Indexing the array (for example to get a
+    single frame) returns views and does not copy any data. These pages belong to the file cache and can be dropped by
+    the kernel at any time, so they do not add to the memory pressure like the anonymous memory of a normal array.
+
+    :param path: The string path of the .raw file
+    :param sensor_width: The width of a frame in pixels
+    :param sensor_height: The height of a frame in pixels
+    :param n: The number of frames to map. If None, all the frames in the file are mapped.
+    :param copy_on_write: On default the array is read only. If this is True, the array can be modified. Only the
+        memory pages which are actually written to are copied into memory, the file itself is never changed.
+
+    :raises ValueError: If the file does not contain enough data for *n* frames
+
+    :returns: The memory mapped array of frames
+    """
+    frame_bytes = sensor_width * sensor_height * np.dtype(np.uint16).itemsize
+    file_frames = os.path.getsize(path) // frame_bytes
+    n = file_frames if n is None else n
+    if n > file_frames:
+        raise ValueError(f'The file "{path}" only contains {file_frames} frames of the size {sensor_width}x'
+                         f'{sensor_height}, but {n} frames were requested')
+
+    return np.memmap(
+        path,
+        dtype=np.uint16,
+        mode='c' if copy_on_write else 'r',
+        shape=(n, sensor_height, sensor_width)
+    )
+
+
+def iter_raw_frames(path: str,
+                    sensor_width: int,
+                    sensor_height: int,
+                    n: Optional[int] = None,
+                    copy: bool = False) -> Iterator[np.ndarray]:
+    """
+    A generator which lazily yields the frames from the .raw file at *path* one after another. This can be directly
+    passed to functions like "analysis.noise.pixel_variance" to analyse large multi frame dumps with a constant memory
+    footprint.
+
+    The frames are views into a read only memory map of the file. Once the generator moves on to the next frame, the
+    memory pages of the previous frame are released again. Accessing the previous frame afterwards is still valid, it
+    simply has to be read from the file again.
+
+    :param path: The string path of the .raw file
+    :param sensor_width: The width of a frame in pixels
+    :param sensor_height: The height of a frame in pixels
+    :param n: The number of frames to yield. If None, all the frames in the file are yielded.
+    :param copy: If True, every frame is copied into a normal in-memory array before it is yielded
+
+    :returns: A generator of frame arrays
+    """
+    frames = map_raw(path, sensor_width, sensor_height, n=n)
+    # "_mmap" is the underlying mmap object of the numpy memmap. It is None for an empty file
+    memory_map = getattr(frames, '_mmap', None)
+    can_release = memory_map is not None and hasattr(memory_map, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+
+    frame_bytes = frames[0].nbytes if len(frames) else 0
+    for index in range(len(frames)):
+        frame = frames[index]
+        yield np.array(frame) if copy else frame
+
+        if can_release:
+            # The mapping starts at the beginning of the file and the frame offsets are not necessarily aligned to the
+            # memory pages. Only pages which are completely within the frame can be released.
+            start = -(-index * frame_bytes // mmap.PAGESIZE) * mmap.PAGESIZE
+            end = (index + 1) * frame_bytes // mmap.PAGESIZE * mmap.PAGESIZE
+            if end > start:
+                memory_map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
 def set_up_camera(verbose: bool = False):
     # enable the drivers and stuff
     execute_script('pcie_init', verbose=verbose, prefix='sudo ')
@@ -0,0 +1,188 @@
+"""
+This module contains the "BlobStore", a content addressed storage for the files of the build artifacts.
+
+**DESIGN CHOICE**
+
+Every build folder contains a full copy of the source repository (which is needed to load the scripts of that specific
+build version later on) and a copy of the bitfile. Usually only a handful of files change between two builds, but
+every build still stored a complete copy of every single file, which quickly fills up the disk.
+
+The blob store keeps exactly one copy of every distinct file content within the "blobs" folder of the installation.
+The name of such a blob file is the SHA256 hash of its content. The files within the build folders are then only hard
+links to these blobs, so an unchanged file does not take up any additional space, no matter how many builds contain
+it. Since hard links are used, the build folders still contain regular files, which can be read, served by the web
+server and deleted just like before.
+
+Blobs are made read only, because modifying a hard linked file would modify it in every build at the same time. The
+executable flag of a file is part of the blob identity, so that the linked files keep their correct permissions.
+
+Hard links also make the garbage collection trivial: The link count of a blob file, which is not referenced by any
+build folder anymore, is 1. "BlobStore.collect_garbage" simply removes all those blobs.
+"""
+import os
+import stat
+import shutil
+import hashlib
+import tempfile
+from typing import Optional, Callable, Tuple, Iterable
+
+from ufotest.config import get_path
+
+
+class BlobStore(object):
+    """
+    Wraps the content addressed blob storage folder.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        store = BlobStore()
+        # Instead of "shutil.copytree"
+        store.link_tree(repository_path, os.path.join(build_folder_path, repository_name))
+        # Instead of "shutil.copy"
+        store.link(bitfile_path, os.path.join(build_folder_path, 'camera.bit'))
+        # After build folders have been deleted
+        count, size = store.collect_garbage()
+
+    :param path: The path of the blob storage folder. Defaults to the "blobs" folder of the installation.
+    """
+    #: The number of bytes which are read at once when hashing a file
+    CHUNK_SIZE = 1024 ** 2
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = get_path('blobs') if path is None else path
+
+    def get_blob_path(self, digest: str) -> str:
+        """
+        Returns the path of the blob with the given *digest*. The blobs are distributed into sub folders by the first
+        two characters of the digest, so that no single folder contains too many files.
+
+        :returns str:
+        """
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def hash_file(self, file_path: str) -> str:
+        """
+        Returns the digest of the file at *file_path*, which is the SHA256 hash of its content. The suffix "x" is
+        appended for executable files.
+
+        :returns str:
+        """
+        sha256 = hashlib.sha256()
+        with open(file_path, mode='rb') as file:
+            for chunk in iter(lambda: file.read(self.CHUNK_SIZE), b''):
+                sha256.update(chunk)
+
+        executable = os.stat(file_path).st_mode & stat.S_IXUSR
+        return sha256.hexdigest() + ('x' if executable else '')
+
+    def put(self, file_path: str) -> str:
+        """
+        Adds the content of the file at *file_path* to the store, if it does not already exist.
+
+        :returns: The digest of the blob
+        """
+        digest = self.hash_file(file_path)
+        blob_path = self.get_blob_path(digest)
+        if os.path.exists(blob_path):
+            return digest
+
+        blob_folder_path = os.path.dirname(blob_path)
+        os.makedirs(blob_folder_path, exist_ok=True)
+
+        # The file is first copied to a temporary file within the same folder and then renamed, so that there never is
+        # an incomplete blob with a valid name.
+        file_descriptor, temp_path = tempfile.mkstemp(dir=blob_folder_path)
+        os.close(file_descriptor)
+        try:
+            shutil.copyfile(file_path, temp_path)
+            os.chmod(temp_path, 0o555 if digest.endswith('x') else 0o444)
+            os.replace(temp_path, blob_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return digest
+
+    def link(self, file_path: str, destination_path: str) -> str:
+        """
+        Adds the file at *file_path* to the store and creates a hard link to the blob at *destination_path*. If the
+        hard link cannot be created (if the destination is on a different file system for example), the file is copied
+        instead.
+
+        :returns: The digest of the blob
+        """
+        digest = self.put(file_path)
+        try:
+            os.link(self.get_blob_path(digest), destination_path)
+        except OSError:
+            shutil.copy2(file_path, destination_path)
+
+        return digest
+
+    def link_tree(self,
+                  source_path: str,
+                  destination_path: str,
+                  ignore: Optional[Callable[[str, list], Iterable[str]]] = None) -> int:
+        """
+        Recreates the folder structure of *source_path* at *destination_path*, where all the regular files are hard
+        links into the blob store. Symbolic links are copied as symbolic links. This is the blob store equivalent of
+        "shutil.copytree".
+
+        :param source_path: The folder to be copied
+        :param destination_path: The path of the new folder, which must not exist yet
+        :param ignore: The same kind of callable as for "shutil.copytree", for example "shutil.ignore_patterns"
+
+        :returns: The number of files which have been linked
+        """
+        count = 0
+        for root, folders, files in os.walk(source_path):
+            ignored = set(ignore(root, folders + files)) if ignore is not None else set()
+            # Modifying the folders list in place prevents os.walk from descending into the ignored folders
+            folders[:] = [folder for folder in folders if folder not in ignored]
+
+            destination_root = os.path.join(destination_path, os.path.relpath(root, source_path))
+            os.makedirs(destination_root, exist_ok=True)
+
+            for name in [name for name in files if name not in ignored]:
+                file_path = os.path.join(root, name)
+                destination_file_path = os.path.join(destination_root, name)
+                if os.path.islink(file_path):
+                    os.symlink(os.readlink(file_path), destination_file_path)
+                else:
+                    self.link(file_path, destination_file_path)
+                    count += 1
+
+            # os.walk does not list symbolic links to folders in "files"
+            for name in [name for name in folders if os.path.islink(os.path.join(root, name))]:
+                folders.remove(name)
+                os.symlink(os.readlink(os.path.join(root, name)), os.path.join(destination_root, name))
+
+        return count
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        """
+        Removes all the blobs, which are not referenced by any file outside of the store anymore.
+
+        :returns: A tuple of the number of removed blobs and the number of freed bytes
+        """
+        count, size = 0, 0
+        if not os.path.exists(self.path):
+            return count, size
+
+        for entry in os.scandir(self.path):
+            if not entry.is_dir():
+                continue
+
+            for blob_entry in os.scandir(entry.path):
+                blob_stat = blob_entry.stat()
+                if blob_stat.st_nlink <= 1:
+                    os.remove(blob_entry.path)
+                    count += 1
+                    size += blob_stat.st_size
+
+            if not os.listdir(entry.path):
+                os.rmdir(entry.path)
+
+        return count, size
@@ -5,9 +5,10 @@ import click
 import datetime
 import shutil
 import json
+import time
 import traceback
 from contextlib import AbstractContextManager
-from typing import Optional
+from typing import Optional, Dict, List, Tuple
 
 from ufotest.config import Config, get_path, get_builds_path
 from ufotest.exceptions import raise_if, IncompleteBuildError, BuildError
@@ -20,6 +21,19 @@ from ufotest.util import (AbstractRichOutput,
                           get_template,
                           get_version)
 from ufotest.testing import TestRunner, TestReport, TestContext
+from ufotest.index import ReportIndex, BUILD
+from ufotest.usage import DiskUsageTracker, BUILDS, BLOBS
+from ufotest.ci.mirror import GitMirror
+from ufotest.ci.blobs import BlobStore
+from ufotest.ci.build_queue import (AbstractQueueBackend,
+                                    JsonQueueBackend,
+                                    SqliteQueueBackend,
+                                    QueueNotifier,
+                                    QUEUE_BACKENDS,
+                                    ALWAYS,
+                                    LATEST,
+                                    coalesce,
+                                    get_build_key)
 
 
 UFOTEST_PATH = get_path()
@@ -118,6 +132,8 @@ class BuildLock(object):
         """
         if cls.is_locked():
             os.remove(cls.get_lock_path())
+            # The build worker does not start a new build while the lock is acquired
+            BuildQueue.get_notifier().notify()
         else:
             raise FileNotFoundError('You cannot release the build lock if it is not locked in the first place')
 
@@ -268,15 +284,23 @@ class BuildContext(AbstractContextManager):
 
         :return: void
         """
-        # ~ DELETING THE CLONED REPOSITORY
-        # another important thing to do to be able to have another build process be able to run again is to delete the
-        # folder which was used for the cloning process.
-        if os.path.exists(self.repository_path):
-            shutil.rmtree(self.repository_path)
-
-        # ~ RELEASING THE LOCK
-        # By doing this, another build process is now able to be started again in a different process possibly
-        BuildLock.release()
+        try:
+            # ~ DELETING THE CLONED REPOSITORY
+            # another important thing to do to be able to have another build process be able to run again is to delete
+            # the folder which was used for the cloning process. This folder is a worktree of the git mirror of the
+            # repository, which also has to forget about it.
+            # A failure at this point is only logged: The next build checks out into a fresh worktree anyways and an
+            # exception here would replace the actual outcome of the build.
+            if os.path.exists(self.repository_path):
+                GitMirror(self.repository_url).remove_worktree(self.repository_path)
+        except Exception as e:
+            cerror(f'Could not remove the build worktree "{self.repository_path}": {e.__class__.__name__}: {e}')
+        finally:
+            # ~ RELEASING THE LOCK
+            # By doing this, another build process is now able to be started again in a different process possibly.
+            # This has to happen no matter what, otherwise the build worker would stall until the lock is removed
+            # manually.
+            BuildLock.release()
 
         # ~ EXIT TEST CONTEXT
         self.test_context.__exit__(exc_type, exc_val, exc_tb)
@@ -355,6 +379,16 @@ class BuildReport(AbstractRichOutput):
         with open(json_path, mode='w') as json_file:
             json_file.write(self.to_json())
 
+        # 4 -- UPDATE THE REPORT INDEX
+        ReportIndex(config=self.context.config).add(BUILD, folder_path, self.to_dict())
+
+        # 5 -- UPDATE THE DISK USAGE
+        # The build folder contains a full copy of the source repository, this is the only time it is measured. Most
+        # of its files are links into the blob store though, which may have received new blobs as well.
+        tracker = DiskUsageTracker(config=self.context.config)
+        tracker.record(BUILDS, folder_path)
+        tracker.refresh(BLOBS)
+
         click.secho('(+) Build report saved to: {}'.format(folder_path), fg='green')
 
     def __str__(self):
@@ -584,7 +618,11 @@ class BuildRunner(object):
         repository_source_path = self.context.repository_path
         repository_destination_path = os.path.join(self.context.folder_path, self.context.repository_name)
 
-        shutil.copytree(repository_source_path, repository_destination_path)
+        # The files are not actually copied, but hard linked to the blob store. That way the files which did not change
+        # since the previous build do not take up any additional space.
+        # The ".git" entry of the worktree only references the git mirror, it would be useless within the build folder
+        BlobStore().link_tree(repository_source_path, repository_destination_path,
+                              ignore=shutil.ignore_patterns('.git'))
         cprint(f'Copied source repository to path: "{repository_destination_path}"')
 
     def copy_bitfile(self):
@@ -607,8 +645,9 @@ class BuildRunner(object):
         bitfile_name = os.path.basename(bitfile_path)
 
         # -- COPY IT INTO THE FOLDER
+        # Just like the repository, the bitfile is only linked to the blob store.
         bitfile_destination_path = os.path.join(self.context.folder_path, bitfile_name)
-        shutil.copy(bitfile_path, bitfile_destination_path)
+        BlobStore().link(bitfile_path, bitfile_destination_path)
 
         # -- SET CONTEXT ATTRIBUTE
         # The context object actually already has the attribute 'bitfile_path'. It has been initialized as None within
@@ -616,78 +655,202 @@ class BuildRunner(object):
         self.context.bitfile_path = bitfile_destination_path
 
     def clone(self):
-        """Clones the remote git repository to the local machine and checking out the desired commit.
+        """Checks out the desired commit of the remote git repository on the local machine.
+
+        The repository is not actually cloned for every build. Instead, a persistent mirror of the repository is updated
+        with only the new commits and the desired commit is then checked out as a worktree of this mirror. See
+        "ufotest.ci.mirror.GitMirror".
+
+        :raises BuildError: If the repository could not be fetched or the commit does not exist
 
         :return: void
         """
-        # TODO: Maybe raise some exceptions in this method.
-        click.secho('    Cloning git repository: {}'.format(self.context.repository_url))
-
-        # -- CLONING THE REPO
-        clone_command = 'git clone --single-branch --branch "{}" "{}"'.format(
-            self.context.branch,
-            self.context.repository_url
-        )
-        exit_code, stdout = run_command(clone_command, cwd=UFOTEST_PATH)
-        click.secho('(+) Cloned git repo: {}'.format(self.context.repository_path), fg='green')
+        click.secho('    Updating git mirror: {}'.format(self.context.repository_url))
 
-        # -- CHECKOUT CORRECT COMMIT
-        checkout_command = 'git checkout "{}"'.format(self.context.commit)
-        exit_code, stdout = run_command(checkout_command, cwd=self.context.repository_path)
-        click.secho('(+) Checking out commit: {}'.format(self.context.commit))
+        # -- UPDATING THE MIRROR
+        # Only the first build actually clones the whole repository, afterwards only the new commits are fetched.
+        mirror = GitMirror(self.context.repository_url)
+        mirror.update()
 
         # -- GET THE COMMIT NAME
-        # Ok so here we are doing something weird... Quick explanation: The build process can be triggered without
-        # an actual commit name. In that case, it will just use the most recent commit by specifying FETCH_HEAD. This
-        # would actually be the commit name within the context object. And that works fine and stuff, but for the
-        # report it would be nice if we had the actual commit name. This we can only actually get after we have
-        # cloned the repo. So this command here gets the commit name and returns it. We then update the commit name
-        # within the context object with this actual name, so that we can use this later in the report.
-        hash_command = 'git rev-parse HEAD'
-        exit_code, stdout = run_command(hash_command, cwd=self.context.repository_path)
-        commit_name = stdout.rstrip('\n')
+        # The build process can be triggered without an actual commit name. In that case, it will just use the most
+        # recent commit of the branch by specifying FETCH_HEAD. For the report it would be nice if we had the actual
+        # commit name though, which is why the commit name within the context object is replaced with the full hash.
+        commit_name = mirror.resolve(self.context.commit, self.context.branch)
         self.context.commit = commit_name
 
+        # -- CHECKOUT CORRECT COMMIT
+        mirror.add_worktree(self.context.repository_path, commit_name)
+        click.secho('(+) Checked out commit {} to: {}'.format(commit_name, self.context.repository_path), fg='green')
+
 
-# BUILD QUEUE
-# So the problem I am seeing is that, that I cannot really access the main loop of the server... If I had a main loop
-# or something it would be fairly easy: I would simply put "if queue not empty and previous finished start next" and
-# that would be it. But I dont really have access to this main loop. Here are two ideas which I had:
-# - Somehow dynamically attach the activation call for the next build to the end of the current build
-# - Decouple the build completely from the web server: Parallel to the web server also start a new process which
-#   simply executes builds. In this separate process I would have the main loop which I wanted.
-# Thinking about this, I realized that it is probably going to be much work and I dont know if I should really do this
-# I mean, is it that important? or should I just delay this for version 1.1?
 class BuildQueue(object):
+    """
+    This is a static class, which models the persistent queue of pending build requests. The web server pushes the
+    requests, which it receives from the webhooks, into this queue and the build worker process pops them again to
+    actually execute the builds.
+
+    The actual storage is implemented by one of the backends from "ufotest.ci.build_queue", which is selected with the
+    "ci.queue_backend" config option. The default "sqlite" backend stores the queue within the file "build_queue.db",
+    the "json" backend is the compatibility mode, which uses the original "build.queue" JSON file.
+
+    Every push also notifies the build worker through a named pipe, so that the worker does not have to poll the queue.
+    See "BuildWorker.run".
+
+    When popping the next build, the pending builds for the same repository and branch are coalesced according to the
+    "ci.coalesce_policy" config option (See "ufotest.ci.build_queue.coalesce"). The builds which are dropped this way
+    are recorded in the "build.superseded" file and can be retrieved with "BuildQueue.get_superseded".
+    """
+    QUEUE_FILE_NAME = 'build.queue'
+    DATABASE_FILE_NAME = 'build_queue.db'
+    NOTIFY_FILE_NAME = 'build.notify'
+    SUPERSEDED_FILE_NAME = 'build.superseded'
 
-    QUEUE_PATH = os.path.join(UFOTEST_PATH, 'build.queue')
+    @classmethod
+    def get_backend(cls) -> AbstractQueueBackend:
+        """
+        Returns a new instance of the queue backend, which is selected in the config. An unknown backend name falls
+        back to the sqlite backend.
+
+        Installations of older versions store the queue in the "build.queue" JSON file. If this file still exists
+        when the sqlite backend is used, all the pending builds are moved from it into the database first, so that no
+        builds are lost with the upgrade.
+
+        :returns: The backend object
+        """
+        name = Config().get_data_or_default(['ci', 'queue_backend'], SqliteQueueBackend.name)
+        backend_class = QUEUE_BACKENDS.get(name, SqliteQueueBackend)
+
+        if backend_class is JsonQueueBackend:
+            return JsonQueueBackend(get_path(cls.QUEUE_FILE_NAME))
+
+        backend = backend_class(get_path(cls.DATABASE_FILE_NAME))
+        legacy_path = get_path(cls.QUEUE_FILE_NAME)
+        if isinstance(backend, SqliteQueueBackend) and os.path.exists(legacy_path):
+            backend.extend(JsonQueueBackend(legacy_path).drain())
+
+        return backend
+
+    @classmethod
+    def get_notifier(cls) -> QueueNotifier:
+        return QueueNotifier(get_path(cls.NOTIFY_FILE_NAME))
+
+    @classmethod
+    def push(cls, build: dict) -> None:
+        """
+        Appends the *build* request dict to the queue and wakes up the build worker.
+
+        :returns: void
+        """
+        cls.get_backend().push(build)
+        cls.get_notifier().notify()
 
     @classmethod
-    def push(cls, build: dict):
-        queue = cls.read()
-        queue.append(build)
-        cls.write(queue)
+    def get_policy(cls) -> Tuple[str, int]:
+        """
+        Returns the coalescing policy and the n for the "every_nth" policy, as they are defined in the config.
+
+        :returns: A tuple (policy, every)
+        """
+        config = Config()
+        policy = config.get_data_or_default(['ci', 'coalesce_policy'], ALWAYS)
+        every = config.get_data_or_default(['ci', 'coalesce_every'], 5)
+
+        return policy, every
 
     @classmethod
     def pop(cls) -> dict:
-        queue = cls.read()
-        build = queue.pop(0)
-        cls.write(queue)
+        """
+        Removes the next build request from the queue and returns it. Depending on the coalescing policy, this is not
+        necessarily the first request in the queue, in which case the older requests for the same branch are dropped
+        and recorded as superseded. The returned dict contains the additional key "enqueued" with the unix timestamp of
+        when the request was added to the queue.
+
+        :raises IndexError: If the queue is empty
+
+        :returns: The build request dict
+        """
+        policy, every = cls.get_policy()
+        build, dropped = cls.get_backend().take(lambda items: coalesce(items, policy, every))
+        if build is None:
+            raise IndexError('pop from empty build queue')
+
+        for dropped_build in dropped:
+            cls.record_superseded(dropped_build, build, 'coalesced')
 
         return build
 
     @classmethod
-    def is_empty(cls):
-        queue = cls.read()
-        return len(queue) == 0
+    def is_superseded(cls, build: dict) -> bool:
+        """
+        Returns whether the given *build*, which is currently running, has been superseded by the pending builds for
+        the same repository and branch. With the "latest" policy, this is the case as soon as a single newer build is
+        pending, with the "every_nth" policy once n newer builds are pending. With the "always" policy a build is never
+        superseded.
+
+        :returns bool:
+        """
+        policy, every = cls.get_policy()
+        if policy == ALWAYS:
+            return False
+
+        key = get_build_key(build)
+        pending = [item for item in cls.get_backend().items() if get_build_key(item) == key]
+        return len(pending) >= (1 if policy == LATEST else max(every, 1))
 
     @classmethod
-    def read(cls) -> list:
-        with open(cls.QUEUE_PATH, mode='r') as file:
-            data = file.read()
-            return json.loads(data)
+    def record_superseded(cls, build: dict, superseded_by: Optional[dict], reason: str) -> None:
+        """
+        Appends the given *build*, which will not be built (to completion), to the record of superseded builds.
+
+        :param build: The build request dict, which was dropped
+        :param superseded_by: The more recent build request, because of which it was dropped
+        :param reason: A string describing why the build was dropped. Either "coalesced" if it was dropped from the
+            queue or "canceled" if it was already running
+
+        :returns: void
+        """
+        record = {
+            'time':             time.time(),
+            'reason':           reason,
+            'enqueued':         build.get('enqueued'),
+            'repository':       get_build_key(build)[0],
+            'ref':              build.get('ref'),
+            'commit':           build.get('commits', [None])[-1],
+            'superseded_by':    None if superseded_by is None else superseded_by.get('commits', [None])[-1]
+        }
+        # Appending a single line is atomic, so there is no need to lock the file
+        with open(get_path(cls.SUPERSEDED_FILE_NAME), mode='a') as file:
+            file.write(json.dumps(record) + '\n')
 
     @classmethod
-    def write(cls, data: list):
-        with open(cls.QUEUE_PATH, mode='w') as file:
-            file.write(json.dumps(data))
+    def get_superseded(cls, limit: Optional[int] = None) -> List[dict]:
+        """
+        Returns the records of the superseded builds, with the most recent one first.
+
+        :param limit: The max number of records to return. None for all of them
+
+        :returns: A list of dicts
+        """
+        path = get_path(cls.SUPERSEDED_FILE_NAME)
+        if not os.path.exists(path):
+            return []
+
+        with open(path, mode='r') as file:
+            records = [json.loads(line) for line in file if line.strip()]
+
+        return records[::-1][:limit]
+
+    @classmethod
+    def is_empty(cls) -> bool:
+        return len(cls.get_backend()) == 0
+
+    @classmethod
+    def stats(cls) -> Dict[str, float]:
+        """
+        Returns a dict with the number of pending builds ("depth") and the time in seconds for which the oldest of
+        them has been waiting ("wait_time").
+
+        :returns dict:
+        """
+        return cls.get_backend().stats()
@@ -0,0 +1,437 @@
+"""
+This module contains the persistent backends for the build queue and the notification mechanism, with which the web
+server wakes up the build worker process whenever a new build has been added to the queue.
+
+**DESIGN CHOICE**
+
+Originally the build queue was a single JSON file "build.queue", which contained the list of all the pending build
+requests. Every push and pop read, parsed and rewrote this whole file without any kind of locking. Two webhook
+requests arriving at the same time could thus overwrite each others changes and silently lose a build. On top of that
+the build worker checked the queue once every second, which means it parsed the file over and over again while doing
+nothing.
+
+The queue is now implemented by exchangeable backends: The "SqliteQueueBackend" (the default) stores the requests in
+a SQLite table, where pushing and popping are single transactions. The "JsonQueueBackend" keeps the original file
+format as a compatibility mode, but now guards every operation with an exclusive file lock. The backend is selected
+with the "ci.queue_backend" config option.
+
+Instead of polling, the build worker blocks on a named pipe (See "QueueNotifier"). Every push writes a single byte into
+this pipe, which immediately wakes up the worker. The worker still wakes up after a (long) timeout on its own, so that
+builds which have been added to the queue by some other means are not stuck forever.
+
+**COALESCING**
+
+A burst of pushes to the source repository creates one build request per push. Each build includes flashing the
+camera and running the whole test suite, which can take hours, so building every stale commit would block the camera
+for no good reason. When a build is popped from the queue, the pending requests for the same repository and branch are
+therefore coalesced according to a policy (See "coalesce"): ALWAYS builds every single request, LATEST only builds the
+most recent one and EVERY_NTH builds every n-th of the pending requests. The requests, which are dropped this way, are
+returned alongside the popped one, so that they can still be recorded.
+"""
+import os
+import json
+import time
+import errno
+import fcntl
+import select
+import sqlite3
+import contextlib
+from abc import abstractmethod
+from typing import Optional, List, Dict, Type, Iterator, Tuple, Callable
+
+#: Every build request is built, no matter how many more recent requests for the same branch are pending
+ALWAYS = 'always'
+#: Only the most recent of the pending requests for the same branch is built, all older ones are dropped
+LATEST = 'latest'
+#: Of the pending requests for the same branch, only every n-th is built
+EVERY_NTH = 'every_nth'
+
+COALESCE_POLICIES = [ALWAYS, LATEST, EVERY_NTH]
+
+# A function, which receives the list of all pending items of the queue and returns the index of the item to be popped
+# and the list of indices of the items to be dropped.
+Selector = Callable[[List[dict]], Tuple[int, List[int]]]
+
+
+def get_build_key(build: dict) -> Tuple[str, str]:
+    """
+    Returns the tuple of repository url and branch ref of the given *build* request. Builds with the same key can be
+    coalesced.
+
+    :returns: A tuple (clone url, ref)
+    """
+    return build.get('repository', {}).get('clone_url', ''), build.get('ref', '')
+
+
+def coalesce(items: List[dict], policy: str = ALWAYS, every: int = 1) -> Tuple[int, List[int]]:
+    """
+    Decides which of the pending build request *items* is to be built next, according to the coalescing *policy*.
+
+    The next build is always chosen from the requests with the same repository and branch as the first item in the
+    queue. With the ALWAYS policy this is simply the first item. With the LATEST policy it is the most recent of these
+    requests and all the older ones are dropped. With the EVERY_NTH policy, the *every*-th request is built and all the
+    requests before it are dropped. If there are less than *every* pending requests the most recent one is built.
+
+    :param items: The list of pending build requests in the order in which they have been pushed
+    :param policy: One of ALWAYS, LATEST and EVERY_NTH
+    :param every: The n for the EVERY_NTH policy
+
+    :raises ValueError: If the policy does not exist
+
+    :returns: A tuple of the index of the item which is to be built and the list of indices of the dropped items
+    """
+    if policy not in COALESCE_POLICIES:
+        raise ValueError(f'The build coalescing policy "{policy}" does not exist. Use one of {COALESCE_POLICIES}')
+
+    key = get_build_key(items[0])
+    indices = [index for index, item in enumerate(items) if get_build_key(item) == key]
+
+    if policy == LATEST:
+        position = len(indices) - 1
+    elif policy == EVERY_NTH:
+        position = min(max(every, 1), len(indices)) - 1
+    else:
+        position = 0
+
+    return indices[position], indices[:position]
+
+
+class AbstractQueueBackend(object):
+    """
+    This is the abstract base class for the persistent storage of the build queue. A backend is constructed with the
+    path of the file in which the queue is stored.
+
+    Each item in the queue is a build request dict (See "BuildWorker"). Besides the request itself, the backends also
+    store the time at which each request was added to the queue, which is used to report the waiting times.
+
+    Both the "push" and the "pop" method have to be atomic, even if they are called from different processes.
+    """
+    #: This is the string name with which the backend can be selected in the config file
+    name = 'abstract'
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @abstractmethod
+    def push(self, build: dict) -> None:
+        """
+        Appends the given *build* request dict to the end of the queue.
+
+        :returns: void
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def take(self, select: Selector) -> Tuple[Optional[dict], List[dict]]:
+        """
+        Atomically removes one build request and possibly several dropped requests from the queue. The function
+        *select* receives the list of all pending requests and returns the index of the request to be taken and the
+        list of indices of the requests to be dropped (See "coalesce"). It is only called if the queue is not empty.
+
+        All the returned dicts contain the additional key "enqueued" with the unix timestamp of when the request was
+        added to the queue.
+
+        :returns: A tuple of the taken build request (None if the queue is empty) and the list of dropped requests
+        """
+        raise NotImplementedError()
+
+    def pop(self) -> Optional[dict]:
+        """
+        Removes the first build request from the queue and returns it.
+
+        :returns: The build request dict or None if the queue is empty
+        """
+        build, _ = self.take(lambda items: (0, []))
+        return build
+
+    @abstractmethod
+    def items(self) -> List[dict]:
+        """
+        Returns a list of all the build requests, which are currently in the queue, in the order in which they will be
+        popped. Each dict also contains the "enqueued" timestamp.
+
+        :returns: A list of dicts
+        """
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns a dict with statistics about the current state of the queue. The key "depth" is the number of pending
+        build requests and "wait_time" is the time in seconds for which the oldest of these requests has been waiting.
+
+        :returns dict:
+        """
+        items = self.items()
+        oldest = min([item['enqueued'] for item in items], default=None)
+
+        return {
+            'depth':        len(items),
+            'wait_time':    0 if oldest is None else time.time() - oldest
+        }
+
+
+class JsonQueueBackend(AbstractQueueBackend):
+    """
+    Stores the build queue as a JSON list within a single file. This is the original format of the "build.queue"
+    file, all the operations read and rewrite the whole file. Every operation holds an exclusive lock on a separate
+    lock file, so that concurrent operations from different processes cannot overwrite each others changes.
+    """
+    name = 'json'
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        with open(f'{self.path}.lock', mode='w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def push(self, build: dict) -> None:
+        with self.lock():
+            queue = self.read()
+            # Older versions did not record the time at which a build was added
+            queue.append({**build, 'enqueued': time.time()})
+            self.write(queue)
+
+    def take(self, select: Selector) -> Tuple[Optional[dict], List[dict]]:
+        with self.lock():
+            queue = self.read()
+            if len(queue) == 0:
+                return None, []
+
+            # Older versions did not record the time at which a build was added
+            queue = [{'enqueued': time.time(), **build} for build in queue]
+            index, dropped_indices = select(queue)
+            removed = {index, *dropped_indices}
+            self.write([build for i, build in enumerate(queue) if i not in removed])
+
+        return queue[index], [queue[i] for i in dropped_indices]
+
+    def items(self) -> List[dict]:
+        with self.lock():
+            queue = self.read()
+
+        return [{'enqueued': time.time(), **build} for build in queue]
+
+    def drain(self) -> List[dict]:
+        """
+        Atomically removes all the build requests from the queue and deletes the queue file.
+
+        :returns: A list of all the build requests, which were in the queue
+        """
+        with self.lock():
+            queue = self.read()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+        return [{'enqueued': time.time(), **build} for build in queue]
+
+    def read(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, mode='r') as file:
+            return json.loads(file.read() or '[]')
+
+    def write(self, data: list) -> None:
+        # The new content is first written to a temporary file, which then replaces the queue file. That way the queue
+        # file is never left in a half written state.
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, mode='w') as file:
+            file.write(json.dumps(data))
+        os.replace(temp_path, self.path)
+
+
+class SqliteQueueBackend(AbstractQueueBackend):
+    """
+    Stores the build queue within a SQLite table. The requests are popped in the order of their auto incremented id.
+    Popping a request is a single "IMMEDIATE" transaction, so two workers can never pop the same request.
+    """
+    name = 'sqlite'
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS queue ('
+        '   id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        '   enqueued REAL NOT NULL,'
+        '   data TEXT NOT NULL'
+        ');'
+    )
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        # "isolation_level=None" disables the implicit transactions of the sqlite3 module, so that the transactions
+        # can be started explicitly with the required locking mode.
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.executescript(self.SCHEMA)
+            yield connection
+        finally:
+            connection.close()
+
+    def push(self, build: dict) -> None:
+        with self.connect() as connection:
+            connection.execute('INSERT INTO queue (enqueued, data) VALUES (?, ?)', (time.time(), json.dumps(build)))
+
+    def extend(self, builds: List[dict]) -> None:
+        """
+        Appends all the given *builds* to the end of the queue. Other than with "push", the "enqueued" timestamps of
+        the builds are kept, if they have one.
+
+        :returns: void
+        """
+        rows = []
+        for build in builds:
+            data = dict(build)
+            enqueued = data.pop('enqueued', time.time())
+            rows.append((enqueued, json.dumps(data)))
+
+        with self.connect() as connection:
+            connection.executemany('INSERT INTO queue (enqueued, data) VALUES (?, ?)', rows)
+
+    def take(self, select: Selector) -> Tuple[Optional[dict], List[dict]]:
+        with self.connect() as connection:
+            # The write lock is acquired right away, so no other process can take any of the same requests
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = connection.execute('SELECT id, enqueued, data FROM queue ORDER BY id').fetchall()
+                if len(rows) == 0:
+                    connection.execute('COMMIT')
+                    return None, []
+
+                items = [{**json.loads(data), 'enqueued': enqueued} for _, enqueued, data in rows]
+                index, dropped_indices = select(items)
+                connection.executemany('DELETE FROM queue WHERE id = ?',
+                                       [(rows[i][0], ) for i in [index, *dropped_indices]])
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+        return items[index], [items[i] for i in dropped_indices]
+
+    def items(self) -> List[dict]:
+        with self.connect() as connection:
+            rows = connection.execute('SELECT enqueued, data FROM queue ORDER BY id').fetchall()
+
+        return [{**json.loads(data), 'enqueued': enqueued} for enqueued, data in rows]
+
+    def __len__(self) -> int:
+        with self.connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+
+#: This dict maps the string names, which can be used for the "ci.queue_backend" config option to the corresponding
+#: backend classes.
+QUEUE_BACKENDS: Dict[str, Type[AbstractQueueBackend]] = {
+    JsonQueueBackend.name: JsonQueueBackend,
+    SqliteQueueBackend.name: SqliteQueueBackend
+}
+
+
+class QueueNotifier(object):
+    """
+    A named pipe, through which the processes which push new builds into the queue can wake up the build worker.
+
+    The worker calls "wait", which blocks until either some other process calls "notify" or the timeout expires. If
+    the worker is not running, a notification is simply discarded. The queue itself is persistent, so the worker will
+    pick up the build once it is started again.
+
+    :param path: The path of the named pipe
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.read_fd: Optional[int] = None
+        self.write_fd: Optional[int] = None
+
+    def ensure_pipe(self) -> None:
+        if not os.path.exists(self.path):
+            try:
+                os.mkfifo(self.path)
+            except FileExistsError:
+                pass
+
+    def notify(self) -> None:
+        """
+        Wakes up the process which is currently waiting on this pipe, if there is one.
+
+        :returns: void
+        """
+        self.ensure_pipe()
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as error:
+            # ENXIO means, that there is no process which has opened the pipe for reading
+            if error.errno == errno.ENXIO:
+                return
+            raise
+
+        try:
+            os.write(fd, b'\x00')
+        except BlockingIOError:
+            # The pipe buffer is full of notifications, which the worker has not yet consumed. Another one makes no
+            # difference.
+            pass
+        finally:
+            os.close(fd)
+
+    def open(self) -> None:
+        """
+        Opens the pipe for reading. This has to be done before the first call to "wait" and should be done before the
+        queue is checked for the first time, so that no notification is lost in between.
+
+        :returns: void
+        """
+        self.ensure_pipe()
+        self.read_fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        # As long as this process also holds a write end of the pipe, the read end never reaches EOF after another
+        # process closes its write end. Otherwise "select" would report the pipe as permanently readable.
+        self.write_fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def close(self) -> None:
+        for fd in [self.read_fd, self.write_fd]:
+            if fd is not None:
+                os.close(fd)
+
+        self.read_fd = self.write_fd = None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until a notification arrives or the *timeout* in seconds expires. All the pending notifications are
+        consumed at once.
+
+        :returns: True if there was a notification, False if the timeout expired
+        """
+        readable, _, _ = select.select([self.read_fd], [], [], timeout)
+        if not readable:
+            return False
+
+        self.drain()
+        return True
+
+    def drain(self) -> None:
+        """
+        Consumes all the pending notifications without blocking.
+
+        :returns: void
+        """
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def fileno(self) -> int:
+        # This makes it possible to wait for notifications together with other file descriptors, for example with
+        # "multiprocessing.connection.wait"
+        return self.read_fd
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
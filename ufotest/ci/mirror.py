@@ -0,0 +1,133 @@
+"""
+This module contains the "GitMirror", which maintains a persistent local mirror of the source repository, from which
+the build process checks out the commit to be built.
+
+**DESIGN CHOICE**
+
+Originally every build cloned the whole source repository from the remote server into the installation folder,
+checked out the commit, copied the entire clone (including the ".git" folder with the complete history) into the build
+folder and then deleted the clone again. For a large firmware repository with lots of bitfiles in its history, this
+network transfer was the bulk of the time of a build, which was not spent on the hardware.
+
+Now there is a bare mirror of the repository within the "mirrors" folder of the installation. It is cloned only once
+and afterwards merely updated with "git fetch", which only transfers the objects which are new since the last build.
+The commit for a build is then checked out as a detached worktree of this mirror, which does not copy any history.
+"""
+import os
+import shutil
+import subprocess
+from typing import Optional
+
+from ufotest.config import get_path
+from ufotest.util import get_repository_name, cprint
+from ufotest.exceptions import BuildError
+
+
+class GitMirror(object):
+    """
+    A persistent bare mirror of the git repository at *repository_url*.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        mirror = GitMirror('https://github.com/the16thpythonist/ufo-mock.git')
+        # Clones the mirror the first time, afterwards only fetches the new commits
+        mirror.update()
+        commit = mirror.resolve('FETCH_HEAD', branch='main')
+        mirror.add_worktree('/tmp/ufo-mock', commit)
+        # ...
+        mirror.remove_worktree('/tmp/ufo-mock')
+
+    :param repository_url: The url of the remote repository
+    :param path: The path of the bare mirror repository. Defaults to a folder with the name of the repository within
+        the "mirrors" folder of the installation.
+    """
+    def __init__(self, repository_url: str, path: Optional[str] = None):
+        self.repository_url = repository_url
+        self.repository_name = get_repository_name(repository_url)
+        self.path = get_path('mirrors', f'{self.repository_name}.git') if path is None else path
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.path, 'HEAD'))
+
+    def git(self, command: str, *args: str, cwd: Optional[str] = None) -> str:
+        """
+        Runs the git *command* with the additional *args* within the mirror repository (or *cwd* if given) and returns
+        its output.
+
+        :raises BuildError: If the git command fails
+
+        :returns: The stripped stdout of the command
+        """
+        completed_process = subprocess.run(
+            ['git', command, *args],
+            cwd=self.path if cwd is None else cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if completed_process.returncode:
+            error = completed_process.stderr.decode().strip()
+            raise BuildError(f'git {command} failed for the repository "{self.repository_url}": {error}')
+
+        return completed_process.stdout.decode().strip()
+
+    def update(self) -> None:
+        """
+        Brings the mirror up to date with the remote repository. If the mirror does not exist yet, it is cloned.
+        Otherwise only the new objects are fetched.
+
+        :raises BuildError: If the mirror could not be cloned or fetched
+
+        :returns: void
+        """
+        if not self.exists():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path):
+                shutil.rmtree(self.path)
+
+            self.git('clone', '--mirror', self.repository_url, self.path, cwd=os.path.dirname(self.path))
+            cprint(f'Created git mirror: {self.path}')
+        else:
+            # A mirror clone maps all the remote refs directly onto the local refs, so this also updates the branches
+            self.git('fetch', '--prune', 'origin')
+            cprint(f'Updated git mirror: {self.path}')
+
+    def resolve(self, commit: str, branch: Optional[str] = None) -> str:
+        """
+        Returns the full hash of the given *commit*. If the commit is "FETCH_HEAD", the most recent commit of the given
+        *branch* is used instead.
+
+        :raises BuildError: If the commit does not exist within the mirror
+
+        :returns: The commit hash
+        """
+        if commit == 'FETCH_HEAD':
+            commit = f'refs/heads/{branch}' if branch else 'HEAD'
+
+        return self.git('rev-parse', '--verify', f'{commit}^{{commit}}')
+
+    def add_worktree(self, path: str, commit: str) -> None:
+        """
+        Checks out the given *commit* as a detached worktree into the folder *path*, which must not exist yet.
+
+        :raises BuildError: If the worktree could not be created
+
+        :returns: void
+        """
+        # Worktrees of previous builds, whose folders have been deleted without git noticing, would otherwise block
+        # the same path from being used again.
+        self.git('worktree', 'prune')
+        self.git('worktree', 'add', '--detach', '--force', path, commit)
+
+    def remove_worktree(self, path: str) -> None:
+        """
+        Removes the worktree folder *path* and unregisters it from the mirror.
+
+        :returns: void
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        if self.exists():
+            self.git('worktree', 'prune')
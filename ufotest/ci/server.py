@@ -1,21 +1,31 @@
 import os
 import json
 import time
+import signal
 import smtplib
-import datetime
 import shutil
+import threading
+import multiprocessing
+import multiprocessing.connection
+from typing import Dict, Optional
 
 import click
-from flask import Flask, request, send_from_directory, jsonify
+from flask import Flask, Response, request, send_from_directory, jsonify
 
 from ufotest.config import Config, get_path
 from ufotest.util import get_template, get_version
 from ufotest.util import cerror, cprint, cresult
 from ufotest.util import get_build_reports, get_test_reports
-from ufotest.util import get_folder_size, format_byte_size
-from ufotest.exceptions import BuildError
-from ufotest.camera import UfoCamera
+from ufotest.util import format_byte_size
+from ufotest.util import HTMLTemplateMixin
+from ufotest.exceptions import BuildError, BuildCanceledError
+from ufotest.camera import AbstractCamera, UfoCamera
+from ufotest.index import ReportIndex, TEST, BUILD
+from ufotest.usage import DiskUsageTracker
+from ufotest.retention import ArchiveCollector, COMPACT, DELETE
+from ufotest.progress import ProgressReader
 from ufotest.ci.build import BuildQueue, BuildLock, BuildRunner, BuildReport, build_context_from_request
+from ufotest.ci.build_queue import QueueNotifier
 from ufotest.ci.mail import send_report_mail
 
 CONFIG = Config()
@@ -62,8 +72,15 @@ class BuildWorker(object):
     This class wraps the main loop which is responsible for actually executing the build jobs.
 
     This class was designed so that it's run method could essentially be used as the main loop of an entirely different
-    subprocess. Its main loop periodically checks the build queue for the case that new build jobs have arrived over
-    the web server.
+    subprocess. Its main loop blocks until the web server notifies it about a new build job in the build queue (see
+    "BuildQueue.push"). As a safety net, the queue is also checked after a timeout of "ci.worker_timeout" seconds
+    without any notification. If the "archive.gc_interval" config option is set, the worker also applies the retention
+    policy to the archive in these intervals, whenever it is idle (see "ufotest.retention").
+
+    If the "ci.cancel_superseded" config option is enabled, each build runs in a child process. Whenever a new build
+    is pushed while a build is running, the worker checks if the running build has been superseded (See
+    "BuildQueue.is_superseded") and cancels it in that case. Note that commands which have already been started by the
+    build, like the flashing of the camera, are not interrupted, the build is canceled as soon as they return.
 
     **The build data**
 
@@ -89,41 +106,150 @@ class BuildWorker(object):
 
     This should have been committed
     """
-    def __init__(self):
+    def __init__(self, timeout: Optional[float] = None, stop_event: Optional[multiprocessing.Event] = None):
         self.running = True
+        # The worker is usually run in a separate process, in which case setting "running" has no effect. The process,
+        # which manages the worker, can set this event instead to stop the worker after the current build.
+        self.stop_event = stop_event
+        self.timeout = CONFIG.get_data_or_default(['ci', 'worker_timeout'], 60) if timeout is None else timeout
+        self.cancel_superseded = CONFIG.get_data_or_default(['ci', 'cancel_superseded'], False)
+        # The interval is configured in hours. 0 disables the regular collection of old reports
+        self.gc_interval = CONFIG.get_data_or_default(['archive', 'gc_interval'], 0) * 3600
+        self.last_collection = time.time()
 
     def run(self):
         try:
-            while self.running:
-                time.sleep(1)
-
-                if not BuildQueue.is_empty() and not BuildLock.is_locked():
-                    build_request = BuildQueue.pop()
+            # The notifier has to be opened before the queue is checked for the first time. Otherwise a build which is
+            # pushed in between would not wake up the worker.
+            with BuildQueue.get_notifier() as notifier:
+                while self.is_running():
+                    # A build which was started manually from the command line also holds the build lock. Releasing
+                    # the lock notifies the worker as well.
+                    if BuildLock.is_locked():
+                        notifier.wait(self.timeout)
+                        continue
 
                     try:
-                        # ~ RUN THE BUILD PROCESS
-                        build_report = self.run_build(build_request)  # raises: BuildError
-
-                        # ~ SEND REPORT MAILS
-                        # After the build process has terminated we want to inform the relevant people of the outcome.
-                        # This is mainly Two people: The maintainer of the repository is getting an email and pusher
-                        self.send_report_mails(build_request, build_report)
+                        build_request = BuildQueue.pop()
+                    except IndexError:
+                        if self.gc_interval and time.time() - self.last_collection >= self.gc_interval:
+                            self.collect_archive()
 
-                    except BuildError as error:
-                        cerror('The build process was terminated due to a build error!')
-                        cerror(str(error))
+                        notifier.wait(self.timeout)
+                        continue
 
-                    except smtplib.SMTPAuthenticationError as error:
-                        cerror('The email credentials provided in the config file were not accepted by the server!')
-                        cerror(str(error))
+                    wait_time = time.time() - build_request['enqueued']
+                    cprint(f'Starting build after {wait_time:.1f} seconds in the queue '
+                           f'({BuildQueue.stats()["depth"]} more builds pending)')
 
-                    except OSError as error:
-                        cerror('Report mails could not be sent because there is no network connection')
-                        cerror(str(error))
+                    if self.cancel_superseded:
+                        self.process_cancellable(build_request, notifier)
+                    else:
+                        self.process(build_request)
 
         except KeyboardInterrupt:
             cprint('\n...Stopping BuildWorker')
 
+    def is_running(self) -> bool:
+        return self.running and (self.stop_event is None or not self.stop_event.is_set())
+
+    def process(self, build_request: dict) -> None:
+        """Runs the build for the given *build_request*, which was popped from the queue, and sends the report mails.
+        Errors are only printed, so that the worker can continue with the next build.
+
+        :param build_request: A dict, which specifies the request, that triggered the build.
+        """
+        try:
+            # ~ RUN THE BUILD PROCESS
+            build_report = self.run_build(build_request)  # raises: BuildError
+
+            # ~ SEND REPORT MAILS
+            # After the build process has terminated we want to inform the relevant people of the outcome.
+            # This is mainly Two people: The maintainer of the repository is getting an email and pusher
+            self.send_report_mails(build_request, build_report)
+
+        # The cancel signal can also arrive outside of the build context, for example while the mails are sent
+        except BuildCanceledError as error:
+            cerror('The build process was canceled!')
+            cerror(str(error))
+
+        except BuildError as error:
+            cerror('The build process was terminated due to a build error!')
+            cerror(str(error))
+
+        except smtplib.SMTPAuthenticationError as error:
+            cerror('The email credentials provided in the config file were not accepted by the server!')
+            cerror(str(error))
+
+        except OSError as error:
+            cerror('Report mails could not be sent because there is no network connection')
+            cerror(str(error))
+
+    def collect_archive(self) -> None:
+        """Compacts and deletes old test and build reports according to the retention policy (see
+        "ufotest.retention"). This is called every "archive.gc_interval" hours while no build is running. Errors are
+        only printed, so that the worker can continue with the next build.
+        """
+        self.last_collection = time.time()
+        try:
+            results = ArchiveCollector(config=CONFIG).collect()
+            freed = sum(result['freed'] for result in results.values())
+            compacted = sum(result[COMPACT] for result in results.values())
+            deleted = sum(result[DELETE] for result in results.values())
+            cprint(f'Collected old reports: compacted {compacted}, deleted {deleted} '
+                   f'({format_byte_size(freed, "MB")} freed)')
+
+        except OSError as error:
+            cerror('The old reports could not be collected!')
+            cerror(str(error))
+
+    def process_cancellable(self, build_request: dict, notifier: QueueNotifier) -> bool:
+        """Runs the build for the given *build_request* in a child process. While the build is running, every
+        notification of the *notifier* triggers a check whether the build has been superseded, in which case it is
+        canceled and recorded as superseded.
+
+        :param build_request: A dict, which specifies the request, that triggered the build.
+        :param notifier: The opened notifier of the build queue
+
+        :returns: False if the build was canceled, True otherwise
+        """
+        # The child process is not a daemon, because the build itself starts process pools, which daemons can not do.
+        # But this also means, that the exit handler of multiprocessing would wait for the build to finish, should
+        # this worker process be terminated. This is why the child is explicitly terminated in that case.
+        process = multiprocessing.Process(target=self.process_child, args=(build_request, ))
+        process.start()
+
+        try:
+            while process.is_alive():
+                ready = multiprocessing.connection.wait([process.sentinel, notifier], timeout=self.timeout)
+                if notifier not in ready:
+                    continue
+
+                notifier.drain()
+                if BuildQueue.is_superseded(build_request):
+                    cerror('The running build has been superseded by a more recent push and will be canceled!')
+                    # The child process turns this signal into an exception, so that the build context is properly
+                    # exited, which releases the build lock and removes the incomplete build folder.
+                    process.terminate()
+                    process.join()
+                    BuildQueue.record_superseded(build_request, None, 'canceled')
+                    return False
+        except BaseException:
+            cerror('The build worker is stopped, the running build will be canceled!')
+            process.terminate()
+            process.join()
+            raise
+
+        process.join()
+        return True
+
+    def process_child(self, build_request: dict) -> None:
+        def cancel(signum, frame):
+            raise BuildCanceledError('The build has been superseded by a more recent build request')
+
+        signal.signal(signal.SIGTERM, cancel)
+        self.process(build_request)
+
     def run_build(self, build_request: dict) -> BuildReport:
         """Actually runs the build process based on the information in *build_request* and returns the build report.
 
@@ -160,6 +286,52 @@ class BuildWorker(object):
         send_report_mail(pusher_email, pusher_name, build_report)
 
 
+# The camera object which is used by the web interface to display the camera status. Creating a camera object for
+# every page request would also mean that its cached register snapshot is lost every time.
+CAMERAS: Dict[type, AbstractCamera] = {}
+CAMERAS_LOCK = threading.Lock()
+
+
+def get_camera() -> AbstractCamera:
+    """
+    Returns the camera object, which is shared by all the requests to the web interface. The camera class is determined
+    by the "camera_class" filter hook, a new object is only created when this class changes.
+
+    :returns: The camera object
+    """
+    camera_class = CONFIG.pm.apply_filter('camera_class', UfoCamera)
+    with CAMERAS_LOCK:
+        if camera_class not in CAMERAS:
+            CAMERAS.clear()
+            CAMERAS[camera_class] = camera_class(CONFIG)
+
+        return CAMERAS[camera_class]
+
+
+# The max number of reports, which can be requested for a single page of the report listings with the "limit" parameter
+MAX_PAGE_LIMIT = 100
+
+
+def get_report_page(kind: str) -> dict:
+    """
+    Returns the page of report summaries of the given *kind*, which is selected by the query parameters of the current
+    request. The supported parameters are "page" (the 1-based page number), "limit" (the number of reports per page)
+    and "before" (the cursor of the last report on the previous page, see "index.make_cursor"). For the returned dict see
+    "ReportIndex.page".
+
+    :raises ValueError: If the page or limit parameters are not integers
+
+    :returns dict:
+    """
+    default_limit = CONFIG.get_data_or_default(['ci', 'page_size'], 20)
+    limit = min(max(int(request.args.get('limit', default_limit)), 1), MAX_PAGE_LIMIT)
+    page = max(int(request.args.get('page', 1)), 1)
+    before = request.args.get('before') or None
+
+    report_page = ReportIndex(config=CONFIG).page(kind, page=page, limit=limit, before=before)
+    return CONFIG.pm.apply_filter('report_page', report_page, kind=kind)
+
+
 server = Flask('UfoTest CI Server', static_folder=None)
 
 
@@ -179,10 +351,11 @@ def home():
     # The integer amount of how many items to be shown for both the most recent test and most recent build reports.
     recent_count = CONFIG.pm.apply_filter('home_recent_count', 5)
 
-    test_reports = get_test_reports()
-
-    recent_builds = get_build_reports()[:recent_count]
-    recent_tests = test_reports[:recent_count]
+    # Only the most recent reports are actually loaded from the report index, the total number of reports is a simple
+    # count query.
+    recent_builds = get_build_reports(limit=recent_count)[:recent_count]
+    recent_tests = get_test_reports(limit=recent_count)[:recent_count]
+    test_report_count = ReportIndex(config=CONFIG).count(TEST)
 
     # So we derive the summary values about the state of the hardware and firmware from the most recent test report. On
     # default the test reports returned by "get_test_reports" are sorted by recentness, which would mean that we would
@@ -195,8 +368,9 @@ def home():
     if len(recent_builds) != 0:
         most_recent_build_report = sorted(recent_builds, key=lambda d: d['start_iso'], reverse=True)[0]
 
-    camera_class = CONFIG.pm.apply_filter('camera_class', UfoCamera)
-    camera = camera_class(CONFIG)
+    # The camera object is shared between the requests, which means that "poll" can reuse a recent register snapshot
+    camera = get_camera()
+    camera_class = camera.__class__
 
     status_summary = [
         # UFOTEST INFORMATION
@@ -213,7 +387,7 @@ def home():
         {
             'id': 'report-count',
             'label': 'Total Test Reports',
-            'value': len(test_reports)
+            'value': test_report_count
         },
         {
             'id': 'loaded-plugins',
@@ -275,7 +449,9 @@ def home():
 
     # ~ CALCULATING DISK USAGE
     # TODO: The unit is hardcoded. This could be part of the config. Super low prio though
-    used_space = get_folder_size(CONFIG.get_path())
+    # The used space is not measured here, but read from the running totals of the disk usage tracker. These are
+    # updated whenever a report is saved.
+    used_space = DiskUsageTracker(config=CONFIG).total()
 
     # https://stackoverflow.com/questions/48929553/get-hard-disk-size-in-python
     _, _, free_space = shutil.disk_usage('/')
@@ -362,62 +538,124 @@ def push_gitlab():
     return 'New build added to the queue', 200
 
 
+@server.route('/api/queue')
+def queue_api():
+    """
+    Returns the current state of the build queue as JSON: The number of pending builds as "depth", the time in seconds
+    for which the oldest of them has been waiting as "wait_time", whether a build is currently running as "running" and
+    the records of the 10 most recently superseded builds as "superseded".
+    """
+    return jsonify({
+        **BuildQueue.stats(),
+        'running':      BuildLock.is_locked(),
+        'superseded':   BuildQueue.get_superseded(limit=10)
+    }), 200
+
+
+# The max number of seconds for which a single request to the progress routes is kept open. Browsers automatically
+# reconnect to the event stream, so this only limits how long a single server thread is blocked by one client.
+PROGRESS_TIMEOUT = 60
+
+
+@server.route('/progress')
+def progress():
+    """
+    Returns the live run page, which displays the progress of the current (or most recent) test run as it happens.
+    """
+    template = get_template('progress.html')
+    return template.render({}), 200
+
+
+@server.route('/progress/stream')
+def progress_stream():
+    """
+    Streams the progress events of the current test run as Server-Sent Events. A reconnecting client only receives the
+    events after the "Last-Event-ID" header (or the "after" query parameter).
+    """
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError as e:
+        return str(e), 400
+
+    def generate():
+        yield 'retry: 1000\n\n'
+        for event in ProgressReader().follow(after=after, timeout=PROGRESS_TIMEOUT):
+            yield f'id: {event["id"]}\ndata: {json.dumps(event)}\n\n'
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@server.route('/api/progress')
+def progress_api():
+    """
+    The long polling alternative to the event stream. Returns the progress events with an id greater than the "after"
+    query parameter as JSON. If there are none yet, the request blocks for at most "timeout" seconds until new events
+    arrive.
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        timeout = min(float(request.args.get('timeout', 30)), PROGRESS_TIMEOUT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'events': ProgressReader().wait(after=after, timeout=timeout)}), 200
+
+
 @server.route('/archive')
 def archive_list():
-    reports = []
-    for root, folders, files in os.walk(ARCHIVE_PATH):
-        for folder in folders:
-            folder_path = os.path.join(root, folder)
-            report_json_path = os.path.join(folder_path, 'report.json')
-
-            # We really need to check for the existence here because of the following case: A test run has been started
-            # but is not yet complete. In this case the test folder already exists, but the report does not. In this
-            # case attempting to open the file would cause an exception!
-            if os.path.exists(report_json_path):
-                with open(report_json_path, mode='r') as report_json_file:
-                    report = json.loads(report_json_file.read())
-                    reports.append(report)
-
-        break
-
-    sorted_reports = sorted(
-        reports,
-        key=lambda r: datetime.datetime.fromisoformat(r['start_iso']),
-        reverse=True
-    )
+    # Only the summaries of a single page of reports are loaded from the report index, so that the time to render this
+    # page does not depend on the size of the archive.
+    try:
+        report_page = get_report_page(TEST)
+    except ValueError as e:
+        return str(e), 400
 
     template = get_template('archive_list.html')
-    return template.render({'reports': sorted_reports}), 200
+    return template.render({'reports': report_page['reports'], 'pagination': report_page}), 200
+
+
+@server.route('/api/archive')
+def archive_api():
+    try:
+        return jsonify(get_report_page(TEST)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @server.route('/archive/<path:path>')
 def archive_detail(path):
+    # The report.json contains everything to render the report.html. If the html file is missing (because it was
+    # deleted or never written), it is rendered on demand.
+    folder, name = os.path.split(path)
+    folder_path = os.path.realpath(os.path.join(ARCHIVE_PATH, folder))
+    json_path = os.path.join(folder_path, 'report.json')
+    # Only the report folders directly within the archive folder are considered
+    is_report_folder = os.path.dirname(folder_path) == os.path.realpath(ARCHIVE_PATH)
+    if name == 'report.html' and is_report_folder and not os.path.exists(os.path.join(folder_path, name)) and \
+            os.path.exists(json_path):
+        with open(json_path, mode='r') as file:
+            return HTMLTemplateMixin.html_from_dict(json.load(file)), 200
+
     return send_from_directory(ARCHIVE_PATH, path)
 
 
 @server.route('/builds')
 def builds_list():
-    reports = []
-    for root, folders, files in os.walk(BUILDS_PATH):
-        for folder in folders:
-            folder_path = os.path.join(root, folder)
-            report_json_path = os.path.join(folder_path, 'report.json')
-
-            if os.path.exists(report_json_path):
-                with open(report_json_path, mode='r') as report_json_file:
-                    report = json.loads(report_json_file.read())
-                    reports.append(report)
+    try:
+        report_page = get_report_page(BUILD)
+    except ValueError as e:
+        return str(e), 400
 
-        break
+    template = get_template('builds_list.html')
+    return template.render({'reports': report_page['reports'], 'pagination': report_page}), 200
 
-    sorted_reports = sorted(
-        reports,
-        key=lambda r: datetime.datetime.fromisoformat(r['start_iso']),
-        reverse=True
-    )
 
-    template = get_template('builds_list.html')
-    return template.render({'reports': sorted_reports}), 200
+@server.route('/api/builds')
+def builds_api():
+    try:
+        return jsonify(get_report_page(BUILD)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @server.route('/builds/<path:path>')
@@ -0,0 +1,280 @@
+"""
+This module contains the serving backends for the CI server and the "CIServerSupervisor", which runs the web server
+together with the build worker.
+
+**DESIGN CHOICE**
+
+Originally "ufotest ci serve" simply called "server.run", which is the development server of flask, and started the
+build worker as an unmanaged sibling process. The development server is not meant for production use. Every request
+is handled by the same process, so a single slow request (a large archive listing for example) delays the webhook
+requests of GitHub and GitLab, which then run into their timeouts. When the server was stopped, the build worker was
+simply killed in the middle of a build.
+
+Now the server can be run by different serving backends, which are selected with the "ci.serving_backend" option:
+
+- "gunicorn": A pre-forking WSGI server with "ci.server_workers" processes, each of which handles up to
+  "ci.server_threads" requests at the same time. This is the recommended backend.
+- "waitress": A pure python WSGI server, which handles requests within a single process, but with
+  "ci.server_threads" threads.
+- "flask": The development server of flask with one thread per request. This is always available.
+- "auto": The first of the above, which is installed.
+
+gunicorn and waitress are optional dependencies, they are only imported when they are actually used.
+
+The supervisor starts the build worker as a managed sibling process before the web server. When the server is stopped
+(with Ctrl+C or SIGTERM), the worker is asked to stop via an event and is given "ci.shutdown_timeout" seconds to finish
+the current build. Only after that, it is terminated. The webhook routes only push the build into the queue, so they
+are always answered right away, independent of the builds and of the other requests.
+"""
+import signal
+import importlib.util
+import multiprocessing
+from typing import Optional, Dict, Type, List
+
+from flask import Flask
+
+from ufotest.config import Config, CONFIG
+from ufotest.util import cprint, cerror
+from ufotest.ci.build import BuildQueue
+from ufotest.ci.server import BuildWorker
+
+
+class AbstractServingBackend(object):
+    """
+    The abstract base class for the WSGI servers, which can run the flask app of the CI server.
+
+    :param workers: The number of worker processes
+    :param threads: The number of threads per worker process
+    :param shutdown_timeout: The number of seconds, which running requests are given to finish on shutdown
+    """
+    #: The name of the python module, which has to be installed to use this backend. None if there is no such module
+    module: Optional[str] = None
+
+    def __init__(self, workers: int = 2, threads: int = 8, shutdown_timeout: float = 30):
+        self.workers = workers
+        self.threads = threads
+        self.shutdown_timeout = shutdown_timeout
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return cls.module is None or importlib.util.find_spec(cls.module) is not None
+
+    def serve(self, app: Flask, host: str, port: int) -> None:
+        """
+        Runs the given flask *app* on the given *host* and *port*. This method blocks until the server is stopped.
+
+        :returns: void
+        """
+        raise NotImplementedError()
+
+
+class FlaskServingBackend(AbstractServingBackend):
+    """
+    The development server of flask, which handles every request in a new thread. The numbers of workers and threads
+    are ignored.
+    """
+    def serve(self, app: Flask, host: str, port: int) -> None:
+        app.run(host=host, port=port, threaded=True)
+
+
+class WaitressServingBackend(AbstractServingBackend):
+    """
+    The waitress WSGI server, which handles the requests with a pool of threads within a single process. The number of
+    workers is ignored.
+    """
+    module = 'waitress'
+
+    def serve(self, app: Flask, host: str, port: int) -> None:
+        import waitress
+
+        waitress.serve(app, host=host, port=port, threads=self.threads)
+
+
+class GunicornServingBackend(AbstractServingBackend):
+    """
+    The gunicorn WSGI server, which forks multiple worker processes, which each handle the requests with a pool of
+    threads. gunicorn handles SIGTERM and SIGINT itself and stops its workers gracefully.
+    """
+    module = 'gunicorn'
+
+    def serve(self, app: Flask, host: str, port: int) -> None:
+        from gunicorn.app.base import BaseApplication
+
+        options = {
+            'bind':             f'{host}:{port}',
+            'workers':          self.workers,
+            'threads':          self.threads,
+            'worker_class':     'gthread',
+            'graceful_timeout': self.shutdown_timeout
+        }
+
+        class Application(BaseApplication):
+
+            def load_config(self):
+                for key, value in options.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return app
+
+        Application().run()
+
+
+#: The serving backends, which can be selected with the "ci.serving_backend" option
+SERVING_BACKENDS: Dict[str, Type[AbstractServingBackend]] = {
+    'gunicorn':     GunicornServingBackend,
+    'waitress':     WaitressServingBackend,
+    'flask':        FlaskServingBackend,
+}
+
+#: The order in which the serving backends are tried with the "auto" option
+AUTO_SERVING_BACKENDS: List[str] = ['gunicorn', 'waitress', 'flask']
+
+
+def get_serving_backend_class(name: str) -> Type[AbstractServingBackend]:
+    """
+    Returns the serving backend class with the given *name*. For "auto" this is the first available backend of
+    AUTO_SERVING_BACKENDS.
+
+    :raises KeyError: If there is no backend with this name
+    :raises ImportError: If the backend is not installed
+
+    :returns: The serving backend class
+    """
+    if name == 'auto':
+        return next(SERVING_BACKENDS[key] for key in AUTO_SERVING_BACKENDS if SERVING_BACKENDS[key].is_available())
+
+    if name not in SERVING_BACKENDS:
+        raise KeyError(f'There is no serving backend "{name}". Choose one of: auto, {", ".join(SERVING_BACKENDS)}')
+
+    backend_class = SERVING_BACKENDS[name]
+    if not backend_class.is_available():
+        raise ImportError(f'The serving backend "{name}" requires the python package "{backend_class.module}"')
+
+    return backend_class
+
+
+def run_build_worker(stop_event: multiprocessing.Event) -> None:
+    # The shutdown of the worker is coordinated by the supervisor with the stop event. Otherwise a Ctrl+C in the
+    # terminal, which is sent to the whole process group, would interrupt the current build right away. SIGTERM is only
+    # sent by the supervisor after the shutdown timeout. It is turned into an exception, so that the build context is
+    # still properly exited, which releases the build lock.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, terminate)
+    BuildWorker(stop_event=stop_event).run()
+
+
+class CIServerSupervisor(object):
+    """
+    Runs the flask *app* of the CI server with a serving backend and the build worker as a managed sibling process.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        supervisor = CIServerSupervisor(server, host='0.0.0.0', port=8030, backend='gunicorn', workers=4)
+        # Blocks until the server is stopped, then stops the build worker
+        supervisor.run()
+
+    :param app: The flask app
+    :param host: The host address, to which the server is bound
+    :param port: The port of the server
+    :param backend: The name of the serving backend. Defaults to the "ci.serving_backend" option
+    :param workers: The number of worker processes of the server. Defaults to the "ci.server_workers" option
+    :param threads: The number of threads per worker. Defaults to the "ci.server_threads" option
+    :param config: The config instance
+    """
+    def __init__(self,
+                 app: Flask,
+                 host: str,
+                 port: int,
+                 backend: Optional[str] = None,
+                 workers: Optional[int] = None,
+                 threads: Optional[int] = None,
+                 config: Config = CONFIG):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.config = config
+
+        self.backend_name = config.get_data_or_default(['ci', 'serving_backend'], 'auto') if backend is None else backend
+        self.workers = config.get_data_or_default(['ci', 'server_workers'], 2) if workers is None else workers
+        self.threads = config.get_data_or_default(['ci', 'server_threads'], 8) if threads is None else threads
+        self.shutdown_timeout = config.get_data_or_default(['ci', 'shutdown_timeout'], 30)
+
+        self.stop_event = multiprocessing.Event()
+        self.worker_process: Optional[multiprocessing.Process] = None
+
+    def get_backend(self) -> AbstractServingBackend:
+        """
+        Returns the serving backend instance.
+
+        :raises KeyError: If the configured backend does not exist
+        :raises ImportError: If the configured backend is not installed
+
+        :returns: The serving backend
+        """
+        backend_class = get_serving_backend_class(self.backend_name)
+        return backend_class(workers=self.workers, threads=self.threads, shutdown_timeout=self.shutdown_timeout)
+
+    def start_worker(self) -> None:
+        self.stop_event.clear()
+        self.worker_process = multiprocessing.Process(target=run_build_worker, args=(self.stop_event, ))
+        self.worker_process.start()
+
+    def stop_worker(self) -> None:
+        """
+        Asks the build worker to stop and waits for at most "ci.shutdown_timeout" seconds for it to finish the current
+        build, before it is terminated.
+
+        :returns: void
+        """
+        if self.worker_process is None or not self.worker_process.is_alive():
+            return
+
+        cprint('Waiting for the build worker to finish...')
+        self.stop_event.set()
+        BuildQueue.get_notifier().notify()
+        self.worker_process.join(self.shutdown_timeout)
+
+        if self.worker_process.is_alive():
+            cerror(f'The build worker did not stop within {self.shutdown_timeout} seconds and is terminated!')
+            self.worker_process.terminate()
+            # The worker cancels the running build upon termination, which should not take long. But the server must
+            # not hang forever, should the build not react to this.
+            self.worker_process.join(self.shutdown_timeout)
+
+        if self.worker_process.is_alive():
+            cerror('The build worker could not be terminated and is killed!')
+            self.worker_process.kill()
+            self.worker_process.join()
+
+    def run(self) -> None:
+        """
+        Starts the build worker and runs the server until it is stopped by SIGINT or SIGTERM. Afterwards the build
+        worker is stopped as well.
+
+        :raises KeyError: If the configured backend does not exist
+        :raises ImportError: If the configured backend is not installed
+
+        :returns: void
+        """
+        backend = self.get_backend()
+        cprint(f'Serving with "{backend.__class__.__name__}" ({self.workers} workers, {self.threads} threads)')
+
+        # The flask and waitress servers only stop on a KeyboardInterrupt. gunicorn installs its own signal handlers.
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+
+        previous_handler = signal.signal(signal.SIGTERM, terminate)
+        self.start_worker()
+        try:
+            backend.serve(self.app, self.host, self.port)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            self.stop_worker()
@@ -4,10 +4,15 @@ Module containing all the actual console scripts of the project.
 import sys
 import os
 import json
-from multiprocessing import Process
+import time
+import fnmatch
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pprint import pprint
 
 import click
+import jinja2
 import matplotlib
 import numpy as np
 import shutil
@@ -26,7 +31,6 @@ from ufotest.util import (update_install,
                           check_path)
 from ufotest.util import get_template
 from ufotest.util import cerror, cresult, ctitle, csubtitle, cprint, cparams
-from ufotest.util import HTMLTemplateMixin
 from ufotest.util import format_byte_size
 from ufotest.install import (mock_install_repository,
                              install_dependencies,
@@ -37,9 +41,15 @@ from ufotest.install import (mock_install_repository,
                              install_uca_ufo,
                              install_ipecamera)
 from ufotest.camera import AbstractCamera, UfoCamera, MockCamera
-from ufotest.testing import TestRunner, TestContext, TestReport
+from ufotest.testing import TestRunner, TestContext, TestReport, migrate_report
+from ufotest.testing import recompile_report, get_recompile_fingerprint, RECOMPILED, UNCHANGED, FILTERED
+from ufotest.index import ReportIndex, TEST, BUILD
+from ufotest.usage import DiskUsageTracker, BLOBS
+from ufotest.retention import ArchiveCollector, KEEP, COMPACT, DELETE
+from ufotest.ci.blobs import BlobStore
 from ufotest.ci.build import BuildRunner, BuildReport, BuildLock, build_context_from_config
-from ufotest.ci.server import server, BuildWorker
+from ufotest.ci.server import server
+from ufotest.ci.wsgi import CIServerSupervisor, SERVING_BACKENDS
 
 
 CONFIG = Config()
@@ -787,8 +797,14 @@ def build(config, suite, skip) -> None:
 
 @click.command('serve', short_help='Runs the CI server which serves the web interface and accepts build requests')
 @click.option('--host', '-h', type=click.STRING, default='0.0.0.0', help='the host address for the server')
+@click.option('--backend', '-b', type=click.Choice(['auto', *SERVING_BACKENDS.keys()]), default=None,
+              help='the WSGI server which runs the web interface. Defaults to the "ci.serving_backend" option')
+@click.option('--workers', '-w', type=click.INT, default=None,
+              help='the number of server processes. Defaults to the "ci.server_workers" option')
+@click.option('--threads', '-t', type=click.INT, default=None,
+              help='the number of threads per server process. Defaults to the "ci.server_threads" option')
 @pass_config
-def serve(config, host):
+def serve(config, host, backend, workers, threads):
     """
     Starts the CI web server.
 
@@ -800,6 +816,10 @@ def serve(config, host):
     Additionally the running web server exposes a web API, which accepts incoming notifications from github or gitlab
     code repositories to information about a new push event to the firmware repository of the camera. Following such a
     push notification a new build and subsequent test execution will be triggered automatically.
+
+    For production use, the server should be run by a multi process WSGI server like gunicorn (if it is installed). The
+    server is stopped gracefully with Ctrl+C or SIGTERM, in which case the build worker gets the chance to finish the
+    current build first.
     """
     # -- ECHO CONFIGURATION
     click.secho('\n| | STARTING CI SERVER | |', bold=True)
@@ -817,22 +837,29 @@ def serve(config, host):
 
     click.secho('(+) Visit the server at http://{}:{}/'.format(hostname, port), fg='green')
 
-    # -- STARTING BUILD WORKER
+    # -- STARTING THE SERVER AND THE BUILD WORKER
     # The flask server does not actually process the actual builds. It simply accepts the requests and based on the
     # information within these requests it schedules a new build by putting the information into a queue. The actual
-    # build will then be started by this separate build worker process. This is because builds can take a very long
-    # time and they should not block the web server from handling other requests.
-    build_worker = BuildWorker()
-    process = Process(target=build_worker.run)
-    process.start()
-
-    # -- STARTING THE SERVER
-    server.run(port=port, host=host)
+    # build will then be started by a separate build worker process, which is managed by the supervisor. This is
+    # because builds can take a very long time and they should not block the web server from handling other requests.
+    supervisor = CIServerSupervisor(server, host, port, backend=backend, workers=workers, threads=threads, config=config)
+    try:
+        supervisor.run()
+    except (KeyError, ImportError) as error:
+        cerror(str(error))
+        sys.exit(1)
 
 
 @click.command('recompile', short_help='Updates all the HTML test reports')
+@click.option('--since', '-s', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S']), default=None,
+              help='Only recompile the reports of test runs, which were started after this date')
+@click.option('--only', '-o', type=click.STRING, multiple=True,
+              help='Only recompile the report folders, whose names match this glob pattern. Can be used multiple times')
+@click.option('--force', '-f', is_flag=True, help='Recompile the reports even if nothing has changed')
+@click.option('--workers', '-w', type=click.INT, default=None,
+              help='The number of worker processes. Defaults to the number of CPUs. With 0 no processes are used')
 @pass_config
-def recompile(config):
+def recompile(config, since, only, force, workers):
     """
     This command recompiles all the static HTML files of the test reports.
 
@@ -841,6 +868,9 @@ def recompile(config):
     templates are updated with a new release version. In such a case the test report html pages would not reflect the
     changes. In this case, the "recompile" command can be used to recreate the static html files using the current
     config / template versions.
+
+    The reports are recompiled by multiple processes in parallel. Reports, for which neither the report.json, nor the
+    templates nor the url config have changed since the last time they were recompiled, are skipped.
     """
     # THE PROBLEM
     # So this is the problem: Test reports are actually static html files. These html templates for each test reports
@@ -854,39 +884,207 @@ def recompile(config):
     # The "recompile" command should fix this by recreating all the test report static html files with the current
     # version of the report template based on the info in the report.json file
 
+    workers = os.cpu_count() if workers is None else workers
     ctitle('RECOMPILE TEST REPORT HTML')
     cparams({
-        'archive folder':       config.get_archive_path()
+        'archive folder':       config.get_archive_path(),
+        'since':                since,
+        'only':                 ', '.join(only),
+        'force':                force,
+        'workers':              workers
     })
 
-    count = 0
-    for root, folders, files in os.walk(config.get_archive_path()):
-
-        for folder in folders:
-            folder_path = os.path.join(root, folder)
-            report_json_path = os.path.join(folder_path, 'report.json')
-            report_html_path = os.path.join(folder_path, 'report.html')
-
-            if not os.path.exists(report_json_path):
+    folder_paths = []
+    for folder in sorted(os.listdir(config.get_archive_path())):
+        folder_path = os.path.join(config.get_archive_path(), folder)
+        if only and not any(fnmatch.fnmatch(folder, pattern) for pattern in only):
+            continue
+
+        if os.path.exists(os.path.join(folder_path, 'report.json')):
+            folder_paths.append(folder_path)
+
+    # The report.json only contains the dict representation of the test report, which is rendered with the static
+    # method "html_from_dict" of the HTMLTemplateMixin (see "recompile_report"). The worker processes have to use the
+    # same prepared config and plugins as this process. This is why they are explicitly forked: The default start
+    # method is not "fork" on every platform and python version.
+    fingerprint = get_recompile_fingerprint(config)
+    kwargs = {'since': None if since is None else since.isoformat(), 'force': force}
+    counts = {RECOMPILED: 0, UNCHANGED: 0, FILTERED: 0}
+    start_time = time.time()
+    if workers > 0:
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=1)
+
+    with executor:
+        futures = {executor.submit(recompile_report, folder_path, fingerprint, **kwargs): folder_path
+                   for folder_path in folder_paths}
+        for future in as_completed(futures):
+            folder = os.path.basename(futures[future])
+            try:
+                result = future.result()
+            # A single broken report (or a crashed worker process) must not abort the whole recompilation
+            except (ValueError, KeyError, OSError, jinja2.TemplateError, BrokenProcessPool) as error:
+                cerror(f'Could not recompile test report {folder}: {error.__class__.__name__}: {error}')
                 continue
 
-            with open(report_json_path, mode='r+') as file:
-                report_data = json.load(file)
-
-            with open(report_html_path, mode='w+') as file:
-                # "report_data" is only the dict representation of the test report. This is problematic because we
-                # cannot call the "to_html" method then. But the test report class and all the test result classes
-                # implement the HTMLTemplateMixin class, which enables to render the html template from just this dict
-                # representation using the static method "html_from_dict". This is possible because the dict itself
-                # saves the entire template string in one of its fields.
-                html = HTMLTemplateMixin.html_from_dict(report_data)
-                file.write(html)
+            counts[result] += 1
+            if result == RECOMPILED:
                 cprint(f'Recompiled test report {folder}')
-            count += 1
 
-        break
+    duration = time.time() - start_time
+    cresult(f'Recompiled {counts[RECOMPILED]} test reports, {counts[UNCHANGED]} were unchanged and '
+            f'{counts[FILTERED]} filtered!')
+    cresult(f'Checked {len(folder_paths)} reports in {duration:.2f} seconds '
+            f'({len(folder_paths) / max(duration, 0.001):.1f} reports per second)')
+
+    sys.exit(0)
+
+
+@click.command('reindex', short_help='Rebuilds the index of all test and build reports')
+@pass_config
+def reindex(config):
+    """
+    This command rebuilds the report index from the report.json files of all the test and build reports and measures
+    the disk usage of the installation folder again.
+
+    The report index is a SQLite database within the installation folder, which is used to list the reports within the
+    web interface. Reports are automatically added to it when they are saved. The same goes for the disk usage of the
+    report folders. A rebuild is only necessary if report folders were added, modified or removed manually.
+    """
+    report_index = ReportIndex(config=config)
+    tracker = DiskUsageTracker(config=config)
+
+    ctitle('REBUILD REPORT INDEX')
+    cparams({
+        'index file':           report_index.path,
+        'usage file':           tracker.path,
+        'archive folder':       config.get_archive_path(),
+        'builds folder':        config.get_builds_path()
+    })
+
+    counts = report_index.rebuild()
+    cresult(f'Indexed {counts[TEST]} test reports and {counts[BUILD]} build reports!')
+
+    totals = tracker.rebuild()
+    usage = ', '.join(f'{category}: {format_byte_size(size, "MB")}' for category, size in totals.items())
+    cresult(f'Measured disk usage ({usage})')
+
+    sys.exit(0)
+
+
+@click.command('gc', short_help='Removes the stored build artifacts, which are no longer used by any build')
+@pass_config
+def gc(config):
+    """
+    This command removes all the files from the blob store, which are no longer referenced by any build folder.
+
+    The source repository and the bitfile within each build folder are only hard links to the blob store, which keeps
+    exactly one copy of each distinct file. When build folders are deleted, the files which are exclusive to them remain
+    within the blob store until this command is run.
+    """
+    store = BlobStore()
+
+    ctitle('COLLECT UNUSED BUILD ARTIFACTS')
+    cparams({
+        'blob folder':          store.path
+    })
+
+    # Between storing a blob and linking it into the build folder, a running build has an unreferenced blob
+    if BuildLock.is_locked():
+        cerror('A build is currently running. Try again later!')
+        sys.exit(1)
+
+    count, size = store.collect_garbage()
+    DiskUsageTracker(config=config).refresh(BLOBS)
+    cresult(f'Removed {count} unused blobs ({format_byte_size(size, "MB")})')
+
+    sys.exit(0)
+
+
+@click.group('archive', short_help='Commands for managing the archive of test and build reports')
+def archive():
+    pass
+
+
+@click.command('gc', short_help='Compacts and deletes old test and build reports according to the retention policy')
+@click.option('--dry-run', '-d', is_flag=True, help='Only show what would be done without modifying anything')
+@pass_config
+def archive_gc(config, dry_run):
+    """
+    This command ages out old test and build reports according to the retention policy of the [archive] section of the
+    config file.
+
+    The most recent reports are always kept. Of the older reports, only the failing ones and the most recent report of
+    each day are kept. The folders of the old test reports, which are kept, are compacted into a compressed tarball.
+    Only their report files remain, so that they are still listed within the web interface.
+    """
+    collector = ArchiveCollector(config=config)
+    policy = collector.policy
+
+    ctitle('COLLECT OLD REPORTS')
+    cparams({
+        'keep last':            policy.keep_last,
+        'compact after days':   policy.compact_after_days,
+        'keep failing days':    policy.keep_failing_days,
+        'delete after days':    policy.delete_after_days,
+        'dry run':              dry_run
+    })
+
+    # The unused blobs must not be removed while a build is running (see "ufotest ci gc")
+    collect_blobs = not BuildLock.is_locked()
+    results = collector.collect(dry_run=dry_run, collect_blobs=collect_blobs)
+    for kind, result in results.items():
+        cresult(f'{kind} reports: kept {result[KEEP]}, compacted {result[COMPACT]}, deleted {result[DELETE]} '
+                f'({format_byte_size(result["freed"], "MB")} freed)')
+
+    if not collect_blobs:
+        cerror('A build is currently running, so the unused build artifacts were not removed. Run "ufotest ci gc" later')
 
-    cresult(f'Recompiled {count} test reports!')
+    sys.exit(0)
+
+
+@click.command('migrate', short_help='Converts the test reports of older versions into the current compact format')
+@pass_config
+def archive_migrate(config):
+    """
+    This command converts the report.json files of all the test reports within the archive into the current format.
+
+    Older versions saved the complete template string and the pre-rendered html of every single test result within
+    the report.json file. The current format only references the templates by their name, which makes the files a lot
+    smaller. The report.html files are not modified, use "ufotest ci recompile" to render them again.
+    """
+    report_index = ReportIndex(config=config)
+
+    ctitle('MIGRATE TEST REPORTS')
+    cparams({
+        'archive folder':       config.get_archive_path()
+    })
+
+    count = 0
+    saved_size = 0
+    for folder in sorted(os.listdir(config.get_archive_path())):
+        folder_path = os.path.join(config.get_archive_path(), folder)
+        report_json_path = os.path.join(folder_path, 'report.json')
+        if not os.path.exists(report_json_path):
+            continue
+
+        size = os.path.getsize(report_json_path)
+        try:
+            report_data = migrate_report(folder_path)
+        except (ValueError, KeyError) as error:
+            cerror(f'Could not migrate test report {folder}: {error}')
+            continue
+
+        if report_data is None:
+            continue
+
+        report_index.add(TEST, folder_path, report_data)
+        saved_size += size - os.path.getsize(report_json_path)
+        cprint(f'Migrated test report {folder}')
+        count += 1
+
+    cresult(f'Migrated {count} test reports ({format_byte_size(saved_size, "MB")} saved)')
 
     sys.exit(0)
 
@@ -902,6 +1100,12 @@ def devices():
 ci.add_command(build)
 ci.add_command(serve)
 ci.add_command(recompile)
+ci.add_command(reindex)
+ci.add_command(gc)
+
+# Registering the commands with the "archive" group
+archive.add_command(archive_gc)
+archive.add_command(archive_migrate)
 
 # Registering the commands with the "scripts" group.
 scripts.add_command(invoke_script)
@@ -924,6 +1128,7 @@ cli.add_command(test)
 # Registering the sub groups
 cli.add_command(ci)
 cli.add_command(scripts)
+cli.add_command(archive)
 
 # 2.0.0 - 29.11.2021
 # "MiscCommands" is a special click command group which uses a filter hook from the
@@ -399,7 +399,7 @@ class Config(metaclass=Singleton):
         if isinstance(item, list) or isinstance(item, tuple):
             current_data = self.data
             for element in item:
-                if not isinstance(element, dict) or element not in current_data.keys():
+                if not isinstance(current_data, dict) or element not in current_data.keys():
                     return False
                 else:
                     current_data = current_data[element]
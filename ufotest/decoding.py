@@ -0,0 +1,186 @@
+"""
+This module contains a pure numpy decoder for the raw data stream, which is transferred from the camera over the DMA
+engine of the FPGA board (the output of "pci -r dma0 --multipacket").
+
+**DESIGN CHOICE**
+
+Previously the only way to decode this data was the external "ipedec" binary. It can only work with files and writes
+its result into yet another ".raw" file, which then had to be read back into a numpy array. That is an additional
+process spawn and a full frame disk round trip for every single frame. The functions in this module decode the byte
+stream directly into a uint16 numpy array. They only use vectorized numpy operations on the whole stream, there are no
+python loops over rows or pixels. Since they have no dependency to the ufotest config, they can also be used within
+worker processes.
+
+**THE DATA FORMAT**
+
+The stream is a sequence of 32 bit little endian words. A single frame consists of
+
+- A frame header of 8 words. The most significant nibble of each header word is 0x5 and the second nibble is the
+  one based index of the word within the header (0x51..., 0x52..., ..., 0x58...).
+- One data packet for every row of the frame. A packet starts with a packet header word, which contains the following
+  bit fields (from the most significant to the least significant bits): magic (8 bits, either 0xc0 or 0xe0), pixel
+  size (4 bits, 2 for 12 bit pixels), row number (12 bits) and pixel number (8 bits). The header is followed by the
+  pixels of the whole row as 12 bit values, which are packed most significant bit first into the words. This means that
+  three words contain eight pixels. The row data is padded with zeros to a full group of eight pixels.
+- A frame footer of 8 words, which all have the value 0x0AAAAAAA
+
+A multi frame dump is simply the concatenation of multiple of these frames.
+"""
+from typing import Optional, Union
+
+import numpy as np
+
+from ufotest.exceptions import FrameDecodingError
+
+FRAME_HEADER_WORDS = 8
+FRAME_HEADER_MAGIC = 0x5
+FRAME_FOOTER_WORDS = 8
+FRAME_FOOTER_WORD = 0x0AAAAAAA
+
+PACKET_MAGICS = (0xc0, 0xe0)
+PIXEL_SIZE_12BIT = 2
+
+
+def packet_word_count(width: int) -> int:
+    """
+    Returns the number of 32 bit words, which make up the data packet for a single row of *width* pixels. This includes
+    the packet header word.
+
+    :returns int:
+    """
+    # Three words contain exactly eight pixels
+    return 1 + 3 * int(np.ceil(width / 8))
+
+
+def frame_word_count(width: int, height: int) -> int:
+    """
+    Returns the number of 32 bit words, which make up a single encoded frame with the dimensions *width* x *height*.
+
+    :returns int:
+    """
+    return FRAME_HEADER_WORDS + height * packet_word_count(width) + FRAME_FOOTER_WORDS
+
+
+def unpack_12bit(words: np.ndarray, pixel_count: int) -> np.ndarray:
+    """
+    Unpacks the 12 bit pixel values, which are packed most significant bit first into the 32 bit *words* array. The
+    last axis of *words* is unpacked, all leading axes are kept. Only the first *pixel_count* pixels are returned from
+    every packed sequence.
+
+    :param words: An uint32 array, whose last axis contains the packed pixel data
+    :param pixel_count: The number of pixels to return per packed sequence
+
+    :returns: An uint16 array with the same leading axes as words and pixel_count elements in the last axis
+    """
+    # Converting the words into big endian byte order first turns the packing into a simple stream of bytes, where
+    # every three bytes contain two pixels: "AA AB BB".
+    byte_array = words.astype('>u4', copy=False).view(np.uint8)
+    byte_array = byte_array.reshape(words.shape[:-1] + (-1, 3))
+    b0, b1, b2 = (byte_array[..., i].astype(np.uint16) for i in range(3))
+
+    pixels = np.empty(words.shape[:-1] + (byte_array.shape[-2], 2), dtype=np.uint16)
+    np.bitwise_or(b0 << 4, b1 >> 4, out=pixels[..., 0])
+    np.bitwise_or((b1 & 0xf) << 8, b2, out=pixels[..., 1])
+
+    return pixels.reshape(words.shape[:-1] + (-1, ))[..., :pixel_count]
+
+
+def decode_frames(data: Union[bytes, bytearray, memoryview, np.ndarray],
+                  width: int,
+                  height: int,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decodes the raw DMA byte stream *data*, which contains one or multiple frames of the dimensions *width* x *height*.
+    The result is a three dimensional uint16 array (n, height, width) where n is the number of frames.
+
+    :param data: The raw bytes as received from the camera. May be any object which supports the buffer protocol. The
+        data is not copied before decoding.
+    :param width: The number of pixel columns of the sensor
+    :param height: The number of pixel rows of the sensor
+    :param out: Optionally a preallocated uint16 array of the shape (n, height, width) into which to write the frames
+
+    :raises FrameDecodingError: If the data is incomplete or if any of the header, footer or packet markers do not
+        match the expected format
+
+    :returns: The array of frames
+    """
+    data = memoryview(data).cast('B')
+    if len(data) % 4:
+        raise FrameDecodingError(f'The data length of {len(data)} bytes is not a multiple of the word size')
+    words = np.frombuffer(data, dtype='<u4')
+
+    frame_words = frame_word_count(width, height)
+    frame_count, remainder = divmod(len(words), frame_words)
+    if frame_count == 0 or remainder:
+        raise FrameDecodingError(f'Incomplete frame data: Received {len(words)} words, which is not a multiple of the '
+                                 f'{frame_words} words of a single {width}x{height} frame')
+
+    frames = words.reshape((frame_count, frame_words))
+
+    # ~ Checking the frame header and footer
+    headers = frames[:, :FRAME_HEADER_WORDS]
+    expected_nibbles = np.arange(1, FRAME_HEADER_WORDS + 1, dtype=np.uint32)
+    if np.any(headers >> 28 != FRAME_HEADER_MAGIC) or np.any((headers >> 24) & 0xf != expected_nibbles):
+        raise FrameDecodingError('Invalid frame header')
+
+    footers = frames[:, -FRAME_FOOTER_WORDS:]
+    if np.any(footers != FRAME_FOOTER_WORD):
+        raise FrameDecodingError('Invalid frame footer')
+
+    # ~ Checking the packet headers
+    packets = frames[:, FRAME_HEADER_WORDS:-FRAME_FOOTER_WORDS].reshape((frame_count, height, -1))
+    packet_headers = packets[:, :, 0]
+    if not np.all(np.isin(packet_headers >> 24, PACKET_MAGICS)):
+        raise FrameDecodingError('Invalid packet header magic')
+
+    if np.any((packet_headers >> 20) & 0xf != PIXEL_SIZE_12BIT):
+        raise FrameDecodingError('Only 12 bit pixel data is supported')
+
+    # The rows do not necessarily arrive in order, that is why the row numbers are used to place the rows. But every row
+    # has to be received exactly once.
+    rows = ((packet_headers >> 8) & 0xfff).astype(np.intp)
+    if np.any(np.sort(rows, axis=1) != np.arange(height)):
+        raise FrameDecodingError('The row numbers of the packets do not match the frame height')
+
+    # ~ Unpacking the pixels
+    if out is None:
+        out = np.empty((frame_count, height, width), dtype=np.uint16)
+    elif out.shape != (frame_count, height, width) or out.dtype != np.uint16:
+        raise ValueError(f'The output array has to be an uint16 array of shape {(frame_count, height, width)} but an '
+                         f'array of dtype {out.dtype} and shape {out.shape} was given')
+
+    pixels = unpack_12bit(packets[:, :, 1:], width)
+    out[np.arange(frame_count)[:, np.newaxis], rows] = pixels
+
+    return out
+
+
+def decode_frame(data: Union[bytes, bytearray, memoryview, np.ndarray],
+                 width: int,
+                 height: int,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Decodes the raw DMA byte stream *data* of a single frame with the dimensions *width* x *height* into an uint16 array
+    of the shape (height, width).
+
+    :param out: Optionally a preallocated uint16 array of the shape (height, width) into which to write the frame
+
+    :raises FrameDecodingError: If the data does not contain exactly one valid frame
+
+    :returns: The frame array
+    """
+    frames = decode_frames(data, width, height, out=None if out is None else out[np.newaxis])
+    if len(frames) != 1:
+        raise FrameDecodingError(f'Expected the data of a single frame, but {len(frames)} frames were received')
+
+    return frames[0]
+
+
+def decode_file(path: str, width: int, height: int) -> np.ndarray:
+    """
+    Decodes all the frames from the file *path*, which contains the raw data received from the camera.
+
+    :returns: The array of frames with the shape (n, height, width)
+    """
+    with open(path, mode='rb') as file:
+        return decode_frames(file.read(), width, height)
@@ -38,3 +38,8 @@ class PciError(Exception):
 class FrameDecodingError(Exception):
     """When something goes wrong during the decoding of the frame
     """
+
+
+class BuildCanceledError(BuildError):
+    """When a running build process is canceled, because it has been superseded by a more recent build request.
+    """
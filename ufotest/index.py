@@ -0,0 +1,401 @@
+"""
+This module contains the "ReportIndex", which keeps track of all the test and build reports in a SQLite database
+within the installation folder.
+
+**DESIGN CHOICE**
+
+Previously every listing of the reports (the home page, the archive and builds pages, "get_test_reports" ...) walked
+the whole archive folder, opened and parsed every single report.json file and then sorted all of them by their start
+time. With thousands of archived test runs this means that the home page alone takes several seconds to load.
+
+The report index stores the JSON data of each report together with its start time in a SQLite table. The reports are
+added to the index when they are saved, so the listings only have to run a single sorted (and optionally paginated)
+query. The index is not the primary storage of the reports though, that is still the report.json file in each report
+folder. This is why the index can be rebuilt from these files at any time, which is done automatically if the database
+does not exist yet and manually with the "ufotest ci reindex" command.
+
+Besides the full JSON data, the index also stores a small "summary" of each report, which only contains the fields
+needed to display the report within a list (see SUMMARY_KEYS). The full report dicts contain the result dicts of every
+single test case and can be quite large, which is why the paginated listings of the web interface only load these
+summaries.
+"""
+import os
+import json
+import math
+import sqlite3
+import threading
+import contextlib
+from typing import Optional, List, Dict, Tuple, Iterator, Callable
+
+from ufotest.config import Config, CONFIG, get_path
+
+#: The kind of report for the test reports in the archive folder
+TEST = 'test'
+#: The kind of report for the build reports in the builds folder
+BUILD = 'build'
+
+#: For each kind of report, this dict contains the keys of the report dict, which are part of the summary of a report.
+#: Only these values are loaded for the report listings.
+SUMMARY_KEYS = {
+    TEST: [
+        'name', 'folder_name', 'platform', 'version', 'hardware_version', 'firmware_version', 'sensor_version',
+        'start', 'start_iso', 'end', 'duration', 'test_count', 'successful_count', 'success_ratio'
+    ],
+    BUILD: [
+        'repository_name', 'folder_name', 'branch', 'commit', 'version', 'test_suite', 'start', 'start_iso', 'end',
+        'duration', 'test_count', 'test_success_count', 'test_percentage'
+    ]
+}
+
+
+#: Separates the start time and the folder name of a report within a pagination cursor
+CURSOR_SEPARATOR = '|'
+
+
+def make_cursor(start_iso: str, name: str) -> str:
+    """
+    Returns the pagination cursor, which points to the report with the ISO start time *start_iso* and the folder
+    *name*. The folder name breaks the tie between reports with the same start time.
+
+    :returns str:
+    """
+    return f'{start_iso}{CURSOR_SEPARATOR}{name}'
+
+
+def parse_cursor(cursor: str) -> Tuple[str, Optional[str]]:
+    """
+    Returns the start time and the folder name of the given pagination *cursor*. A cursor can also only consist of an
+    ISO start time, in which case the folder name is None.
+
+    :returns: A tuple (start_iso, name)
+    """
+    start_iso, separator, name = cursor.partition(CURSOR_SEPARATOR)
+    return start_iso, (name if separator else None)
+
+
+def ensure_schema(connection: sqlite3.Connection,
+                  schema: Tuple[str, ...],
+                  version: int,
+                  rebuild: Callable[[sqlite3.Connection], object]) -> None:
+    """
+    Makes sure, that the database of the given *connection* was created with the given *version* of the *schema*. The
+    version is stored as the "user_version" of the database. If it does not match, all the statements of the *schema*
+    are executed and the tables are filled again by calling *rebuild* with the connection.
+
+    The CI server may run in multiple processes, which open the database at the same time. This is why the tables are
+    recreated within a single exclusive transaction, in which the version is checked once more. Only the first process
+    recreates the tables, all the others wait for it and then find the current version.
+
+    :returns: void
+    """
+    current_version, = connection.execute('PRAGMA user_version').fetchone()
+    if current_version == version:
+        return
+
+    # The transaction is managed manually. Otherwise the sqlite3 module would open and commit transactions on its own.
+    isolation_level = connection.isolation_level
+    connection.isolation_level = None
+    try:
+        connection.execute('BEGIN EXCLUSIVE')
+        try:
+            current_version, = connection.execute('PRAGMA user_version').fetchone()
+            if current_version != version:
+                for statement in schema:
+                    connection.execute(statement)
+                rebuild(connection)
+                connection.execute(f'PRAGMA user_version = {version}')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+    finally:
+        connection.isolation_level = isolation_level
+
+
+def summarize_report(kind: str, report: dict) -> dict:
+    """
+    Returns the summary dict of the given *report* of the given *kind*. The summary only contains the keys listed in
+    SUMMARY_KEYS. Older reports may not contain all of these keys, in which case they are simply missing from the
+    summary as well.
+
+    :returns dict:
+    """
+    return {key: report[key] for key in SUMMARY_KEYS[kind] if key in report}
+
+
+class ReportIndex(object):
+    """
+    Wraps the SQLite database which indexes all the test and build reports.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        index = ReportIndex()
+        # The 10 most recent test reports
+        reports = index.query(TEST, limit=10)
+        # The next 10 reports, which are older than the last one
+        reports = index.query(TEST, limit=10, before=make_cursor(reports[-1]['start_iso'], 'report_name'))
+        # The summaries of the second page of 20 reports
+        page = index.page(TEST, page=2, limit=20)
+
+    :param path: The path of the database file. Defaults to "reports.db" within the installation folder
+    :param config: The config instance
+    """
+    SCHEMA = (
+        'DROP TABLE IF EXISTS reports',
+        'CREATE TABLE reports ('
+        '   kind TEXT NOT NULL,'
+        '   folder TEXT NOT NULL,'
+        '   name TEXT NOT NULL,'
+        '   start_iso TEXT NOT NULL,'
+        '   summary TEXT NOT NULL,'
+        '   data TEXT NOT NULL,'
+        '   PRIMARY KEY (kind, folder)'
+        ')',
+        'CREATE INDEX reports_start ON reports (kind, start_iso DESC, name DESC)'
+    )
+    # This version is stored as the "user_version" of the database. Whenever the schema changes, this number has to be
+    # incremented, which causes existing databases to be recreated and rebuilt from the report folders.
+    SCHEMA_VERSION = 3
+
+    # All the ReportIndex instances, which are used from different threads, share this lock for the rebuild, so that
+    # the threads of one process do not even wait for the exclusive transaction of the rebuild (see "ensure_schema").
+    _lock = threading.Lock()
+
+    def __init__(self, path: Optional[str] = None, config: Config = CONFIG):
+        self.config = config
+        self.path = get_path('reports.db') if path is None else path
+
+    def get_folder(self, kind: str) -> str:
+        """
+        Returns the path of the folder, which contains the reports of the given *kind*.
+
+        :returns str:
+        """
+        return self.config.get_archive_path() if kind == TEST else self.config.get_builds_path()
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        A context manager, which opens a new connection to the database and commits all changes at the end. A new
+        connection is used for every operation because sqlite connections cannot be shared between threads. If the
+        database does not exist yet or was created with an older schema, it is (re)created and filled with all the
+        existing reports.
+        """
+        with self._lock:
+            connection = sqlite3.connect(self.path, timeout=10)
+            try:
+                ensure_schema(connection, self.SCHEMA, self.SCHEMA_VERSION, self._rebuild)
+            except BaseException:
+                connection.close()
+                raise
+
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # -- Modifying the index
+
+    def add(self, kind: str, folder_path: str, report: dict) -> None:
+        """
+        Adds the dict *report* of the given *kind*, which is saved within *folder_path*, to the index. An existing
+        entry for the same folder is replaced.
+
+        :returns: void
+        """
+        with self.connect() as connection:
+            self._add(connection, kind, folder_path, report)
+
+    def remove(self, kind: str, folder_path: str) -> None:
+        """
+        Removes the report of the given *kind* within *folder_path* from the index.
+
+        :returns: void
+        """
+        with self.connect() as connection:
+            connection.execute('DELETE FROM reports WHERE kind = ? AND folder = ?', (kind, self._key(folder_path)))
+
+    def rebuild(self) -> Dict[str, int]:
+        """
+        Discards the current content of the index and adds all the reports, which are currently saved within the
+        archive and builds folders.
+
+        :returns: A dict, whose keys are the report kinds and the values the number of reports of that kind
+        """
+        with self.connect() as connection:
+            return self._rebuild(connection)
+
+    # -- Querying the index
+
+    def query(self,
+              kind: str,
+              limit: Optional[int] = None,
+              offset: int = 0,
+              before: Optional[str] = None,
+              summary: bool = False) -> List[dict]:
+        """
+        Returns the report dicts of the given *kind*, sorted by their start time with the most recent report first.
+        Reports with the same start time are sorted by their folder name.
+
+        :param kind: The kind of reports, either TEST or BUILD
+        :param limit: The max number of reports to return. None for all of them
+        :param offset: The number of (the most recent) reports to skip
+        :param before: A pagination cursor (See "make_cursor"). If given, only the reports which come after the report
+            of the cursor in the sort order are returned. The cursor can also be a plain ISO datetime string, in which
+            case only the reports which were started before this time are returned
+        :param summary: If True, only the summary dicts of the reports are returned instead of the full report dicts
+
+        :returns: A list of report dicts
+        """
+        rows = self._select(kind, 'summary' if summary else 'data', limit, offset, before)
+        return [json.loads(data) for _, data in rows]
+
+    def page(self, kind: str, page: int = 1, limit: int = 20, before: Optional[str] = None) -> dict:
+        """
+        Returns one page of the report summaries of the given *kind*, sorted with the most recent report first.
+
+        The page can either be selected by its 1-based *page* number or by the *before* cursor, which points to the
+        last report on the previous page (See "make_cursor"). The cursor should be preferred, because the offset of a page
+        number has to be skipped by the database, whereas the cursor directly uses the index. If a cursor is given,
+        the page number is ignored.
+
+        The returned dict contains the following keys:
+
+        - reports: The list of report summary dicts on this page
+        - count: The total number of reports of this kind
+        - page: The 1-based number of this page
+        - pages: The total number of pages
+        - limit: The max number of reports per page
+        - before: The cursor, which was used for this page or None
+        - next: The cursor for the next page or None if this is the last page
+
+        :returns dict:
+        """
+        total = self.count(kind)
+        if before is None:
+            offset = (page - 1) * limit
+            remaining = max(total - offset, 0)
+        else:
+            offset = 0
+            remaining = self.count(kind, before=before)
+            page = (total - remaining) // limit + 1
+
+        rows = self._select(kind, 'summary', limit, offset, before)
+        reports = [json.loads(summary) for _, summary in rows]
+        has_next = remaining > len(reports) and len(reports) != 0
+
+        return {
+            'reports':      reports,
+            'count':        total,
+            'page':         page,
+            'pages':        max(math.ceil(total / limit), 1),
+            'limit':        limit,
+            'before':       before,
+            'next':         make_cursor(reports[-1]['start_iso'], rows[-1][0]) if has_next else None
+        }
+
+    def entries(self, kind: str) -> List[Tuple[str, dict]]:
+        """
+        Returns the folder paths and summary dicts of all the reports of the given *kind*, sorted with the most recent
+        report first.
+
+        :returns: A list of tuples, where the first element is the absolute folder path and the second the summary dict
+        """
+        with self.connect() as connection:
+            rows = connection.execute('SELECT folder, summary FROM reports WHERE kind = ? '
+                                      'ORDER BY start_iso DESC, name DESC', (kind, )).fetchall()
+
+        return [(folder, json.loads(summary)) for folder, summary in rows]
+
+    def count(self, kind: str, before: Optional[str] = None) -> int:
+        """
+        Returns the number of reports of the given *kind* (which come after the *before* cursor, see "query").
+
+        :returns int:
+        """
+        conditions, parameters = self._conditions(kind, before)
+        with self.connect() as connection:
+            row = connection.execute(f'SELECT COUNT(*) FROM reports WHERE {conditions}', parameters).fetchone()
+
+        return row[0]
+
+    # -- Internal methods
+
+    def _conditions(self, kind: str, before: Optional[str]) -> Tuple[str, list]:
+        conditions, parameters = ['kind = ?'], [kind]
+        if before is not None:
+            start_iso, name = parse_cursor(before)
+            if name is None:
+                conditions.append('start_iso < ?')
+                parameters.append(start_iso)
+            else:
+                # The folder name breaks the tie between reports with the same start time. Otherwise the reports
+                # with the same start time as the last report of a page would be skipped.
+                conditions.append('(start_iso < ? OR (start_iso = ? AND name < ?))')
+                parameters += [start_iso, start_iso, name]
+
+        return ' AND '.join(conditions), parameters
+
+    def _select(self,
+                kind: str,
+                column: str,
+                limit: Optional[int],
+                offset: int,
+                before: Optional[str]) -> List[Tuple[str, str]]:
+        conditions, parameters = self._conditions(kind, before)
+        # In SQLite a negative limit means that there is no limit
+        parameters += [-1 if limit is None else limit, offset]
+        with self.connect() as connection:
+            return connection.execute(
+                f'SELECT name, {column} FROM reports WHERE {conditions} '
+                f'ORDER BY start_iso DESC, name DESC LIMIT ? OFFSET ?',
+                parameters
+            ).fetchall()
+
+    def _key(self, folder_path: str) -> str:
+        return os.path.abspath(folder_path)
+
+    def _add(self, connection: sqlite3.Connection, kind: str, folder_path: str, report: dict) -> None:
+        connection.execute(
+            'INSERT OR REPLACE INTO reports (kind, folder, name, start_iso, summary, data) VALUES (?, ?, ?, ?, ?, ?)',
+            (kind, self._key(folder_path), os.path.basename(self._key(folder_path)), report['start_iso'],
+             json.dumps(summarize_report(kind, report)), json.dumps(report))
+        )
+
+    def _rebuild(self, connection: sqlite3.Connection) -> Dict[str, int]:
+        # ufotest.util imports this module
+        from ufotest.util import cerror
+
+        connection.execute('DELETE FROM reports')
+
+        counts = {}
+        for kind in [TEST, BUILD]:
+            counts[kind] = 0
+            folder = self.get_folder(kind)
+            if not os.path.exists(folder):
+                continue
+
+            for name in os.listdir(folder):
+                report_json_path = os.path.join(folder, name, 'report.json')
+                # The folder of a test run, which is not yet complete, does not contain a report yet.
+                if not os.path.exists(report_json_path):
+                    continue
+
+                # A single broken report must not prevent the index from being created, because otherwise none of
+                # the listings would work anymore.
+                try:
+                    with open(report_json_path, mode='r') as report_json_file:
+                        report = json.load(report_json_file)
+
+                    self._add(connection, kind, os.path.join(folder, name), report)
+                except (ValueError, KeyError, TypeError, OSError) as error:
+                    cerror(f'Could not add report {report_json_path} to the index: '
+                           f'{error.__class__.__name__}: {error}')
+                    continue
+
+                counts[kind] += 1
+
+        return counts
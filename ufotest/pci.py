@@ -0,0 +1,539 @@
+"""
+This module contains the "PciSession", which is used to access the registers of the camera FPGA using the "pci"
+command line tool of pcitool.
+
+**DESIGN CHOICE**
+
+Previously every single register access spawned a completely new shell process, which then ran the pci command.
+Requesting a single frame alone required four of these processes and setting the exposure time two more. A sweep over
+multiple exposure times thus ended up with hundreds of process spawns, each of which has a noticeable overhead.
+
+The PciSession instead keeps a single shell process alive for the whole lifetime of the camera object and sends the
+pci commands to the stdin of this shell. Additionally multiple commands can be collected within a "batch", in which
+case all of them are written to the shell at once as a single script and the results are only collected afterwards.
+
+The actual execution of the commands is implemented by a backend. The "ShellPciBackend" is the default. The
+"MockPciBackend" does not run any commands, it simulates a register file in memory and can be used for testing.
+
+On top of the session, the "RegisterFile" offers the register access in terms of integer addresses and values. It
+parses the output of register reads into ints and combines consecutive writes to the same register within a batch.
+A "RegisterSnapshot" holds the parsed values of a whole range of registers, which were read at one point in time.
+"""
+import os
+import re
+import time
+import uuid
+import subprocess
+import contextlib
+from abc import abstractmethod
+from typing import Optional, List, Dict, Tuple, Union
+
+from ufotest.exceptions import PciError
+
+
+class PciCommand(object):
+    """
+    Represents a single command, which is executed by a PciSession. The fields "exit_code" and "stdout" are None until
+    the command has actually been executed. Outside of a batch this happens immediately. Inside of a batch this only
+    happens once the batch has been completed.
+    """
+    def __init__(self, command: str):
+        self.command = command
+        self.exit_code: Optional[int] = None
+        self.stdout: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.exit_code is not None
+
+    @property
+    def success(self) -> bool:
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return f'PciCommand("{self.command}", exit_code={self.exit_code})'
+
+
+class AbstractPciBackend(object):
+    """
+    The abstract base class for the backends, which actually execute the commands of a PciSession.
+    """
+
+    @abstractmethod
+    def execute(self, commands: List[PciCommand]) -> None:
+        """
+        Executes all the given *commands* in the given order and sets their "exit_code" and "stdout" fields.
+
+        :raises PciError: If the commands cannot be executed at all. This does not include commands which simply
+            return a non zero exit code.
+
+        :returns: void
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        """
+        Releases all the resources of the backend.
+
+        :returns: void
+        """
+        pass
+
+
+class ShellPciBackend(AbstractPciBackend):
+    """
+    Executes the commands within a single persistent shell process. The process is only started with the first
+    execution and it is restarted if it ever terminates.
+
+    After each command a unique marker string is echoed together with the exit code of the command. This marker is
+    used to split the output of the shell into the outputs of the individual commands.
+    """
+
+    def __init__(self, shell: str = '/bin/sh'):
+        self.shell = shell
+        self.process: Optional[subprocess.Popen] = None
+        self.marker = f'__ufotest_pci_{uuid.uuid4().hex}__'
+
+        #: The number of shell processes which have been started by this backend
+        self.spawn_count = 0
+
+    def start(self) -> subprocess.Popen:
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                [self.shell],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                # The shell has to be started with the current environment, because the config may have modified some
+                # environment variables, which are needed by pcitool
+                env=dict(os.environ)
+            )
+            self.spawn_count += 1
+
+            # The shell itself may print some messages when starting up. These must not end up in the output of the
+            # first command, which is why everything until the first marker is discarded here.
+            self.process.stdin.write(f'printf "%s 0\\n" "{self.marker}"\n'.encode())
+            self.process.stdin.flush()
+            while True:
+                line = self.process.stdout.readline()
+                if not line or line.decode().startswith(self.marker):
+                    break
+
+        return self.process
+
+    def execute(self, commands: List[PciCommand]) -> None:
+        process = self.start()
+
+        # The stderr of the individual commands is also redirected to stdout, which is the same behavior as before,
+        # where the error message was also taken from the output
+        script = ''.join(f'{command.command} 2>&1\nprintf "\\n%s %s\\n" "{self.marker}" "$?"\n'
+                         for command in commands)
+        try:
+            process.stdin.write(script.encode())
+            process.stdin.flush()
+
+            for command in commands:
+                lines = []
+                while True:
+                    line = process.stdout.readline()
+                    if not line:
+                        raise PciError(f'The pci shell process terminated unexpectedly during "{command.command}"')
+
+                    line = line.decode()
+                    if line.startswith(self.marker):
+                        break
+                    lines.append(line)
+
+                # The printf of the marker starts with a newline, in case the output of the command did not end with
+                # one. That additional newline is removed again here, so that the output is exactly the same as when
+                # running the command in its own process.
+                stdout = ''.join(lines)
+                command.stdout = stdout[:-1] if stdout.endswith('\n') else stdout
+                command.exit_code = int(line.split()[1])
+        except PciError:
+            self.close()
+            raise
+        except OSError as error:
+            self.close()
+            raise PciError(f'Communication with the pci shell process failed: {error}')
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        if self.process is not None:
+            # Closing stdin causes the shell to exit
+            with contextlib.suppress(OSError):
+                self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+
+class MockPciBackend(AbstractPciBackend):
+    """
+    A backend which does not execute any commands, but simulates a register file in memory. Only the write and read
+    commands of pci are supported. Register addresses are normalized, so that "9040" and "0x9040" refer to the same
+    register. Registers which were never written have the value 0.
+
+    All the executed commands are recorded in the "history" list.
+    """
+    WRITE_PATTERN = re.compile(r'^pci -w (\S+) (\S+)$')
+    READ_PATTERN = re.compile(r'^pci -r (\S+) -s (\d+)$')
+
+    def __init__(self, registers: Optional[Dict[int, int]] = None):
+        self.registers: Dict[int, int] = {} if registers is None else registers
+        self.history: List[str] = []
+
+        #: The number of times the execute method was called
+        self.execute_count = 0
+
+    def execute(self, commands: List[PciCommand]) -> None:
+        self.execute_count += 1
+        for command in commands:
+            self.history.append(command.command)
+            command.exit_code, command.stdout = self.execute_command(command.command)
+
+    def execute_command(self, command: str):
+        write_match = self.WRITE_PATTERN.match(command)
+        if write_match:
+            address, value = write_match.groups()
+            self.registers[int(address, 16)] = int(value, 16)
+            return 0, ''
+
+        read_match = self.READ_PATTERN.match(command)
+        if read_match:
+            address, size = int(read_match.group(1), 16), int(read_match.group(2))
+            return 0, self.format_read(address, size)
+
+        # Everything else, like the sleep commands, simply succeeds
+        return 0, ''
+
+    def format_read(self, address: int, size: int) -> str:
+        """
+        Formats the value of *size* registers starting at *address* like the output of "pci -r", which has four
+        register values per line, each line prefixed with the address.
+        """
+        lines = []
+        for offset in range(0, size, 4):
+            values = [f'{self.registers.get(address + (offset + i) * 4, 0):08x}' for i in range(min(4, size - offset))]
+            lines.append(f'{address + offset * 4:04x}:  ' + '  '.join(values) + '\n')
+
+        return ''.join(lines)
+
+
+class PciSession(object):
+    """
+    Wraps the register access of the camera using the "pci" command.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        session = PciSession()
+        session.write('9040', '80000201')
+        # Outside of a batch, the commands are executed immediately
+        print(session.read('9070', 4).stdout)
+
+        # Within a batch all commands are only executed at the end, using only a single round trip to the shell
+        with session.batch():
+            session.write('9040', '80000209')
+            session.sleep(0.1)
+            command = session.read('9070', 4)
+        print(command.stdout)
+
+    :param backend: The backend object to be used for the execution of the commands. Defaults to a new
+        ShellPciBackend
+    """
+    def __init__(self, backend: Optional[AbstractPciBackend] = None):
+        self.backend = ShellPciBackend() if backend is None else backend
+        self.pending: Optional[List[PciCommand]] = None
+
+    @property
+    def batching(self) -> bool:
+        return self.pending is not None
+
+    def execute(self, command: str) -> PciCommand:
+        """
+        Executes the given string *command*. If a batch is currently active, the command is only queued.
+
+        :returns: The PciCommand object, which will contain the result of the command
+        """
+        pci_command = PciCommand(command)
+        if self.batching:
+            self.pending.append(pci_command)
+        else:
+            self.backend.execute([pci_command])
+
+        return pci_command
+
+    def write(self, addr: str, value: str) -> PciCommand:
+        """
+        Writes the new *value* to the register with the given *addr*
+
+        :returns: The PciCommand object
+        """
+        return self.execute(f'pci -w {addr} {value}')
+
+    def read(self, addr: str, size: int) -> PciCommand:
+        """
+        Reads *size* registers starting with the given *addr*. The output of the read is available as the "stdout" of
+        the returned command object.
+
+        :returns: The PciCommand object
+        """
+        return self.execute(f'pci -r {addr} -s {size}')
+
+    def sleep(self, seconds: float) -> PciCommand:
+        """
+        Waits for the given amount of *seconds* between two register accesses. Within a batch this wait is part of the
+        script which is sent to the shell, which means that the timing between the register accesses is preserved.
+
+        :returns: The PciCommand object
+        """
+        return self.execute(f'sleep {seconds}')
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        A context manager. All the commands which are issued within the context are collected and only executed at
+        the end of the context with a single round trip to the backend. Nested batches are merged into the outer
+        most batch.
+        """
+        if self.batching:
+            yield self
+            return
+
+        self.pending = []
+        try:
+            yield self
+            commands = self.pending
+        finally:
+            self.pending = None
+
+        if commands:
+            self.backend.execute(commands)
+
+    def close(self) -> None:
+        self.backend.close()
+
+
+def parse_register_output(output: str) -> List[int]:
+    """
+    Parses the string *output* of a "pci -r" register read into a list of the integer register values. The output
+    consists of one or multiple lines, each of which starts with the address of the first register in that line,
+    followed by up to four hex register values:
+
+    .. code-block:: text
+
+        9050:  ffff0000  00000000  11110000  00000000
+        9060:  00000001  00000000
+
+    :returns: The list of all the register values in the order in which they appear in the output
+    """
+    values = []
+    for line in output.splitlines():
+        address, separator, content = line.partition(':')
+        if not separator:
+            continue
+        values += [int(value, 16) for value in content.split()]
+
+    return values
+
+
+def normalize_address(addr: Union[int, str]) -> int:
+    """
+    Returns the integer version of the register address *addr*, which may be given as an int or as a hex string with
+    or without the "0x" prefix.
+
+    :returns int:
+    """
+    return addr if isinstance(addr, int) else int(addr, 16)
+
+
+class RegisterRead(object):
+    """
+    Represents the result of a register read of a RegisterFile. The parsed integer values are only available once the
+    underlying pci command has actually been executed, which inside of a batch happens at the end of the batch.
+    """
+    def __init__(self, address: int, size: int, command: PciCommand):
+        self.address = address
+        self.size = size
+        self.command = command
+
+    @property
+    def done(self) -> bool:
+        return self.command.done
+
+    @property
+    def values(self) -> List[int]:
+        """
+        The list of the integer values of all the *size* registers which were read.
+
+        :raises PciError: If the read was not executed yet, if it failed or if its output could not be parsed
+        """
+        if not self.done:
+            raise PciError(f'The read of register {self.address:04x} has not been executed yet')
+
+        if not self.command.success:
+            message = self.command.stdout.strip().split('\n')[0]
+            raise PciError(f'The read of register {self.address:04x} failed: {message}')
+
+        try:
+            values = parse_register_output(self.command.stdout)
+        except ValueError:
+            raise PciError(f'Could not parse the output of the read of register {self.address:04x}: '
+                           f'"{self.command.stdout}"')
+
+        if len(values) < self.size:
+            raise PciError(f'The read of register {self.address:04x} returned {len(values)} instead of the expected '
+                           f'{self.size} values')
+
+        return values[:self.size]
+
+    @property
+    def value(self) -> int:
+        """
+        The integer value of the first register which was read.
+        """
+        return self.values[0]
+
+    def __repr__(self):
+        return f'RegisterRead(address={self.address:04x}, size={self.size}, done={self.done})'
+
+
+class RegisterFile(object):
+    """
+    Provides access to the registers of the camera FPGA in terms of integer addresses and values on top of a
+    PciSession.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        registers = RegisterFile(PciSession())
+        with registers.batch():
+            registers.write(0x9000, 0xa24e)
+            registers.write(0x9000, 0xa24f)  # merged with the previous write
+            registers.sleep(0.1)
+            read = registers.read(0x9010)
+        print(read.value)
+
+    **DESIGN CHOICE**
+
+    Within a batch, consecutive writes to the same register are combined: Only the last of these values is actually
+    written, the previous ones are replaced in the queue. This only applies if nothing else, no read and no sleep, is
+    queued in between the two writes. Some registers act as triggers however, where every single write has a side
+    effect (the frame request register 9040 for example). For these, the combining has to be disabled by passing
+    merge=False to the write.
+
+    :param session: The PciSession which is used to execute the register accesses
+    """
+    def __init__(self, session: PciSession):
+        self.session = session
+
+        # This is the write command which was last queued within the current batch, together with its address. Only if
+        # it is still the last pending command of the session when the next write is issued, the two can be combined.
+        self.last_write: Optional[Tuple[int, PciCommand]] = None
+
+        #: The number of writes which were saved by combining them with a previous write
+        self.merge_count = 0
+
+    def write(self, addr: Union[int, str], value: Union[int, str], merge: bool = True) -> PciCommand:
+        """
+        Writes the integer *value* to the register with the address *addr*.
+
+        :param addr: The register address
+        :param value: The new value of the register
+        :param merge: Whether or not this write may be combined with a directly preceding write to the same register
+            within the same batch. If False, neither this write is combined with the previous nor the next one with
+            this one.
+
+        :returns: The PciCommand object
+        """
+        address, value = normalize_address(addr), normalize_address(value)
+        command_string = f'pci -w {address:#06x} {value:#010x}'
+
+        if merge and self.session.batching and self.last_write is not None:
+            last_address, last_command = self.last_write
+            if last_address == address and self.session.pending and self.session.pending[-1] is last_command:
+                last_command.command = command_string
+                self.merge_count += 1
+                return last_command
+
+        command = self.session.execute(command_string)
+        self.last_write = (address, command) if merge and self.session.batching else None
+        return command
+
+    def read(self, addr: Union[int, str], size: int = 1) -> RegisterRead:
+        """
+        Reads *size* consecutive registers starting at the address *addr*. Outside of a batch the values are available
+        immediately through the returned object, inside of a batch only after the batch has been completed.
+
+        :returns: The RegisterRead object, whose "values" / "value" fields contain the parsed integer register values
+        """
+        address = normalize_address(addr)
+        return RegisterRead(address, size, self.session.read(f'{address:04x}', size))
+
+    def sleep(self, seconds: float) -> PciCommand:
+        """
+        Waits for the given amount of *seconds* between two register accesses. See PciSession.sleep
+
+        :returns: The PciCommand object
+        """
+        return self.session.sleep(seconds)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        A context manager. All the register accesses within the context are collected and executed with a single
+        round trip at the end of the context. See PciSession.batch
+        """
+        try:
+            with self.session.batch():
+                yield self
+        finally:
+            if not self.session.batching:
+                self.last_write = None
+
+
+class RegisterSnapshot(object):
+    """
+    Holds the integer values of a contiguous range of registers, which were read at one point in time.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        read = registers.read(0x9000, 120)
+        snapshot = RegisterSnapshot(0x9000, read.values)
+        print(snapshot[0x9050], snapshot.age)
+
+    :param address: The address of the first register of the range
+    :param values: The list of the integer register values
+    :param timestamp: The time at which the values were read. Defaults to the current time
+    """
+    def __init__(self, address: int, values: List[int], timestamp: Optional[float] = None):
+        self.address = address
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # The registers are 32 bit wide, which means that the addresses of consecutive registers differ by 4
+        self.registers: Dict[int, int] = {address + index * 4: value for index, value in enumerate(values)}
+
+    @property
+    def age(self) -> float:
+        """
+        The amount of seconds since the register values were read.
+        """
+        return time.time() - self.timestamp
+
+    def get(self, addr: Union[int, str], default: Optional[int] = None) -> Optional[int]:
+        return self.registers.get(normalize_address(addr), default)
+
+    def __getitem__(self, addr: Union[int, str]) -> int:
+        return self.registers[normalize_address(addr)]
+
+    def __contains__(self, addr: Union[int, str]) -> bool:
+        return normalize_address(addr) in self.registers
+
+    def __repr__(self):
+        return f'RegisterSnapshot(address={self.address:04x}, size={len(self.registers)}, age={self.age:.2f})'
@@ -2,7 +2,7 @@ import os
 import sys
 import importlib.util
 
-from typing import Any, Callable, Tuple
+from typing import Any, Callable, Tuple, Dict
 from collections import defaultdict
 
 """
@@ -18,6 +18,71 @@ the modification of certain important values of the main program.
 """
 
 
+class HookRegistry(defaultdict):
+    """
+    A dict, which contains the lists of the callback specs registered for each hook name, together with the
+    precomputed dispatch tuples of these callbacks.
+
+    **DESIGN CHOICE**
+
+    Previously the callback specs of a hook were sorted by their priority every single time the hook was invoked.
+    Some of the hooks are invoked on hot paths though, for example with every request of the web server or for every
+    single test case, while the registered callbacks usually never change after the plugins have been loaded. Now the
+    callbacks are sorted only when a callback is added or removed and stored as an immutable tuple in "dispatch". The
+    invocation of a hook, for which no callbacks are registered at all, is now only a single dict lookup.
+
+    The callbacks should only be added and removed with the "add" and "remove" methods. Deleting a whole hook from the
+    dict also discards its dispatch tuple.
+    """
+    def __init__(self):
+        defaultdict.__init__(self, list)
+        self.dispatch: Dict[str, Tuple[Callable, ...]] = {}
+
+    def add(self, hook_name: str, callback: Callable, priority: int = 10) -> None:
+        self[hook_name].append({
+            'callback':         callback,
+            'priority':         priority
+        })
+        self.update_dispatch(hook_name)
+
+    def remove(self, hook_name: str, callback: Callable) -> bool:
+        """
+        Removes all the specs of the given *callback* from the hook with the given *hook_name*.
+
+        :returns: Whether the callback was registered for this hook
+        """
+        specs = self.get(hook_name, [])
+        remaining = [spec for spec in specs if spec['callback'] is not callback]
+        if len(remaining) == len(specs):
+            return False
+
+        self[hook_name] = remaining
+        self.update_dispatch(hook_name)
+        return True
+
+    def update_dispatch(self, hook_name: str) -> None:
+        specs = self.get(hook_name, [])
+        if len(specs) == 0:
+            self.pop(hook_name, None)
+            return
+
+        # Python's sort is stable (also in reverse), so callbacks with the same priority keep the order of registration
+        callback_specs = sorted(specs, key=lambda spec: spec['priority'], reverse=True)
+        self.dispatch[hook_name] = tuple(spec['callback'] for spec in callback_specs)
+
+    def __delitem__(self, hook_name: str) -> None:
+        defaultdict.__delitem__(self, hook_name)
+        self.dispatch.pop(hook_name, None)
+
+    def pop(self, hook_name: str, *args) -> Any:
+        self.dispatch.pop(hook_name, None)
+        return defaultdict.pop(self, hook_name, *args)
+
+    def clear(self) -> None:
+        defaultdict.clear(self)
+        self.dispatch.clear()
+
+
 class PluginManager:
     """
     This class represents the plugin manager which is responsible for managing the plugin related functionality for
@@ -77,8 +142,8 @@ class PluginManager:
 
         self.plugins = {}
 
-        self.filters = defaultdict(list)
-        self.actions = defaultdict(list)
+        self.filters = HookRegistry()
+        self.actions = HookRegistry()
 
     # -- For invoking hooks in the main system --
 
@@ -92,11 +157,8 @@ class PluginManager:
         :param hook_name: The string name identifying the hook to be executed.
         :return: void
         """
-        if hook_name in self.actions.keys():
-            callback_specs = sorted(self.actions[hook_name], key=lambda spec: spec['priority'], reverse=True)
-            callbacks = [spec['callback'] for spec in callback_specs]
-            for callback in callbacks:
-                callback(*args, **kwargs)
+        for callback in self.actions.dispatch.get(hook_name, ()):
+            callback(*args, **kwargs)
 
     def apply_filter(self, hook_name: str, value: Any, *args, **kwargs) -> Any:
         """
@@ -113,12 +175,8 @@ class PluginManager:
         :return: The manipulated version of the passed value argument
         """
         filtered_value = value
-
-        if hook_name in self.filters.keys():
-            callback_specs = sorted(self.filters[hook_name], key=lambda spec: spec['priority'], reverse=True)
-            callbacks = [spec['callback'] for spec in callback_specs]
-            for callback in callbacks:
-                filtered_value = callback(filtered_value, *args, **kwargs)
+        for callback in self.filters.dispatch.get(hook_name, ()):
+            filtered_value = callback(filtered_value, *args, **kwargs)
 
         return filtered_value
 
@@ -135,10 +193,7 @@ class PluginManager:
         :param priority: The integer defining the priority of this particular callback. Default is 10.
         :return: void
         """
-        self.filters[hook_name].append({
-            'callback':         callback,
-            'priority':         priority
-        })
+        self.filters.add(hook_name, callback, priority)
 
     def register_action(self, hook_name: str, callback: Callable, priority: int = 10) -> None:
         """
@@ -150,10 +205,23 @@ class PluginManager:
         :param priority: The integer defining the priority of this particular callback. Default is 10.
         :return: void
         """
-        self.actions[hook_name].append({
-            'callback':         callback,
-            'priority':         priority
-        })
+        self.actions.add(hook_name, callback, priority)
+
+    def unregister_filter(self, hook_name: str, callback: Callable) -> bool:
+        """
+        Removes the filter *callback* function from the hook identified by *hook_name*.
+
+        :returns: Whether the callback was registered for this hook
+        """
+        return self.filters.remove(hook_name, callback)
+
+    def unregister_action(self, hook_name: str, callback: Callable) -> bool:
+        """
+        Removes the action *callback* function from the hook identified by *hook_name*.
+
+        :returns: Whether the callback was registered for this hook
+        """
+        return self.actions.remove(hook_name, callback)
 
     # -- Loading the plugins --
 
@@ -193,8 +261,8 @@ class PluginManager:
 
         :returns: void
         """
-        self.filters = defaultdict(list)
-        self.actions = defaultdict(list)
+        self.filters = HookRegistry()
+        self.actions = HookRegistry()
 
         self.plugins = {}
 
@@ -0,0 +1,274 @@
+"""
+This module contains the "ProgressBus", which collects structured progress events of a running test run, and the
+"ProgressReader", with which the web server streams these events to the live run page.
+
+**DESIGN CHOICE**
+
+During "ufotest test" or a CI build, the only indication of the progress was the console output. The test run emits
+structured progress events instead: When the run starts and finishes, when every single test starts and finishes (with
+its duration and exit code) and whenever frames have been acquired from the camera.
+
+The test run itself must never be slowed down by this. Emitting an event only appends a dict to an in-process deque
+of a fixed max length, so the memory is bounded as well. If the events are not consumed fast enough, the oldest ones
+are simply dropped. A daemon thread takes the buffered events in regular intervals and appends them to the
+"progress.jsonl" file within the installation folder. This file is necessary, because the test run usually does not
+happen in the process of the web server: "ufotest test" is a separate process and the builds run in the build worker
+process. The file only ever contains the events of the most recent run, it is replaced when a new run starts. Frame
+events are merged before they are written, so that a long frame acquisition only results in a single line per
+interval.
+
+The web server reads new events from this file with the "ProgressReader" and pushes them to the browser as
+Server-Sent Events (see the "/progress" routes of the server).
+"""
+import os
+import json
+import time
+import threading
+import collections
+from typing import Optional, List, Iterator
+
+from ufotest.config import get_path
+
+#: A new test run was started
+RUN_STARTED = 'run_started'
+#: The tests of a suite are about to be executed. The event contains the names of all the tests
+SUITE_STARTED = 'suite_started'
+#: A single test case was started
+TEST_STARTED = 'test_started'
+#: Frames have been acquired from the camera
+FRAME_ACQUIRED = 'frame_acquired'
+#: A single test case has finished
+TEST_FINISHED = 'test_finished'
+#: The test run has finished
+RUN_FINISHED = 'run_finished'
+
+
+class ProgressBus(object):
+    """
+    A bounded, thread safe buffer for the progress events of the test run in the current process.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        # The events of the run are written into the progress file by a background thread
+        PROGRESS.start(run='test_run_01_07_2021__12_00_00')
+        PROGRESS.emit(TEST_STARTED, name='single_frame')
+        PROGRESS.emit(FRAME_ACQUIRED, count=1)
+        # Writes the remaining events and stops the background thread
+        PROGRESS.stop()
+
+    :param size: The max number of events which are buffered in memory
+    :param interval: The number of seconds between the writes of the buffered events into the progress file
+    """
+    def __init__(self, size: int = 1000, interval: float = 0.5):
+        self.events = collections.deque(maxlen=size)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.dropped = 0
+        self.run: Optional[str] = None
+
+        self.path: Optional[str] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def next_id(self) -> int:
+        # The ids are based on the time, so that they keep increasing across multiple runs in different processes.
+        # That way a client, which reconnects with the id of the last event it has seen, does not miss a new run.
+        self.last_id = max(self.last_id + 1, time.time_ns() // 1000)
+        return self.last_id
+
+    def emit(self, event_type: str, **data) -> None:
+        """
+        Adds a new event of the given *event_type* with the additional *data* to the buffer. Events are only buffered
+        while the bus is started.
+
+        :returns: void
+        """
+        if self.thread is None:
+            return
+
+        with self.lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+
+            self.events.append({
+                'id':       self.next_id(),
+                'type':     event_type,
+                'time':     time.time(),
+                'run':      self.run,
+                **data
+            })
+
+    def take(self) -> List[dict]:
+        """
+        Removes all the buffered events and returns them. Consecutive frame events are merged into a single event with
+        the sum of their counts.
+
+        :returns: The list of events
+        """
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+
+        merged = []
+        for event in events:
+            if merged and event['type'] == FRAME_ACQUIRED and merged[-1]['type'] == FRAME_ACQUIRED:
+                merged[-1] = {**event, 'count': merged[-1]['count'] + event['count']}
+            else:
+                merged.append(event)
+
+        return merged
+
+    def start(self, run: str, path: Optional[str] = None, **data) -> None:
+        """
+        Starts the background thread, which writes the events into the progress file at *path* (defaults to
+        "progress.jsonl" within the installation folder) and emits the RUN_STARTED event for the run with the name
+        *run* and the additional *data*.
+
+        :returns: void
+        """
+        if self.thread is not None:
+            self.stop()
+
+        self.run = run
+        self.path = get_path('progress.jsonl') if path is None else path
+        # The progress file only contains the events of the most recent run. It is replaced by a new file instead of
+        # being truncated, so that a reader notices the new run by the changed inode.
+        try:
+            with open(f'{self.path}.tmp', mode='w'):
+                pass
+            os.replace(f'{self.path}.tmp', self.path)
+        except OSError:
+            pass
+
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+        self.emit(RUN_STARTED, **data)
+
+    def stop(self, **data) -> None:
+        """
+        Emits the RUN_FINISHED event with the additional *data*, writes all the remaining events and stops the
+        background thread.
+
+        :returns: void
+        """
+        if self.thread is None:
+            return
+
+        self.emit(RUN_FINISHED, dropped=self.dropped, **data)
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.dropped = 0
+
+    def write_loop(self) -> None:
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+        self.write()
+
+    def write(self) -> None:
+        events = self.take()
+        if len(events) == 0:
+            return
+
+        try:
+            with open(self.path, mode='a') as file:
+                file.write(''.join(json.dumps(event) + '\n' for event in events))
+        except OSError:
+            # The progress display is not important enough to disturb the test run itself
+            pass
+
+
+#: The progress bus of the current process
+PROGRESS = ProgressBus()
+
+
+class ProgressReader(object):
+    """
+    Reads the progress events from the progress file, which is written by a "ProgressBus" in a different process.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        reader = ProgressReader()
+        # All the events of the most recent run
+        events = reader.read()
+        # Yields new events as soon as they are written
+        for event in reader.follow(after=events[-1]['id'], timeout=60):
+            print(event)
+
+    :param path: The path of the progress file. Defaults to "progress.jsonl" within the installation folder
+    :param interval: The number of seconds between two checks for new events by "follow"
+    """
+    def __init__(self, path: Optional[str] = None, interval: float = 0.5):
+        self.path = get_path('progress.jsonl') if path is None else path
+        self.interval = interval
+        self.inode: Optional[int] = None
+        self.offset = 0
+
+    def poll(self) -> List[dict]:
+        """
+        Returns the events, which have been written to the progress file since the last call. If the file has been
+        replaced by a new run in the meantime, the new file is read from the beginning.
+
+        :returns: The list of events
+        """
+        try:
+            file_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+
+        if file_stat.st_ino != self.inode or file_stat.st_size < self.offset:
+            self.inode, self.offset = file_stat.st_ino, 0
+
+        with open(self.path, mode='rb') as file:
+            file.seek(self.offset)
+            content = file.read()
+
+        # A line, which is still being written, is only read the next time
+        complete = content[:content.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        return [json.loads(line) for line in complete.decode().splitlines() if line]
+
+    def read(self, after: int = 0) -> List[dict]:
+        """
+        Returns all the events of the most recent run, whose id is greater than *after*.
+
+        :returns: The list of events
+        """
+        self.inode, self.offset = None, 0
+        return [event for event in self.poll() if event['id'] > after]
+
+    def wait(self, after: int = 0, timeout: Optional[float] = None) -> List[dict]:
+        """
+        Returns the events with an id greater than *after*, which have been written since the last call. If there are
+        none yet, this method blocks until new events have been written or until *timeout* seconds have passed.
+
+        :returns: The list of events, which is empty if the timeout has expired
+        """
+        start_time = time.time()
+        while True:
+            events = [event for event in self.poll() if event['id'] > after]
+            if events or (timeout is not None and time.time() - start_time >= timeout):
+                return events
+
+            time.sleep(self.interval)
+
+    def follow(self, after: int = 0, timeout: Optional[float] = None) -> Iterator[dict]:
+        """
+        A generator which yields the events with an id greater than *after* as soon as they are written to the file. It
+        stops after *timeout* seconds or runs indefinitely if it is None.
+
+        :returns: A generator of event dicts
+        """
+        start_time = time.time()
+        while timeout is None or time.time() - start_time < timeout:
+            remaining = None if timeout is None else max(timeout - (time.time() - start_time), 0)
+            for event in self.wait(after, remaining):
+                after = event['id']
+                yield event
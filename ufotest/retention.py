@@ -0,0 +1,250 @@
+"""
+This module contains the "RetentionPolicy" and the "ArchiveCollector", which age out old test runs and builds.
+
+**DESIGN CHOICE**
+
+Previously the archive and builds folders grew forever. The only hint was the "disk_usage" test case, which advised the
+operator to log into the machine and delete old folders by hand. Deleting folders manually also left stale entries in
+the report index and the disk usage tracker.
+
+The retention policy decides for every report whether it is kept as it is, compacted or deleted, based on a few rules
+from the [archive] section of the config file:
+
+- The most recent "keep_last" reports of each kind are always kept.
+- All reports, which are younger than "compact_after_days", are kept.
+- Older failing reports are compacted, but kept until they are older than "keep_failing_days".
+- Of the older reports, only the most recent report of each day is compacted and kept, the others are deleted.
+- Reports older than "delete_after_days" are deleted (0 disables this rule).
+
+Compacting a report folder moves everything except the "report.*" files into a single compressed tarball within the
+folder. The report.json file stays where it is, so the report is still part of the index (which can still be rebuilt
+from the folders) and still shows up in the listings of the web interface. The images of a compacted report are only
+contained in the tarball though.
+
+Build folders are never compacted, only thinned out. Their files are already deduplicated hard links into the blob
+store, which a tarball would only duplicate again. Additionally, the scripts are loaded from the most recent build
+folder (see "ScriptManager.most_recent_build_folder"), which is determined by the change time of the folders.
+
+The "ArchiveCollector" applies the policy to the report index and keeps the disk usage tracker and the blob store
+(see "ufotest.ci.blobs") in sync. It is used by the "ufotest archive gc" command and optionally by the build worker of
+the CI server in regular intervals (see the "archive.gc_interval" option).
+"""
+import os
+import shutil
+import tarfile
+import datetime
+from typing import Optional, List, Dict
+
+from ufotest.config import Config, CONFIG
+from ufotest.util import get_folder_size
+from ufotest.index import ReportIndex, TEST, BUILD
+from ufotest.usage import DiskUsageTracker, ARCHIVE, BUILDS, BLOBS
+from ufotest.ci.blobs import BlobStore
+
+#: The report is kept as it is
+KEEP = 'keep'
+#: The content of the report folder is compressed into a tarball, only the report files remain
+COMPACT = 'compact'
+#: The report folder is deleted
+DELETE = 'delete'
+
+#: The name of the tarball within a compacted report folder
+COMPACTED_FILE_NAME = 'artifacts.tar.gz'
+
+#: For each kind of report, the names of the summary keys for the number of tests and the number of successful tests
+SUCCESS_KEYS = {
+    TEST: ('test_count', 'successful_count'),
+    BUILD: ('test_count', 'test_success_count')
+}
+
+#: The kinds of reports, whose folders are compacted. The folders of the other kinds are kept instead
+COMPACTED_KINDS = [TEST]
+
+#: For each kind of report, the category of its folder within the disk usage tracker
+USAGE_CATEGORIES = {
+    TEST: ARCHIVE,
+    BUILD: BUILDS
+}
+
+
+def is_failing(kind: str, summary: dict) -> bool:
+    """
+    Returns whether the report of the given *kind* with the given *summary* dict contains failed tests.
+
+    :returns bool:
+    """
+    count_key, success_key = SUCCESS_KEYS[kind]
+    return summary.get(success_key, 0) < summary.get(count_key, 0)
+
+
+def is_compacted(folder_path: str) -> bool:
+    return os.path.exists(os.path.join(folder_path, COMPACTED_FILE_NAME))
+
+
+def compact_folder(folder_path: str) -> None:
+    """
+    Moves all the content of the report folder *folder_path*, except the "report.*" files, into a compressed tarball
+    within this folder.
+
+    :returns: void
+    """
+    names = [name for name in os.listdir(folder_path) if not name.startswith('report.')]
+    if is_compacted(folder_path) or len(names) == 0:
+        return
+
+    # The tarball is only renamed once it is complete, so an interrupted compaction does not lose any files
+    tarball_path = os.path.join(folder_path, COMPACTED_FILE_NAME)
+    temp_path = f'{tarball_path}.tmp'
+    with tarfile.open(temp_path, mode='w:gz') as tarball:
+        for name in names:
+            tarball.add(os.path.join(folder_path, name), arcname=name)
+    os.replace(temp_path, tarball_path)
+
+    for name in names:
+        path = os.path.join(folder_path, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+class RetentionPolicy(object):
+    """
+    Decides which reports are kept, compacted or deleted. See the module docstring for the individual rules.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        policy = RetentionPolicy.from_config(CONFIG)
+        entries = ReportIndex().entries(TEST)
+        # One of KEEP, COMPACT or DELETE for each of the entries
+        actions = policy.decide(TEST, [summary for folder, summary in entries])
+
+    :param keep_last: The number of most recent reports, which are always kept
+    :param compact_after_days: Reports older than this are thinned out to one per day and compacted
+    :param keep_failing_days: Failing reports are not thinned out until they are older than this
+    :param delete_after_days: Reports older than this are deleted. 0 to keep them forever
+    """
+    def __init__(self,
+                 keep_last: int = 50,
+                 compact_after_days: int = 30,
+                 keep_failing_days: int = 90,
+                 delete_after_days: int = 0):
+        self.keep_last = keep_last
+        self.compact_after_days = compact_after_days
+        self.keep_failing_days = keep_failing_days
+        self.delete_after_days = delete_after_days
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'RetentionPolicy':
+        return cls(
+            keep_last=config.get_data_or_default(['archive', 'keep_last'], 50),
+            compact_after_days=config.get_data_or_default(['archive', 'compact_after_days'], 30),
+            keep_failing_days=config.get_data_or_default(['archive', 'keep_failing_days'], 90),
+            delete_after_days=config.get_data_or_default(['archive', 'delete_after_days'], 0)
+        )
+
+    def decide(self, kind: str, summaries: List[dict], now: Optional[datetime.datetime] = None) -> List[str]:
+        """
+        Returns the action for each of the report *summaries* of the given *kind*, which have to be sorted with the
+        most recent report first.
+
+        :returns: A list with one of KEEP, COMPACT or DELETE for each summary
+        """
+        now = datetime.datetime.now() if now is None else now
+        actions = []
+        days = set()
+        for index, summary in enumerate(summaries):
+            start_datetime = datetime.datetime.fromisoformat(summary['start_iso'])
+            age = (now - start_datetime).days
+            # Since the summaries are sorted, the first report of each day is the most recent one of that day
+            day = start_datetime.date()
+            first_of_day = day not in days
+            days.add(day)
+
+            if index < self.keep_last or age < self.compact_after_days:
+                actions.append(KEEP)
+            elif self.delete_after_days and age >= self.delete_after_days:
+                actions.append(DELETE)
+            elif first_of_day or (is_failing(kind, summary) and age < self.keep_failing_days):
+                actions.append(COMPACT)
+            else:
+                actions.append(DELETE)
+
+        return actions
+
+
+class ArchiveCollector(object):
+    """
+    Applies a retention policy to all the test and build reports of the installation.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        collector = ArchiveCollector(config=CONFIG)
+        # Only returns the numbers without modifying anything
+        results = collector.collect(dry_run=True)
+        results = collector.collect()
+
+    :param config: The config instance
+    :param policy: The retention policy. Defaults to the policy from the config
+    :param index: The report index. Defaults to the index of the installation
+    :param tracker: The disk usage tracker. Defaults to the tracker of the installation
+    """
+    def __init__(self,
+                 config: Config = CONFIG,
+                 policy: Optional[RetentionPolicy] = None,
+                 index: Optional[ReportIndex] = None,
+                 tracker: Optional[DiskUsageTracker] = None):
+        self.config = config
+        self.policy = RetentionPolicy.from_config(config) if policy is None else policy
+        self.index = ReportIndex(config=config) if index is None else index
+        self.tracker = DiskUsageTracker(config=config) if tracker is None else tracker
+
+    def collect(self, dry_run: bool = False, collect_blobs: bool = True) -> Dict[str, Dict[str, int]]:
+        """
+        Compacts and deletes the reports according to the policy.
+
+        :param dry_run: If True, nothing is modified, only the results are computed
+        :param collect_blobs: Whether the unused blobs of the deleted and compacted builds are removed afterwards. This
+            must not be done while a build is running.
+
+        :returns: A dict, whose keys are the report kinds and the values dicts with the number of "kept", "compacted"
+            and "deleted" reports and the number of "freed" bytes
+        """
+        results = {}
+        for kind in [TEST, BUILD]:
+            results[kind] = {KEEP: 0, COMPACT: 0, DELETE: 0, 'freed': 0}
+            entries = self.index.entries(kind)
+            actions = self.policy.decide(kind, [summary for folder, summary in entries])
+            for (folder_path, summary), action in zip(entries, actions):
+                if action == COMPACT and (kind not in COMPACTED_KINDS or is_compacted(folder_path)):
+                    action = KEEP
+
+                results[kind][action] += 1
+                if dry_run or action == KEEP:
+                    continue
+
+                # The hard linked files of a build are only freed by the garbage collection of the blob store
+                count_links = kind != BUILD
+                size = get_folder_size(folder_path, count_links) if os.path.exists(folder_path) else 0
+                if action == COMPACT:
+                    compact_folder(folder_path)
+                    size -= get_folder_size(folder_path, count_links)
+                    self.tracker.record(USAGE_CATEGORIES[kind], folder_path)
+                else:
+                    if os.path.exists(folder_path):
+                        shutil.rmtree(folder_path)
+                    self.index.remove(kind, folder_path)
+                    self.tracker.remove(folder_path)
+
+                results[kind]['freed'] += size
+
+        if collect_blobs and not dry_run:
+            count, size = BlobStore().collect_garbage()
+            self.tracker.refresh(BLOBS)
+            results[BUILD]['freed'] += size
+
+        return results
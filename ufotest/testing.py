@@ -3,13 +3,18 @@ import os
 import re
 import sys
 import json
+import hashlib
 import inspect
 import platform
 import datetime
+import pickle
 import logging
+import threading
+import multiprocessing
 import traceback
 from abc import ABC, abstractmethod
-from typing import Tuple, Dict, List, Type, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Tuple, Dict, List, Type, Any, Optional, Union, Callable
 from contextlib import AbstractContextManager
 
 import matplotlib.pyplot as plt
@@ -20,12 +25,177 @@ from ufotest.util import csubtitle, cprint, cresult, cerror
 from ufotest.util import (markdown_to_html,
                           dynamic_import,
                           create_folder,
+                          write_file,
                           get_template,
                           get_version,
                           random_string)
-from ufotest.util import AbstractRichOutput, HTMLTemplateMixin
+from ufotest.util import AbstractRichOutput, HTMLTemplateMixin, get_template_fingerprint
+from ufotest.index import ReportIndex, TEST
+from ufotest.usage import DiskUsageTracker, ARCHIVE
+from ufotest.progress import PROGRESS, SUITE_STARTED, TEST_STARTED, TEST_FINISHED
 from ufotest.camera import UfoCamera, AbstractCamera
 
+#: The version of the schema of the test report.json files. Version 1 (or no version at all) embedded the template
+#: string and the pre-rendered html of every single result. Since version 2 the results only reference the templates of
+#: their classes. Older reports can be converted with the "ufotest archive migrate" command.
+REPORT_SCHEMA_VERSION = 2
+
+#: The possible outcomes of "recompile_report"
+RECOMPILED = 'recompiled'
+UNCHANGED = 'unchanged'
+FILTERED = 'filtered'
+
+
+def render_figure(figure: Union[bytes, plt.Figure, FigureSpec], path: str, savefig_kwargs: dict) -> str:
+    """
+    Renders the given *figure* into the image file *path* and closes the figure afterwards. This function is executed
+    within the worker processes of the FigureRenderer.
+
+    :param figure: Either a matplotlib Figure, the pickled bytes of a Figure or a FigureSpec, which creates the figure
+    :param path: The absolute path of the image file to create
+    :param savefig_kwargs: Additional keyword arguments for the "savefig" call
+
+    :returns: The path of the image file
+    """
+    if isinstance(figure, bytes):
+        figure = pickle.loads(figure)
+    elif isinstance(figure, FigureSpec):
+        figure = figure.create()
+
+    try:
+        figure.savefig(path, **savefig_kwargs)
+    finally:
+        plt.close(figure)
+
+    return path
+
+
+class FigureSpec(object):
+    """
+    Describes a matplotlib figure by the function which creates it, instead of the figure itself. The *factory* is
+    called with the given *args* and *kwargs* and has to return a new Figure.
+
+    A FigureSpec can be passed to a FigureTestResult instead of a figure. Then not only the rendering, but also the
+    creation of the figure happens in a worker process of the FigureRenderer. For this to work, the factory has to be a
+    module level function and all the arguments have to be picklable.
+    """
+    def __init__(self, factory: Callable[..., plt.Figure], *args, **kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+
+    def create(self) -> plt.Figure:
+        return self.factory(*self.args, **self.kwargs)
+
+
+class FigureRenderer(object):
+    """
+    Renders matplotlib figures into image files within a pool of worker processes.
+
+    **DESIGN CHOICE**
+
+    Most tests create large figures (full frame images, histograms with thousands of bins...). Previously each of these
+    figures was saved right within the test, which means that the rendering of the PNG files often took longer than
+    the actual acquisition of the frames. Now the figures are only pickled within the test and the rendering is done by
+    separate processes, while the next test can already use the camera. Only when the test report is actually saved,
+    all the outstanding renderings have to be finished.
+
+    With 0 *workers*, the figures are rendered right away within the calling process. The same fallback is used for
+    figures which cannot be pickled.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        renderer = FigureRenderer(workers=2)
+        renderer.render(figure, '/tmp/figure.png')
+        # ...
+        renderer.wait()
+        renderer.shutdown()
+
+    :param workers: The number of worker processes
+    :param savefig_kwargs: Additional keyword arguments for all the "savefig" calls
+    """
+    def __init__(self, workers: int = 2, savefig_kwargs: Optional[dict] = None):
+        self.workers = workers
+        # https://stackoverflow.com/questions/11837979/removing-white-space-around-a-saved-image-in-matplotlib
+        # The parameters "bbox_inches" and "pad_inches" are supposed to reduce the whitespace around the plot.
+        self.savefig_kwargs = {'bbox_inches': 'tight', 'pad_inches': 0.2} if savefig_kwargs is None else savefig_kwargs
+
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.futures: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def render(self, figure: Union[plt.Figure, FigureSpec], path: str) -> Future:
+        """
+        Renders the given *figure* into the image file *path*. The rendering is only submitted to the worker pool, the
+        file does not necessarily exist when this method returns. Figure objects are closed after they have been
+        submitted, so they cannot be used afterwards.
+
+        :returns: A Future, which completes once the image file has been written. Its result is the path.
+        """
+        future = None
+        if self.workers > 0:
+            try:
+                data = figure if isinstance(figure, FigureSpec) else pickle.dumps(figure)
+                with self.lock:
+                    if self.executor is None:
+                        # "spawn" because a forked child would inherit the state of all the other threads, which may
+                        # currently be executing tests.
+                        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                            mp_context=multiprocessing.get_context('spawn'))
+                    future = self.executor.submit(render_figure, data, path, self.savefig_kwargs)
+
+                if isinstance(figure, plt.Figure):
+                    plt.close(figure)
+            except (pickle.PicklingError, TypeError, AttributeError, OSError):
+                # Some artists cannot be pickled and the worker processes may not be able to start. In these cases the
+                # figure is simply rendered right away.
+                future = None
+
+        if future is None:
+            future = Future()
+            try:
+                future.set_result(render_figure(figure, path, self.savefig_kwargs))
+            except Exception as error:
+                future.set_exception(error)
+
+        with self.lock:
+            self.futures[path] = future
+
+        return future
+
+    def wait(self) -> Dict[str, BaseException]:
+        """
+        Blocks until all the submitted figures have been rendered.
+
+        :returns: A dict, whose keys are the paths of all the figures whose rendering failed and the values are the
+            corresponding exceptions
+        """
+        with self.lock:
+            futures = dict(self.futures)
+            self.futures.clear()
+
+        errors = {}
+        for path, future in futures.items():
+            exception = future.exception()
+            if exception is not None:
+                errors[path] = exception
+
+        return errors
+
+    def shutdown(self) -> None:
+        """
+        Waits for all the outstanding renderings and then terminates the worker processes.
+
+        :returns: void
+        """
+        self.wait()
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
 
 class TestContext(AbstractContextManager):
     """
@@ -118,6 +288,12 @@ class TestContext(AbstractContextManager):
         self.firmware_version = None
         self.sensor_version = None
 
+        # The figures of the FigureTestResults are rendered by this object in separate processes, while the next tests
+        # are already running. The test report waits for all of them to be finished before it is saved.
+        self.figure_renderer = FigureRenderer(
+            workers=self.config.get_data_or_default(['tests', 'render_workers'], 2)
+        )
+
         self.config.pm.do_action('post_test_context_construction', context=self, namespace=globals())
 
     def start(self, name: str):
@@ -149,9 +325,18 @@ class TestContext(AbstractContextManager):
         # ~ LOGGING START MESSAGE
         self.logger.debug('Enter test context')
 
+        # ~ STREAMING THE PROGRESS
+        if self.config.get_data_or_default(['tests', 'progress'], True):
+            PROGRESS.start(run=self.folder_name, url=self.folder_url)
+
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        # ~ WAITING FOR THE FIGURES
+        self.figure_renderer.shutdown()
+
+        PROGRESS.stop(error=None if exc_val is None else str(exc_val))
+
         # ~ LOGGING END MESSAGE
         self.logger.debug('Exit test context')
 
@@ -205,6 +390,8 @@ class TestRunner(object):
         self.camera_class = self.config.pm.apply_filter('camera_class', UfoCamera)
         self.camera = self.camera_class(self.config)
         self.camera.set_up()
+        # Only one test at a time may use the camera. Tests which require the camera acquire this lock.
+        self.camera_lock = threading.Lock()
 
     def load_modules(self) -> None:
         """
@@ -353,6 +540,7 @@ class TestRunner(object):
         # A AbstractTest subclass can be instantiated by passing a single argument to the constructor and that is the
         # the test runner object itself.
         test_class = self.tests[test_name]
+        PROGRESS.emit(SUITE_STARTED, name=test_name, tests=[test_name])
         test_instance: AbstractTest = test_class(self)
         test_result: AbstractTestResult = test_instance.execute()
 
@@ -373,6 +561,7 @@ class TestRunner(object):
         # performed within the "get_test_suite" method.
         test_suite = self.get_test_suite(suite_name)
         self.context.start(suite_name)
+        PROGRESS.emit(SUITE_STARTED, name=suite_name, tests=[test_class.name for test_class in test_suite.tests])
 
         results = test_suite.execute_all()
         self.context.results.update(results)
@@ -508,8 +697,7 @@ class AbstractTestResult(HTMLTemplateMixin, AbstractRichOutput, ABC):
         return {
             **HTMLTemplateMixin.to_dict(self),
             'passing': self.passing,
-            'exit_code': self.exit_code,
-            'html': self.to_html()
+            'exit_code': self.exit_code
         }
 
 
@@ -600,16 +788,25 @@ class ImageTestResult(AbstractTestResult):
 
 
 class FigureTestResult(ImageTestResult):
+    """
+    Represents a matplotlib figure as the result of a test case.
 
-    def __init__(self, exit_code: int, test_context: TestContext, figure: plt.Figure, description: str):
+    The figure is not saved right away. It is passed to the FigureRenderer of the test context, which renders it into
+    the test folder in the background. The path of the image file is already known in advance, but the file itself may
+    only exist once "wait" returns. Instead of a figure object, a FigureSpec can also be passed, in which case even
+    the creation of the figure is done in the background.
+    """
+    def __init__(self,
+                 exit_code: int,
+                 test_context: TestContext,
+                 figure: Union[plt.Figure, FigureSpec],
+                 description: str):
         self.test_context = test_context
 
         # ~ SAVE IMAGE INTO TEST FOLDER
         self.figure_name = f'{random_string(10, additional_letters="")}.png'
         self.figure_path = self.test_context.get_path(self.figure_name)
-        # https://stackoverflow.com/questions/11837979/removing-white-space-around-a-saved-image-in-matplotlib
-        # The parameters "bbox_inches" and "pad_inches" are supposed to reduce the whitespace around the plot.
-        figure.savefig(self.figure_path, bbox_inches='tight', pad_inches=0.2)
+        self.future = self.test_context.figure_renderer.render(figure, self.figure_path)
 
         ImageTestResult.__init__(
             self,
@@ -619,6 +816,20 @@ class FigureTestResult(ImageTestResult):
             url_base=self.test_context.relative_url
         )
 
+    @property
+    def rendered(self) -> bool:
+        return self.future.done()
+
+    def wait(self) -> str:
+        """
+        Blocks until the figure has been rendered.
+
+        :raises Exception: Any exception, which occurred during the rendering
+
+        :returns: The path of the image file
+        """
+        return self.future.result()
+
 
 class DictTestResult(AbstractTestResult):
 
@@ -663,17 +874,13 @@ class DictTestResult(AbstractTestResult):
 
 class DictListTestResult(AbstractTestResult):
 
-    HTML_TEMPLATE_NAME = 'dict_list_test_result.html'
+    # The actual template is a file within the templates folder. The included template has access to "this" as well.
+    HTML_TEMPLATE = '{% include "dict_list_test_result.html" %}'
 
     def __init__(self, exit_code: int, data: Dict[Any, dict]):
         super(DictListTestResult, self).__init__(exit_code)
         self.data = data
 
-    # TODO: Write comment
-    def get_html_template_string(self) -> str:
-        template = get_template(self.HTML_TEMPLATE_NAME)
-        return template.render({'data': self.data})
-
     # IMPLEMENT "AbstractRichOutput"
     # ------------------------------
     # Since markdown and latex conversion are not being used at the moment anyways we'll leave them empty for the time
@@ -830,6 +1037,15 @@ class AbstractTest(ABC):
     name = "abstract"
     description = ""
 
+    # Whether or not the test interacts with the camera. Within a test suite, all the tests which require the camera
+    # are executed one after the other, while the others may be executed in parallel. See TestSuite
+    requires_camera = True
+
+    # Whether or not the test creates its figures with the global state of "matplotlib.pyplot" (plt.subplots etc.),
+    # which is not thread safe. These tests are executed one after the other as well, even if they do not require the
+    # camera. A test which creates its figures directly as "matplotlib.figure.Figure" objects can set this to False.
+    uses_pyplot = True
+
     def __init__(self, test_runner: TestRunner):
         self.test_runner = test_runner
         self.logger = self.test_runner.logger
@@ -839,6 +1055,7 @@ class AbstractTest(ABC):
 
     def execute(self) -> AbstractTestResult:
         start_datetime = datetime.datetime.now()
+        PROGRESS.emit(TEST_STARTED, name=self.name)
         try:
             test_result = self.run()
         except Exception as e:
@@ -857,6 +1074,8 @@ class AbstractTest(ABC):
 
         test_result.start_datetime = start_datetime
         test_result.end_start_time = end_datetime
+        PROGRESS.emit(TEST_FINISHED, name=self.name, exit_code=test_result.exit_code,
+                      duration=(end_datetime - start_datetime).total_seconds())
         return test_result
 
     def get_name(self):
@@ -868,12 +1087,25 @@ class AbstractTest(ABC):
 
 
 class TestSuite(object):
-
+    """
+    Represents a group of test cases, which are executed together.
+
+    **DESIGN CHOICE**
+
+    Originally all the tests of a suite were executed strictly one after the other. But many tests do not interact
+    with the camera at all (disk usage, script checks, ...) and those do not have to wait for the long running camera
+    tests. Every test now declares with its "requires_camera" flag whether it needs the camera. All the camera tests
+    are executed one after the other, in the order of the suite and while holding the camera lock of the test runner.
+    The tests which use the global pyplot state ("uses_pyplot") are executed within this same serial lane, because
+    pyplot is not thread safe. All the other tests are executed in a thread pool at the same time. The number of threads is defined by the
+    "tests.workers" config option. With only one worker, all tests are executed sequentially as before. Independent of
+    the order in which the tests finish, the results are always returned in the order of the suite.
+    """
     def __init__(self, test_runner: TestRunner, tests: List[Type[AbstractTest]], name: str):
         self.test_runner = test_runner
         self.tests = tests
         self.suite_name = name
-        self.config = Config()
+        self.config = test_runner.config
 
         self.results = {}
 
@@ -881,14 +1113,68 @@ class TestSuite(object):
         """
         Executes all all test cases which are part of this suite.
         """
+        worker_count = self.config.get_data_or_default(['tests', 'workers'], 4)
+        if worker_count <= 1:
+            for test_class in self.tests:
+                self.results[test_class.name] = self.execute_test(test_class)
+
+            return self.results
+
+        serial_tests = [test_class for test_class in self.tests if self.is_serial(test_class)]
+        other_tests = [test_class for test_class in self.tests if not self.is_serial(test_class)]
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=worker_count) as executor:
+            # All the camera and pyplot tests are a single task, which executes them one after the other. That way they
+            # keep their order and still only block one of the workers.
+            serial_future = executor.submit(self.execute_tests, serial_tests)
+            futures = {test_class.name: executor.submit(self.execute_test, test_class) for test_class in other_tests}
+
+            results.update(serial_future.result())
+            for name, future in futures.items():
+                results[name] = future.result()
+
         for test_class in self.tests:
-            test = test_class(self.test_runner)
-            csubtitle(f'TEST: {test.name}')
-            self.results[test.name] = test.execute()
-            cresult(f'{test.name} DONE')
+            self.results[test_class.name] = results[test_class.name]
 
         return self.results
 
+    @classmethod
+    def is_serial(cls, test_class: Type[AbstractTest]) -> bool:
+        """
+        Whether the given *test_class* has to be executed within the serial lane of the suite, because it either
+        requires the camera or uses the global pyplot state.
+
+        :returns: boolean value
+        """
+        return test_class.requires_camera or test_class.uses_pyplot
+
+    def execute_tests(self, test_classes: List[Type[AbstractTest]]) -> Dict[str, AbstractTestResult]:
+        """
+        Executes all the given *test_classes* one after the other.
+
+        :returns: A dict whose keys are the test names and the values the according test results
+        """
+        return {test_class.name: self.execute_test(test_class) for test_class in test_classes}
+
+    def execute_test(self, test_class: Type[AbstractTest]) -> AbstractTestResult:
+        """
+        Executes the single test *test_class*. If the test requires the camera, it is only executed while holding the
+        camera lock of the test runner.
+
+        :returns: The test result
+        """
+        test = test_class(self.test_runner)
+        csubtitle(f'TEST: {test.name}')
+        if test.requires_camera:
+            with self.test_runner.camera_lock:
+                result = test.execute()
+        else:
+            result = test.execute()
+        cresult(f'{test.name} DONE')
+
+        return result
+
     def get_name(self):
         return 'suite:{}'.format(self.suite_name)
 
@@ -989,20 +1275,47 @@ class TestReport(HTMLTemplateMixin, AbstractRichOutput):
         self.result_dicts = {name: result.to_dict() for name, result in self.results.items()}
 
     def save(self, folder_path: str):
-        # 1 -- SAVE MARKDOWN FILE
-        markdown_path = os.path.join(folder_path, 'report.md')
-        with open(markdown_path, mode='w') as markdown_file:
-            markdown_file.write(self.to_markdown())
+        """
+        Saves the markdown, html and json versions of the report into the given *folder_path* and adds the report to
+        the report index.
+
+        **DESIGN CHOICE**
+
+        Every result is converted into its dict only once, when the report is constructed. All the output formats are
+        rendered from these dicts, the report dict itself is created once and shared by the json file and the report
+        index. The rendering happens first, while the figures of the results may still be rendered by the worker
+        processes of the figure renderer. Only the writing of the files waits for the figures, so that a report never
+        references images, which do not exist yet. The files are then written concurrently. The report is only added to
+        the index, once all the files have been written successfully.
 
-        # 2 -- SAVE HTML FILE
-        html_path = os.path.join(folder_path, 'report.html')
-        with open(html_path, mode='w') as html_file:
-            html_file.write(self.to_html())
+        :returns: void
+        """
+        # 1 -- RENDER ALL OUTPUTS
+        data = self.to_dict()
+        contents = {
+            'report.md':        self.to_markdown(),
+            'report.html':      self.to_html(),
+            'report.json':      json.dumps(data, sort_keys=True, indent=4)
+        }
 
-        # 3 -- SAVE JSON FILE
-        json_path = os.path.join(folder_path, 'report.json')
-        with open(json_path, mode='w') as json_file:
-            json_file.write(self.to_json())
+        # 2 -- WAIT FOR THE FIGURES
+        for path, error in self.context.figure_renderer.wait().items():
+            self.context.logger.error(f'Rendering the figure "{path}" failed: {error}')
+
+        # 3 -- WRITE THE FILES
+        with ThreadPoolExecutor(max_workers=len(contents)) as executor:
+            futures = [executor.submit(write_file, os.path.join(folder_path, name), content)
+                       for name, content in contents.items()]
+            for future in futures:
+                future.result()
+
+        # 4 -- UPDATE THE REPORT INDEX
+        # Only now that all the files exist. Otherwise the index could list a report, whose files failed to be written
+        # or which do not exist yet.
+        ReportIndex(config=self.config).add(TEST, folder_path, data)
+
+        # 5 -- UPDATE THE DISK USAGE
+        DiskUsageTracker(config=self.config).record(ARCHIVE, folder_path)
 
     # == UTILITY FUNCTIONS
 
@@ -1034,15 +1347,35 @@ class TestReport(HTMLTemplateMixin, AbstractRichOutput):
             'sensor_version':       self.sensor_version,
             'test_descriptions':    self.test_descriptions,
             'result_dicts':         self.result_dicts,
+            # Added 2.0.0
+            'schema_version':       REPORT_SCHEMA_VERSION,
         }
 
     def to_json(self) -> str:
         data = self.to_dict()
         return json.dumps(data, sort_keys=True, indent=4)
 
+    @classmethod
+    def migrate_dict(cls, data: dict) -> dict:
+        """
+        Converts the report *data* dict, which was loaded from the report.json of an older version, into the current
+        compact schema. The template strings of all the results are replaced by references to the templates of their
+        classes, as long as these classes still use the same templates. The report itself always references the current
+        report template, which is also what "ci recompile" is for.
+
+        :returns: The migrated report dict
+        """
+        data = cls.compact_dict(data)
+        data.pop(cls.TEMPLATE_FIELD_NAME, None)
+        data[cls.TEMPLATE_REFERENCE_FIELD_NAME] = cls.get_template_reference()
+        data['schema_version'] = REPORT_SCHEMA_VERSION
+
+        return data
+
     # -- IMPLEMENT "HTMLTemplateMixin"
 
-    def get_html_template_string(self) -> str:
+    @classmethod
+    def get_class_html_template_string(cls) -> str:
         template_path = os.path.join(TEMPLATE_PATH, 'test_report.html')
         with open(template_path, mode='r') as file:
             template_string = file.read()
@@ -1064,6 +1397,90 @@ class TestReport(HTMLTemplateMixin, AbstractRichOutput):
         pass
 
 
+def migrate_report(folder_path: str) -> Optional[dict]:
+    """
+    Converts the report.json file within the test report folder *folder_path* into the current compact schema (see
+    REPORT_SCHEMA_VERSION). The file is replaced atomically, so that it is never left in a broken state.
+
+    :returns: The migrated report dict or None if the report already uses the current schema
+    """
+    json_path = os.path.join(folder_path, 'report.json')
+    with open(json_path, mode='r') as file:
+        data = json.load(file)
+
+    if data.get('schema_version', 1) >= REPORT_SCHEMA_VERSION:
+        return None
+
+    data = TestReport.migrate_dict(data)
+    with open(f'{json_path}.tmp', mode='w') as file:
+        json.dump(data, file, sort_keys=True, indent=4)
+    os.replace(f'{json_path}.tmp', json_path)
+
+    return data
+
+
+def get_recompile_fingerprint(config: Config = CONFIG) -> str:
+    """
+    Returns the fingerprint of everything besides the report.json itself, which affects the html of a recompiled test
+    report: The version of ufotest, the templates and the urls of the given *config*.
+
+    :returns: The hex digest of the hash
+    """
+    digest = hashlib.sha256()
+    digest.update(get_version().encode())
+    digest.update(config.url('').encode())
+    digest.update(config.static('').encode())
+    digest.update(get_template_fingerprint(config.template_environment).encode())
+
+    return digest.hexdigest()
+
+
+def recompile_report(folder_path: str,
+                     fingerprint: str,
+                     since: Optional[str] = None,
+                     force: bool = False) -> str:
+    """
+    Renders the report.html file of the test report within *folder_path* from its report.json file.
+
+    **DESIGN CHOICE**
+
+    Recompiling is mainly needed after the url of the server has changed or after an update of ufotest. Every time the
+    html file is rendered, the hash of the report.json content together with the given *fingerprint* (see
+    "get_recompile_fingerprint") is saved into the "report.fingerprint" file. If the new hash is the same, the html
+    would not change and the report is skipped. Only the raw json content has to be read for that, it is only parsed if
+    the report actually has to be rendered. This function is executed by the worker processes of "ci recompile".
+
+    :param folder_path: The absolute path of the test report folder
+    :param fingerprint: The fingerprint of the templates and the config
+    :param since: An ISO datetime string. Only reports, which were started after this datetime are recompiled
+    :param force: Whether to recompile the report even if nothing has changed
+
+    :returns: RECOMPILED, UNCHANGED or FILTERED
+    """
+    html_path = os.path.join(folder_path, 'report.html')
+    fingerprint_path = os.path.join(folder_path, 'report.fingerprint')
+    with open(os.path.join(folder_path, 'report.json'), mode='rb') as file:
+        content = file.read()
+
+    data = None
+    if since is not None:
+        data = json.loads(content)
+        if data.get('start_iso', '') < since:
+            return FILTERED
+
+    report_fingerprint = hashlib.sha256(fingerprint.encode() + content).hexdigest()
+    if not force and os.path.exists(html_path) and os.path.exists(fingerprint_path):
+        with open(fingerprint_path, mode='r') as file:
+            if file.read() == report_fingerprint:
+                return UNCHANGED
+
+    data = json.loads(content) if data is None else data
+    write_file(html_path, HTMLTemplateMixin.html_from_dict(data))
+    write_file(fingerprint_path, report_fingerprint)
+
+    return RECOMPILED
+
+
 class _TestReport(AbstractRichOutput):
     """
     :deprecated:
@@ -9,7 +9,8 @@ import matplotlib.pyplot as plt
 from ufotest.testing import AbstractTest, FigureTestResult, MessageTestResult, CombinedTestResult, TestRunner
 from ufotest.camera import get_frame
 from ufotest.exceptions import PciError, FrameDecodingError
-from ufotest.util import get_folder_size, format_byte_size
+from ufotest.util import format_byte_size
+from ufotest.usage import DiskUsageTracker
 
 
 class RepeatedResetTest(AbstractTest):
@@ -228,12 +229,15 @@ class DiskUsageTest(AbstractTest):
     FREE_SPACE_THRESHOLD_GB = 10.0
 
     name = 'disk_usage'
+    requires_camera = False
+    uses_pyplot = False
 
     description = (
         f'This is a simple test, which will fail if the free space of the disk where ufotest is currently installed '
         f'goes below the critical threshold of {FREE_SPACE_THRESHOLD_GB} GB. This will serve as a warning to clean up '
         f'old entries of the test and build archive. If this test fails it is advised that you log into the ufotest '
-        f'system and delete the oldest entries, which are no longer needed.'
+        f'system and run the "ufotest archive gc" command, which compacts and deletes the old entries according to '
+        f'the retention policy of the [archive] section of the config file.'
     )
 
     def __init__(self, test_runner: TestRunner):
@@ -241,7 +245,10 @@ class DiskUsageTest(AbstractTest):
 
     def run(self):
         # https://stackoverflow.com/questions/48929553/get-hard-disk-size-in-python
-        ufotest_used = get_folder_size(self.config.get_path())
+        # Only the folders which have changed since they were last recorded are measured again
+        tracker = DiskUsageTracker(config=self.config)
+        tracker.refresh()
+        ufotest_used = tracker.total()
         total, used, free = shutil.disk_usage('/')
         threshold = self.FREE_SPACE_THRESHOLD_GB * 1024 ** 3
 
@@ -263,7 +270,8 @@ class DiskUsageTest(AbstractTest):
             message += (
                 '<span style="color: lightcoral;">This is not much remaining space and you are strongly advised to log '
                 'into the system administration of the machine, where ufotest is currently installed and running to '
-                'delete the oldest and unneeded entries of both the test and the build archives!</span>'
+                'run the command <code>ufotest archive gc</code>, which compacts and deletes the oldest entries of '
+                'both the test and the build archives according to the retention policy!</span>'
             )
             exit_code = 1
 
@@ -231,6 +231,11 @@ class FrameAcquisitionTime(AbstractTest):
             f'standard deviation within that batch. (right) This bar chart shows how many frames in each batch could'
             f'not be acquired due to some error.'
         )
+        # The acquisition time strongly depends on how the frame data is transferred from the camera, which is why the
+        # used transport is mentioned, if the camera supports it.
+        if self.camera.supports_prop('frame_transport'):
+            fig_description += f' The frames were received using the "{self.camera.get_prop("frame_transport")}" ' \
+                               f'frame transport.'
         figure_result = FigureTestResult(exit_code, self.context, fig, fig_description)
 
         return figure_result
@@ -5,6 +5,8 @@ from ufotest.testing import MessageTestResult
 class LibucaInstalledTest(AbstractTest):
 
     name = 'libuca_installed'
+    requires_camera = False
+    uses_pyplot = False
 
     def __init__(self, test_runner: TestRunner):
         AbstractTest.__init__(self, test_runner)
@@ -17,6 +17,7 @@ from ufotest.testing import (AbstractTest,
 class MockTest(AbstractTest):
 
     name = "mock"
+    requires_camera = False
 
     description = (
         "This test case is simply a mock, which is used to test the ufotest software tools. The test case does "
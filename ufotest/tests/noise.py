@@ -1,4 +1,3 @@
-import math
 import time
 import random
 import statistics
@@ -20,6 +19,7 @@ from ufotest.testing import (AbstractTest,
                              CombinedTestResult,
                              DictTestResult)
 from ufotest.exceptions import PciError, FrameDecodingError
+from ufotest.analysis.noise import pair_variance, pixel_variance, rms_noise
 
 
 # == UTILITY FUNCTIONS
@@ -30,23 +30,15 @@ def calculate_pair_variance(frame1: np.ndarray, frame2: np.ndarray) -> float:
     *frame2*, this method calculates the variance of the difference of those frames. This measure of variance is the
     necessary value to determine the noise of the camera.
 
+    This function only remains for backwards compatibility. The actual calculation is done by the vectorized kernel
+    "ufotest.analysis.noise.pair_variance".
+
     :param frame1: The first of the two independent(!) frames
     :param frame2: The second frame
 
     :returns float: The variance
     """
-    frame1_mean = np.mean(frame1)
-    frame2_mean = np.mean(frame2)
-
-    row_count = len(frame1)
-    column_count = len(frame1[0])
-    squared_sum = 0
-    for i in range(row_count):
-        for j in range(column_count):
-            squared_sum += ((frame1[i][j] - frame1_mean) - (frame2[i][j] - frame2_mean)) ** 2
-
-    variance = squared_sum / (2 * row_count * column_count)
-    return variance
+    return pair_variance(frame1, frame2)
 
 
 # == ACTUAL TEST CASES
@@ -69,14 +61,13 @@ class MeasureNoiseMixin:
 
         :return: float
         """
-        frame1 = self.camera.get_frame()
+        frame1, frame2 = self.camera.get_frames(2)
         self.noise_measurement['frame1'] = frame1
-        frame2 = self.camera.get_frame()
         self.noise_measurement['frame2'] = frame2
 
-        variance = calculate_pair_variance(frame1, frame2)
+        variance = pair_variance(frame1, frame2)
         self.noise_measurement['variance'] = variance
-        rmsnoise = np.sqrt(variance)
+        rmsnoise = rms_noise(variance)
         self.noise_measurement['rmsnoise'] = rmsnoise
 
         return rmsnoise
@@ -111,13 +102,11 @@ class CalculatePairNoiseTest(AbstractTest):
 
         message_result = MessageTestResult(self.exit_code, self.INFO_MESSAGE)
 
-        frame1 = self.camera.get_frame()
-        cprint('Captured frame 1')
-        frame2 = self.camera.get_frame()
-        cprint('Captured frame 2')
+        frame1, frame2 = self.camera.get_frames(2)
+        cprint('Captured 2 frames')
 
-        variance = calculate_pair_variance(frame1, frame2)
-        rmsnoise = math.sqrt(variance)
+        variance = pair_variance(frame1, frame2)
+        rmsnoise = rms_noise(variance)
 
         dict_result = DictTestResult(self.exit_code, {
             'variance': round(variance, ndigits=self.NDIGITS),
@@ -202,7 +191,6 @@ class CalculateMultiNoiseTest(AbstractTest):
     def __init__(self, test_runner: TestRunner):
         super(CalculateMultiNoiseTest, self).__init__(test_runner)
         self.frames = []
-        self.frame_array = None
 
         self.variance_frame = np.zeros(shape=(self.config.get_sensor_height(), self.config.get_sensor_width()))
         self.noise_frame = np.zeros(shape=(self.config.get_sensor_height(), self.config.get_sensor_width()))
@@ -217,22 +205,14 @@ class CalculateMultiNoiseTest(AbstractTest):
                 cprint(f'Failed to acquire frame {i + 1}')
 
         # ~ Calculating the noise
-        self.frame_array = np.zeros(shape=(
-            self.config.get_sensor_height(),
-            self.config.get_sensor_width(),
-            len(self.frames)
-        ))
-        for index, frame in enumerate(self.frames):
-            self.frame_array[:, :, index] = frame
-
-        cprint(f'Assembled {len(self.frames)} frames into a 3d numpy array')
-        cprint(f'max: {np.max(self.frame_array)} - min: {np.min(self.frame_array)}')
-
-        self.variance_frame = np.var(self.frame_array, axis=2)
+        # "pixel_variance" accumulates the per pixel variance frame by frame, so there is no need to assemble all the
+        # frames into one big float array first.
+        self.variance_frame = pixel_variance(self.frames)
         self.noise_frame = np.sqrt(self.variance_frame)
+        cprint(f'Calculated the pixel variance over {len(self.frames)} frames')
 
-        variance = np.mean(self.variance_frame)
-        noise = np.sqrt(variance)
+        variance = float(np.mean(self.variance_frame))
+        noise = rms_noise(self.variance_frame)
 
         fig = self.create_variance_figure()
 
@@ -273,9 +253,8 @@ class CalculateNoiseWorker(mp.Process):
             # the camera at that exposure time.
             exposure_time, frame1, frame2 = self.task_queue.get()
 
-            variance = calculate_pair_variance(frame1, frame2)
-            print(f"variance {variance}")
-            noise = np.sqrt(variance)
+            variance = pair_variance(frame1, frame2)
+            noise = rms_noise(variance)
 
             # The result will be a tuple whose first element is again the exposure time and the second element is the
             # resulting noise value which was calculated
@@ -350,8 +329,8 @@ class CalculateNoiseMultiProcessing(AbstractTest):
     def calculate_sequential(self):
         start_time = time.time()
         for exp, frame1, frame2 in self.tasks:
-            variance = calculate_pair_variance(frame1, frame2)
-            noise = np.sqrt(variance)
+            variance = pair_variance(frame1, frame2)
+            noise = rms_noise(variance)
 
         end_time = time.time()
         self.sequential_time = end_time - start_time
@@ -415,8 +394,7 @@ class CalculateDarkPhotonTransferCurve(MeasureNoiseMixin, AbstractTest):
 
             for i in range(self.reps):
                 try:
-                    frame1 = self.camera.get_frame()
-                    frame2 = self.camera.get_frame()
+                    frame1, frame2 = self.camera.get_frames(2)
                     self.tasks.append((exposure_time, frame1, frame2))
                     cprint(f'Acquired two frames for exp time: {exposure_time}')
 
@@ -424,25 +402,15 @@ class CalculateDarkPhotonTransferCurve(MeasureNoiseMixin, AbstractTest):
                     error_count += 1
                     cprint(f'Failed to acquire frames for exp time: {exposure_time}')
 
-        # ~ Calculating the noises in parallel
-        task_queue = mp.Queue()
-        [task_queue.put(task) for task in self.tasks]
-        result_queue = mp.Queue()
-
-        worker_count = 4
-        workers = []
-        for i in range(worker_count):
-            worker = CalculateNoiseWorker(task_queue, result_queue)
-            worker.start()
-            workers.append(worker)
-
-        [worker.join() for worker in workers]
-
-        while not result_queue.empty():
-            exposure_time, noise = result_queue.get()
+        # ~ Calculating the noises
+        # This used to be distributed to a pool of worker processes, because the pure python calculation of the pair
+        # variance was so slow. With the vectorized kernel the sequential calculation only takes a fraction of a
+        # second per pair and the overhead of pickling all the frames to the workers is not worth it anymore.
+        for exposure_time, frame1, frame2 in self.tasks:
+            noise = rms_noise(pair_variance(frame1, frame2))
             self.noises[exposure_time].append(noise)
 
-        cprint('Calculated noises in parallel')
+        cprint('Calculated noises')
 
         ptc_fig = self.create_ptc_figure(self.exposure_times, self.noises)
 
@@ -504,16 +472,8 @@ class CalculateDarkPhotonTransferCurve2(AbstractTest):
                 except (PciError, FrameDecodingError) as e:
                     print(e.__class__)
 
-            frame_array = np.zeros(shape=(
-                self.config.get_sensor_height(),
-                self.config.get_sensor_width(),
-                len(frames)
-            ))
-            for index, frame in enumerate(frames):
-                frame_array[:, :, index] = frame
-
-            variance = np.mean(np.var(frame_array, axis=2) / len(frames))
-            noise = np.sqrt(variance)
+            variance = float(np.mean(pixel_variance(frames) / len(frames)))
+            noise = rms_noise(variance)
             cprint(f'{variance} - {noise}')
 
         return MessageTestResult(0, "a")
@@ -14,6 +14,9 @@ from ufotest.util import run_command
 
 class ScriptTest(AbstractTest):
 
+    requires_camera = False
+    uses_pyplot = False
+
     BOOLEAN_COLORS = {
         True: 'lightgreen',
         False: 'lightcoral'
@@ -44,6 +47,8 @@ class ScriptTest(AbstractTest):
 class LoadedScriptsTest(AbstractTest):
 
     name = 'loaded_scripts'
+    requires_camera = False
+    uses_pyplot = False
     description = (
         'This test will check if all build version of the external scripts have been loaded. The external scripts are '
         'usually bash scripts which manage the actual interfacing with the camera hardware. By default, ufotest ships '
@@ -0,0 +1,357 @@
+"""
+This module contains the "frame transports". A frame transport implements the way in which the raw data of a frame,
+which has previously been requested from the camera, is transferred from the DMA engine of the FPGA board into a numpy
+array within the python process.
+
+**DESIGN CHOICE**
+
+Originally the UfoCamera received a frame by first writing the DMA output of the "pci" command into a temporary file,
+then invoking "ipedec" to decode this file into yet another temporary ".raw" file, which was then finally read back
+into a numpy array. That is three process spawns, two full frame disk writes and a full frame disk read for every single
+frame.
+
+This process is now wrapped by the "FileFrameTransport" class. The "PipeFrameTransport" on the other hand reads the DMA
+output directly from the stdout pipe of the "pci" process into a reusable in-memory buffer and only uses a RAM backed
+scratch file (/dev/shm) for the decoding step. The decoded image is then read straight into the target numpy array
+without any intermediate copies.
+
+The transports are pluggable: The UfoCamera selects the transport based on the "camera.frame_transport" config option
+and the "ufo_camera_transport_class" filter hook. Should the selected transport not be available on the current system,
+the camera falls back to the FileFrameTransport.
+
+Independent of the transport, the "camera.frame_decoder" config option selects whether the data is decoded with the
+external "ipedec" binary or with the numpy decoder from "ufotest.decoding". With the numpy decoder the PipeFrameTransport
+decodes the received buffer directly, without any files or additional processes.
+"""
+import os
+import shutil
+import subprocess
+import threading
+from abc import abstractmethod
+from typing import Optional, Dict, Type
+
+import numpy as np
+
+from ufotest.exceptions import PciError, FrameDecodingError
+from ufotest.decoding import decode_frames, frame_word_count
+
+
+class AbstractFrameTransport(object):
+    """
+    This is the abstract base class for all frame transports. A transport is constructed with the camera object to
+    which it belongs.
+
+    A frame transport has to implement the "is_available" method, which returns whether or not the transport can be
+    used on the current system, and the "receive_frames" method, which receives the data of one or multiple frames,
+    which have already been requested from the camera, and returns them as a numpy array.
+    """
+    #: This is the string name with which the transport can be selected in the config file
+    name = 'abstract'
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.config = camera.config
+
+        # Either "ipedec" or "numpy"
+        self.decoder = self.config.get_data_or_default(['camera', 'frame_decoder'], 'ipedec')
+
+    @property
+    def width(self) -> int:
+        return self.config.get_sensor_width()
+
+    @property
+    def height(self) -> int:
+        return self.config.get_sensor_height()
+
+    @abstractmethod
+    def is_available(self) -> bool:
+        """
+        Returns whether or not this transport can be used on the current system.
+
+        :returns bool:
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def receive_frames(self, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Receives the data of *count* frames, which have previously been requested from the camera as one burst and
+        returns them as a numpy array of the shape (count, height, width).
+
+        :param count: The number of frames which have been requested
+        :param out: Optionally a preallocated uint16 array with the shape (count, height, width) into which the frames
+            will be written. If not given, a new array is created.
+
+        :raises PciError: If there is any problem with the data transfer
+        :raises FrameDecodingError: If the received data cannot be decoded
+
+        :returns: The frames array
+        """
+        raise NotImplementedError()
+
+    def receive(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Receives the data of a single frame, which has previously been requested from the camera and returns it as a
+        numpy array of the shape (height, width).
+
+        :param out: Optionally a preallocated uint16 array with the shape (height, width) into which the frame will be
+            written. If not given, a new array is created.
+
+        :raises PciError: If there is any problem with the data transfer
+        :raises FrameDecodingError: If the received data cannot be decoded
+
+        :returns: The frame array
+        """
+        if out is None:
+            return self.receive_frames(1)[0]
+
+        self.receive_frames(1, out=out[np.newaxis])
+        return out
+
+    # -- Utility methods
+
+    def allocate_frames(self, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the given *out* array, if it is a valid target for *count* frames, or creates a new uint16 array for
+        that many frames.
+
+        :raises ValueError: If the given out array does not have the right shape or data type
+
+        :returns: The array into which the frames are to be written
+        """
+        shape = (count, self.height, self.width)
+        if out is None:
+            return np.empty(shape=shape, dtype=np.uint16)
+
+        if out.shape != shape or out.dtype != np.uint16:
+            raise ValueError(f'The frame buffer has to be an uint16 array of shape {shape} but an array of dtype '
+                             f'{out.dtype} and shape {out.shape} was given')
+
+        return out
+
+    def read_raw(self, path: str, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Reads the decoded .raw image file at *path*, which contains *count* frames, directly into the array *out*.
+
+        :raises FrameDecodingError: If the file does not contain enough data for all the frames
+
+        :returns: The frames array
+        """
+        out = self.allocate_frames(count, out)
+        with open(path, mode='rb') as file:
+            # "readinto" writes directly into the memory of the numpy array, there is no intermediate bytes object
+            byte_count = file.readinto(memoryview(out).cast('B'))
+
+        if byte_count != out.nbytes:
+            raise FrameDecodingError(f'The decoded frame file "{path}" only contained {byte_count} of the expected '
+                                     f'{out.nbytes} bytes for {count} frame(s)')
+
+        return out
+
+    def decode_command(self, data_path: str) -> str:
+        """
+        Returns the string command which decodes the raw DMA data in the file *data_path* into a .raw image file with
+        the same path but ".raw" appended. If the data contains multiple frames, ipedec writes all of them into this
+        one file.
+
+        :returns str:
+        """
+        return 'ipedec -r {height} --num-columns {width} {path} {verbose}'.format(
+            height=self.height,
+            width=self.width,
+            path=data_path,
+            verbose='-v' if self.config.verbose() else ''
+        )
+
+    def decode_data(self, data: memoryview, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes the raw DMA *data* of *count* frames in-process with the numpy decoder into the array *out*.
+
+        :raises FrameDecodingError: If the data cannot be decoded or does not contain *count* frames
+
+        :returns: The frames array
+        """
+        expected_size = count * frame_word_count(self.width, self.height) * 4
+        if len(data) != expected_size:
+            raise FrameDecodingError(f'Expected {expected_size} bytes of data for {count} frame(s), but received '
+                                     f'{len(data)} bytes')
+
+        return decode_frames(data, self.width, self.height, out=self.allocate_frames(count, out))
+
+    def decode_file(self, data_path: str, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes the raw DMA data of *count* frames in the file *data_path* and reads the result into the array *out*.
+        Depending on the configured decoder, either ipedec is invoked or the file is decoded in-process.
+
+        :raises FrameDecodingError: If the decoding fails
+
+        :returns: The frames array
+        """
+        if self.decoder == 'numpy':
+            with open(data_path, mode='rb') as file:
+                return self.decode_data(file.read(), count, out)
+
+        result = self.camera.execute_command(self.decode_command(data_path))
+        # If this step fails, it is usually because not enough bytes could be received. Wrong data vs no data at all.
+        if result['exit_code']:
+            stdout = result['stdout']
+            raise FrameDecodingError(stdout[:stdout.find('\n')])
+
+        return self.read_raw(f'{data_path}.raw', count, out)
+
+
+class FileFrameTransport(AbstractFrameTransport):
+    """
+    Receives frames by writing the DMA data into a temporary file, decoding that file with ipedec and then reading
+    the resulting .raw file. This is the original way of receiving frames. It only requires the "pci" and "ipedec"
+    commands and works on every system, which is why it is used as the fallback.
+    """
+    name = 'file'
+
+    def is_available(self) -> bool:
+        return True
+
+    def receive_frames(self, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        self.camera.receive_frame()
+        if self.decoder == 'numpy':
+            return self.decode_file(self.camera.data_path, count, out)
+
+        self.camera.decode_frame()
+        return self.read_raw(self.camera.frame_path, count, out)
+
+
+class PipeFrameTransport(AbstractFrameTransport):
+    """
+    Receives frames by reading the DMA data directly from the stdout pipe of the "pci" command into an in-memory
+    buffer. The buffer is reused for all subsequent frames.
+
+    With the numpy decoder, the buffer is decoded directly. Only when using ipedec the decoding step still needs a file,
+    because ipedec can only decode files. This scratch file is placed within the RAM backed /dev/shm folder, so the
+    frame data never touches the disk.
+    """
+    name = 'pipe'
+
+    #: The bytes which are read from the pipe in a single system call
+    CHUNK_SIZE = 4 * 1024 ** 2
+
+    #: The number of bytes at the end of the received data, which are searched for the error message of pci
+    ERROR_SIZE = 4096
+
+    def __init__(self, camera, shm_path: str = '/dev/shm'):
+        AbstractFrameTransport.__init__(self, camera)
+        self.shm_path = shm_path
+        self.data_path = os.path.join(self.shm_path, f'ufotest_frame_{os.getpid()}')
+
+        # The raw DMA data is larger than the decoded frame due to the packet headers, but it should not be more than
+        # two bytes per pixel. The buffer will be grown if this initial guess ever turns out to be too small.
+        self.buffer = bytearray(2 * self.width * self.height)
+
+    def is_available(self) -> bool:
+        # The data is read from the stdout of the pci process, so the pci binary itself has to be available
+        if shutil.which('pci') is None:
+            return False
+
+        return self.decoder == 'numpy' or os.access(self.shm_path, os.W_OK)
+
+    def receive_command(self) -> str:
+        return 'pci -r dma0 --multipacket -o /dev/stdout'
+
+    def receive_frames(self, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        data = self.receive_data()
+        try:
+            self.camera.acknowledge_frame()
+            return self.decode(data, count, out)
+        finally:
+            # The view has to be released, otherwise the buffer could not be grown during the next receive
+            data.release()
+
+    def receive_data(self) -> memoryview:
+        """
+        Runs the pci command, which outputs the DMA data to stdout and reads all of it into the internal buffer.
+
+        :raises PciError: If the pci command fails
+
+        :returns: A memoryview of the part of the internal buffer, which contains the received data
+        """
+        process = subprocess.Popen(
+            self.receive_command(),
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+
+        # The stderr pipe has to be drained at the same time as stdout. Otherwise pci would block as soon as it has
+        # written more than a pipe buffer to stderr, while this process still waits for the end of stdout.
+        errors = []
+        error_thread = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        error_thread.start()
+
+        size = 0
+        with process.stdout as stdout:
+            while True:
+                if size + self.CHUNK_SIZE > len(self.buffer):
+                    self.buffer.extend(bytes(max(self.CHUNK_SIZE, len(self.buffer))))
+
+                with memoryview(self.buffer) as view:
+                    count = stdout.readinto(view[size:size + self.CHUNK_SIZE])
+                if not count:
+                    break
+                size += count
+
+        error_thread.join()
+        process.stderr.close()
+        exit_code = process.wait()
+        if exit_code:
+            # pci writes its error messages to stdout. There they end up in the buffer behind all the data which was
+            # received before the error occurred, which is why only the end of the received data is checked.
+            output = bytes(self.buffer[max(0, size - self.ERROR_SIZE):size])
+            raise PciError(self.error_message(b''.join(errors), output, exit_code))
+
+        return memoryview(self.buffer)[:size]
+
+    @classmethod
+    def error_message(cls, stderr: bytes, stdout: bytes, exit_code: int) -> str:
+        """
+        Returns the error message of a failed pci command, given the bytes it has written to *stderr* and the last bytes
+        it has written to *stdout*. The first line of stderr is preferred and otherwise the last line of stdout is used.
+
+        :returns: The error message
+        """
+        stderr_lines = stderr.decode(errors='replace').strip().splitlines()
+        if stderr_lines:
+            return stderr_lines[0]
+
+        stdout_lines = stdout.decode(errors='replace').strip().splitlines()
+        if stdout_lines:
+            return stdout_lines[-1]
+
+        return f'pci exited with code {exit_code}'
+
+    def decode(self, data: memoryview, count: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Decodes the raw DMA *data* of *count* frames into the array *out*.
+
+        :raises FrameDecodingError: If the decoding fails
+
+        :returns: The frames array
+        """
+        if self.decoder == 'numpy':
+            return self.decode_data(data, count, out)
+
+        try:
+            with open(self.data_path, mode='wb') as file:
+                file.write(data)
+
+            return self.decode_file(self.data_path, count, out)
+        finally:
+            for path in [self.data_path, f'{self.data_path}.raw']:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+#: This dict maps the string names, which can be used for the "camera.frame_transport" config option to the
+#: corresponding transport classes.
+FRAME_TRANSPORTS: Dict[str, Type[AbstractFrameTransport]] = {
+    FileFrameTransport.name: FileFrameTransport,
+    PipeFrameTransport.name: PipeFrameTransport
+}
@@ -0,0 +1,271 @@
+"""
+This module contains the "DiskUsageTracker", which keeps track of the disk space used by the ufotest installation.
+
+**DESIGN CHOICE**
+
+Previously the home page of the web interface and the "disk_usage" test case both called "get_folder_size" on the
+whole installation folder. This function recursively stats every single file, which includes the full copy of the
+source repository within every build folder. With a few hundred builds this means that just loading the home page
+stats hundreds of thousands of files.
+
+The tracker instead records the size of each individual run folder at the moment it is saved (See "TestReport.save"
+and "BuildReport.save") and keeps a running total for each category of folders (archive, builds, static, blobs and all
+the other content of the installation folder) within a small SQLite database. Reading the current usage is then only a
+single query. The files within the build folders, which are hard links into the blob store, are only counted once as
+part of the blobs category.
+
+Folders which are modified or deleted manually are not noticed automatically. The "refresh" method compares the
+modification times of the top level entries of each category with the recorded ones and only measures those entries
+again, which have actually changed. Note that the modification time of a folder only changes when its direct content
+changes, deeper modifications are only picked up by a full "rebuild" (see the "ufotest ci reindex" command).
+"""
+import os
+import sqlite3
+import threading
+import contextlib
+from typing import Optional, Dict, Iterator, List
+
+from ufotest.config import Config, CONFIG, get_path
+from ufotest.util import get_folder_size
+from ufotest.index import ensure_schema
+
+#: The category for the test run folders within the archive
+ARCHIVE = 'archive'
+#: The category for the build folders
+BUILDS = 'builds'
+#: The category for the static assets of the web interface
+STATIC = 'static'
+#: The category for the content addressed storage of the build artifacts (See "ufotest.ci.blobs")
+BLOBS = 'blobs'
+#: The category for all the other files and folders within the installation folder
+OTHER = 'other'
+
+CATEGORIES = [ARCHIVE, BUILDS, STATIC, BLOBS, OTHER]
+
+
+class DiskUsageTracker(object):
+    """
+    Wraps the SQLite database, which tracks the disk usage of the individual folders of the ufotest installation.
+
+    **EXAMPLE**
+
+    .. code-block:: python
+
+        tracker = DiskUsageTracker()
+        # Measures a new test run folder and adds its size to the archive total
+        tracker.record(ARCHIVE, folder_path)
+        # Only measures the entries which have changed since they were recorded
+        tracker.refresh()
+        # The total size of the installation in bytes
+        size = tracker.total()
+
+    :param path: The path of the database file. Defaults to "usage.db" within the installation folder
+    :param config: The config instance
+    """
+    SCHEMA = (
+        'DROP TABLE IF EXISTS entries',
+        'CREATE TABLE entries ('
+        '   category TEXT NOT NULL,'
+        '   path TEXT NOT NULL PRIMARY KEY,'
+        '   mtime REAL NOT NULL,'
+        '   size INTEGER NOT NULL'
+        ')',
+        'CREATE INDEX entries_category ON entries (category)',
+        'DROP TABLE IF EXISTS totals',
+        'CREATE TABLE totals ('
+        '   category TEXT NOT NULL PRIMARY KEY,'
+        '   size INTEGER NOT NULL'
+        ')'
+    )
+    # This version is stored as the "user_version" of the database. Whenever the schema changes, this number has to be
+    # incremented, which causes existing databases to be recreated and rebuilt.
+    SCHEMA_VERSION = 2
+
+    # Shared by all instances, so that the database is not rebuilt by multiple threads at once. Multiple processes are
+    # handled by the exclusive transaction of "ensure_schema".
+    _lock = threading.Lock()
+
+    def __init__(self, path: Optional[str] = None, config: Config = CONFIG):
+        self.config = config
+        self.path = get_path('usage.db') if path is None else path
+
+    def get_folder(self, category: str) -> str:
+        """
+        Returns the path of the folder, whose top level entries belong to the given *category*.
+
+        :returns str:
+        """
+        if category == ARCHIVE:
+            return self.config.get_archive_path()
+        elif category == BUILDS:
+            return self.config.get_builds_path()
+        elif category == STATIC:
+            return os.path.join(self.config.get_path(), 'static')
+        elif category == BLOBS:
+            return os.path.join(self.config.get_path(), 'blobs')
+        else:
+            return self.config.get_path()
+
+    def get_entries(self, category: str) -> List[str]:
+        """
+        Returns a list with the paths of all the top level entries of the given *category*, which currently exist.
+        For the OTHER category these are all the entries of the installation folder, except for the folders of the
+        other categories.
+
+        :returns: A list of absolute paths
+        """
+        folder = self.get_folder(category)
+        if not os.path.isdir(folder):
+            return []
+
+        paths = [self._key(os.path.join(folder, name)) for name in os.listdir(folder)]
+        if category == OTHER:
+            excluded = {self._key(self.get_folder(other)) for other in CATEGORIES if other != OTHER}
+            # The database itself (and its temporary journal file) changes with every operation
+            paths = [path for path in paths if path not in excluded and not path.startswith(self._key(self.path))]
+
+        return paths
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        A context manager, which opens a new connection to the database and commits all changes at the end. If the
+        database does not exist yet or was created with an older schema, it is (re)created and all the folders are
+        measured.
+        """
+        with self._lock:
+            connection = sqlite3.connect(self.path, timeout=10)
+            try:
+                ensure_schema(connection, self.SCHEMA, self.SCHEMA_VERSION, self._rebuild)
+            except BaseException:
+                connection.close()
+                raise
+
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # -- Modifying the records
+
+    def record(self, category: str, path: str) -> int:
+        """
+        Measures the size of the file or folder at *path*, which belongs to the given *category*, and records it. An
+        existing record for the same path is replaced and the total of the category is updated accordingly.
+
+        :returns: The size of the entry in bytes
+        """
+        with self.connect() as connection:
+            return self._record(connection, category, self._key(path))
+
+    def remove(self, path: str) -> None:
+        """
+        Removes the record for the given *path* and subtracts its size from the total of its category.
+
+        :returns: void
+        """
+        with self.connect() as connection:
+            self._remove(connection, self._key(path))
+
+    def refresh(self, category: Optional[str] = None) -> Dict[str, int]:
+        """
+        Updates the records of the given *category* (or of all categories if None), by only measuring those top level
+        entries again, which are new or whose modification time has changed. Records of entries which no longer exist
+        are removed.
+
+        :returns: A dict, whose keys are the categories and the values the number of entries that have been updated
+        """
+        categories = CATEGORIES if category is None else [category]
+
+        counts = {}
+        with self.connect() as connection:
+            for category in categories:
+                recorded = dict(connection.execute('SELECT path, mtime FROM entries WHERE category = ?', (category, )))
+                counts[category] = 0
+
+                for path in self.get_entries(category):
+                    if recorded.pop(path, None) != self._mtime(path):
+                        self._record(connection, category, path)
+                        counts[category] += 1
+
+                # The remaining paths have been recorded before but do not exist anymore
+                for path in recorded.keys():
+                    self._remove(connection, path)
+                    counts[category] += 1
+
+        return counts
+
+    def rebuild(self) -> Dict[str, int]:
+        """
+        Discards all the current records and measures every entry of every category again.
+
+        :returns: A dict, whose keys are the categories and the values the total size in bytes
+        """
+        with self.connect() as connection:
+            self._rebuild(connection)
+
+        return self.totals()
+
+    # -- Querying the records
+
+    def totals(self) -> Dict[str, int]:
+        """
+        Returns the total size of each category.
+
+        :returns: A dict, whose keys are the categories and the values the sizes in bytes
+        """
+        with self.connect() as connection:
+            totals = dict(connection.execute('SELECT category, size FROM totals'))
+
+        return {category: totals.get(category, 0) for category in CATEGORIES}
+
+    def total(self) -> int:
+        """
+        Returns the total size of the whole ufotest installation.
+
+        :returns: The size in bytes
+        """
+        return sum(self.totals().values())
+
+    # -- Internal methods
+
+    def _key(self, path: str) -> str:
+        return os.path.abspath(path)
+
+    def _mtime(self, path: str) -> float:
+        return os.stat(path).st_mtime
+
+    def _update_total(self, connection: sqlite3.Connection, category: str, delta: int) -> None:
+        connection.execute(
+            'INSERT INTO totals (category, size) VALUES (?, ?) '
+            'ON CONFLICT (category) DO UPDATE SET size = size + excluded.size',
+            (category, delta)
+        )
+
+    def _record(self, connection: sqlite3.Connection, category: str, path: str) -> int:
+        # The modification time has to be read before measuring, so that changes during the measurement are not missed
+        mtime = self._mtime(path)
+        # The files of the build folders are mostly hard links into the blob store, which are counted there instead
+        size = get_folder_size(path, count_links=(category != BUILDS))
+
+        self._remove(connection, path)
+        connection.execute('INSERT INTO entries (category, path, mtime, size) VALUES (?, ?, ?, ?)',
+                           (category, path, mtime, size))
+        self._update_total(connection, category, size)
+
+        return size
+
+    def _remove(self, connection: sqlite3.Connection, path: str) -> None:
+        row = connection.execute('SELECT category, size FROM entries WHERE path = ?', (path, )).fetchone()
+        if row is not None:
+            connection.execute('DELETE FROM entries WHERE path = ?', (path, ))
+            self._update_total(connection, row[0], -row[1])
+
+    def _rebuild(self, connection: sqlite3.Connection) -> None:
+        connection.execute('DELETE FROM entries')
+        connection.execute('DELETE FROM totals')
+
+        for category in CATEGORIES:
+            for path in self.get_entries(category):
+                self._record(connection, category, path)
@@ -9,6 +9,9 @@ import subprocess
 import shutil
 import datetime
 import json
+import hashlib
+import threading
+import collections
 import importlib.util
 from typing import Optional, Tuple, Dict, List
 from abc import ABC, abstractmethod
@@ -17,6 +20,7 @@ from jinja2 import Template, Environment
 from jinja2 import FileSystemLoader, ChoiceLoader
 
 from ufotest.config import *
+from ufotest.index import ReportIndex, TEST, BUILD
 
 # GLOBAL VARIABLES
 VERSION_PATH = os.path.join(PATH, 'VERSION')
@@ -87,12 +91,14 @@ def cprint(message: str) -> None:
 # -- OS RELATED
 
 
-def get_folder_size(folder_path: str) -> int:
+def get_folder_size(folder_path: str, count_links: bool = True) -> int:
     """
     Returns the size of an entire recursive directory tree as an integer in bytes.
     https://www.thepythoncode.com/article/get-directory-size-in-bytes-using-python
 
     :param str folder_path: The absolute path to the folder which is to be measured
+    :param count_links: If False, files with more than one hard link are not counted. The content of such files is
+        shared with other places (see "ufotest.ci.blobs") and should only be counted once, over there.
 
     :return: The integer amount of bytes which all contents of the folder collectively take up
     """
@@ -101,9 +107,11 @@ def get_folder_size(folder_path: str) -> int:
     try:
         for entry in os.scandir(folder_path):
             if entry.is_file():
-                total += entry.stat().st_size
+                entry_stat = entry.stat()
+                if count_links or entry_stat.st_nlink <= 1:
+                    total += entry_stat.st_size
             elif entry.is_dir():
-                total += get_folder_size(entry.path)
+                total += get_folder_size(entry.path, count_links)
 
         return total
 
@@ -331,6 +339,18 @@ def create_folder(folder_path: str):
         os.chmod(folder_path, 0o777)
 
 
+def write_file(file_path: str, content: str) -> str:
+    """
+    Writes the string *content* into the file *file_path*, replacing any previous content.
+
+    :returns: The file path
+    """
+    with open(file_path, mode='w') as file:
+        file.write(content)
+
+    return file_path
+
+
 def init_install(verbose=False) -> str:
     """Initializes the installation folder for the ufotest app.
 
@@ -541,7 +561,7 @@ def clean_pci_read_output(output: str):
     return cleaned
 
 
-def get_test_reports() -> List[dict]:
+def get_test_reports(limit: Optional[int] = None, before: Optional[str] = None) -> List[dict]:
     """
     Returns a list of all test reports, which are represented as dicts.
 
@@ -550,37 +570,14 @@ def get_test_reports() -> List[dict]:
     The test reports will be sorted by the time they where created, where the most recent one will be the
     first element of the list.
 
+    The reports are not loaded from the individual report folders, but from the report index. See "ufotest.index".
+
+    :param limit: The max number of reports to return. Default is None, which returns all of them
+    :param before: An ISO datetime string. If given, only the reports which were started before are returned
+
     :return: A list of dicts
     """
-    reports = []
-    archive_path = CONFIG.get_archive_path()
-    for root, folders, files in os.walk(archive_path):
-
-        # Each test run gets it's own sub folder in the archive folder
-        for folder in folders:
-            folder_path = os.path.join(root, folder)
-            # Within each of these test folders, the json version of the test report is saved in a file which is always
-            # called "report.json". Just like the according html file is always called "report.html" for example.
-            report_json_path = os.path.join(folder_path, 'report.json')
-
-            # We really need to check for the existence here because of the following case: A test run has been started
-            # but is not yet complete. In this case the test folder already exists, but the report does not. In this
-            # case attempting to open the file would cause an exception!
-            if os.path.exists(report_json_path):
-                with open(report_json_path, mode='r') as report_json_file:
-                    report = json.loads(report_json_file.read())
-                    reports.append(report)
-
-        break
-
-    # At this point, the reports within the list are generally still out of order because they were added in
-    # whatever order the filesystem iterated them. This means we need to sort them still. In this function this is done
-    # by using the start time
-    sorted_reports = sorted(
-        reports,
-        key=lambda r: datetime.datetime.fromisoformat(r['start_iso']),
-        reverse=True
-    )
+    sorted_reports = ReportIndex(config=CONFIG).query(TEST, limit=limit, before=before)
 
     # This filter hook offers the possibility to add additional, externally loaded test reports to this list or
     # change the order of the list etc...
@@ -590,7 +587,7 @@ def get_test_reports() -> List[dict]:
     )
 
 
-def get_build_reports() -> List[dict]:
+def get_build_reports(limit: Optional[int] = None, before: Optional[str] = None) -> List[dict]:
     """
     Returns a list of all build reports, which are represented as dicts.
 
@@ -599,36 +596,14 @@ def get_build_reports() -> List[dict]:
     The test reports will be sorted by the time they where created, where the most recent one will be the
     first element of the list.
 
+    The reports are not loaded from the individual report folders, but from the report index. See "ufotest.index".
+
+    :param limit: The max number of reports to return. Default is None, which returns all of them
+    :param before: An ISO datetime string. If given, only the reports which were started before are returned
+
     :return: A list of dicts
     """
-    reports = []
-    builds_path = CONFIG.get_builds_path()
-    for root, folders, files in os.walk(builds_path):
-        # Each test run gets it's own sub folder in the archive folder
-        for folder in folders:
-            folder_path = os.path.join(root, folder)
-            # Within each of these test folders, the json version of the test report is saved in a file which is always
-            # called "report.json". Just like the according html file is always called "report.html" for example.
-            report_json_path = os.path.join(folder_path, 'report.json')
-
-            # We really need to check for the existence here because of the following case: A test run has been started
-            # but is not yet complete. In this case the test folder already exists, but the report does not. In this
-            # case attempting to open the file would cause an exception!
-            if os.path.exists(report_json_path):
-                with open(report_json_path, mode='r') as report_json_file:
-                    report = json.loads(report_json_file.read())
-                    reports.append(report)
-
-        break
-
-    # At this point, the reports within the list are generally still out of order because they were added in
-    # whatever order the filesystem iterated them. This means we need to sort them still. In this function this is done
-    # by using the start time
-    sorted_reports = sorted(
-        reports,
-        key=lambda r: datetime.datetime.fromisoformat(r['start_iso']),
-        reverse=True
-    )
+    sorted_reports = ReportIndex(config=CONFIG).query(BUILD, limit=limit, before=before)
 
     # This filter hook offers the possibility to add additional, externally loaded test reports to this list or
     # change the order of the list etc...
@@ -680,6 +655,82 @@ class AbstractRichOutput(ABC):
         raise NotImplementedError()
 
 
+class TemplateCache(object):
+    """
+    A thread safe LRU cache for jinja templates, which have been compiled from template strings.
+
+    **DESIGN CHOICE**
+
+    The jinja environment only caches the templates, which are loaded from the template folders by their file name.
+    Templates created with "Environment.from_string" on the other hand are compiled from scratch every single time. This
+    is exactly how the "HTMLTemplateMixin" works: Every result of a test report is rendered from its own template string
+    and nested results, like those of "CombinedTestResult", are rendered by a template, which in turn renders the nested
+    dicts. Compiling a jinja template (parsing, generating the python code and compiling that) takes a lot longer than
+    rendering it. Recompiling a large archive thus spent most of its time compiling the same handful of template
+    strings over and over again.
+
+    The compiled templates are now cached by their template string. The dict lookup is based on the hash of the string,
+    which python computes only once per string object. The cache is bounded and evicts the least recently used template,
+    because the templates of older reports, which are loaded from their json files, may differ from the current ones.
+    The cache is bound to one environment: If the environment is replaced (which happens when the config is prepared
+    with the plugins), all the cached templates are discarded, since they hold a reference to their environment.
+
+    :param size: The max number of compiled templates, which are kept in the cache
+    """
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.templates: Dict[str, Template] = collections.OrderedDict()
+        self.environment: Optional[Environment] = None
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, environment: Environment, template_string: str) -> Template:
+        """
+        Returns the template, which is compiled from *template_string* within the given jinja *environment*. The
+        template is only compiled if it is not already in the cache.
+
+        :returns: The compiled template
+        """
+        with self.lock:
+            if environment is not self.environment:
+                self.templates.clear()
+                self.environment = environment
+
+            if template_string in self.templates:
+                self.templates.move_to_end(template_string)
+                self.hits += 1
+                return self.templates[template_string]
+
+            self.misses += 1
+
+        # Compiling is the expensive part. It is done without the lock, so that other threads are not blocked. At worst
+        # the same template is compiled twice.
+        template = environment.from_string(template_string)
+        with self.lock:
+            if environment is self.environment and self.size > 0:
+                self.templates[template_string] = template
+                while len(self.templates) > self.size:
+                    self.templates.popitem(last=False)
+
+        return template
+
+    def clear(self) -> None:
+        with self.lock:
+            self.templates.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+#: The template cache, which is shared by all the classes implementing "HTMLTemplateMixin"
+TEMPLATE_CACHE = TemplateCache()
+
+#: All the classes implementing "HTMLTemplateMixin" by their template name. This is used to look up the template of a
+#: dict, which only contains a reference to the template of its class.
+HTML_TEMPLATE_CLASSES: Dict[str, type] = {}
+
+
 class HTMLTemplateMixin(object):
     """
     This mixin can be used to provide a default implementation of the "to_html" method for the
@@ -741,6 +792,16 @@ class HTMLTemplateMixin(object):
         c_dict = c.to_dict()
         c_dict['text'] = 'Bye World'
         HTMLTemplateMixin.html_from_dict(c_dict) # <p>Bye World</p>
+
+    **TEMPLATE REFERENCES**
+
+    Originally the dict representation contained the whole template string. Since every single test result of a
+    report and every nested result of a "CombinedTestResult" did that, the report.json files contained the same
+    template strings over and over again. Now the dict only contains a reference to the template of the class: Its
+    name (the import path of the class) and the version "HTML_TEMPLATE_VERSION". Every class implementing this mixin is
+    registered in HTML_TEMPLATE_CLASSES by this name, which is where "html_from_dict" looks up the template string. The
+    version has to be increased, whenever the template of a class is changed in a way, which requires different dict
+    fields. Dicts, which still contain the template string itself, can still be rendered.
     """
 
     TEMPLATE_FIELD_NAME = '_html_template'
@@ -749,6 +810,47 @@ class HTMLTemplateMixin(object):
         saved within the dict representation of the object
     """
 
+    TEMPLATE_REFERENCE_FIELD_NAME = '_template'
+    """
+    :cvar TEMPLATE_REFERENCE_FIELD_NAME: The key name under which the reference to the template of the class is saved
+        within the dict representation of the object
+    """
+
+    HTML_TEMPLATE_VERSION = 1
+    """
+    :cvar HTML_TEMPLATE_VERSION: The version of the html template of the class
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        HTML_TEMPLATE_CLASSES[cls.get_template_name()] = cls
+
+    @classmethod
+    def get_template_name(cls) -> str:
+        """
+        Returns the name, under which the template of the class is referenced within the dict representations.
+
+        :returns: The import path of the class
+        """
+        return f'{cls.__module__}.{cls.__qualname__}'
+
+    @classmethod
+    def get_template_reference(cls) -> dict:
+        return {
+            'name':         cls.get_template_name(),
+            'version':      cls.HTML_TEMPLATE_VERSION
+        }
+
+    @classmethod
+    def get_class_html_template_string(cls) -> Optional[str]:
+        """
+        Returns the jinja html template string of the class. This is the template, which is used for the dicts, which
+        only reference the template of the class.
+
+        :returns: The template string or None if the class does not define a template
+        """
+        return getattr(cls, 'HTML_TEMPLATE', None)
+
     def get_html_template_string(self) -> str:
         """
         Returns the jinja html template string of the object instance.
@@ -764,7 +866,7 @@ class HTMLTemplateMixin(object):
 
         :returns str: The template string
         """
-        template_string = self.HTML_TEMPLATE
+        template_string = self.get_class_html_template_string()
         return template_string
 
     def to_html(self) -> str:
@@ -773,42 +875,140 @@ class HTMLTemplateMixin(object):
 
         :returns str: The rendered html string
         """
-        CONFIG.template_environment.filters['html_from_dict'] = self.html_from_dict
         template_string = self.get_html_template_string()
-        template = CONFIG.template_environment.from_string(template_string)
+        template = self.get_compiled_template(template_string)
         return template.render({'this': self})
 
     def to_dict(self) -> dict:
         """
         Returns the dict representation which contains the important fields required for the HTMLTemplateMixin
-        functionality.
+        functionality. Usually this is only the reference to the template of the class. Only if an instance uses a
+        different template than its class, the template string itself is part of the dict.
 
         :returns dict:
         """
         template_string = self.get_html_template_string()
+        if template_string == self.get_class_html_template_string():
+            return {self.TEMPLATE_REFERENCE_FIELD_NAME: self.get_template_reference()}
+
         return {self.TEMPLATE_FIELD_NAME: template_string}
 
     @classmethod
     def html_from_dict(cls, data: dict) -> str:
         """
         Given a "data" dict, which was created by the "to_dict" method of a class which implements this mixin, this
-        method will use the template string which is saved in this dict and the other fields which represent the
+        method will use the template which is referenced or saved in this dict and the other fields which represent the
         original instance attributes to render and return the appropriate html representation.
 
         :raises KeyError: If the given "data" dict does not actually originate from a class which implements this mixin
-            which is indicated by the fact that it wont contain the necessary field for the template string.
+            which is indicated by the fact that it wont contain the necessary field for the template string. Also if
+            the referenced template class is not known (maybe because it is part of a plugin, which is not loaded).
 
         :returns str: The html representation according to the template string and the values contained in the dict.
         """
-        if cls.TEMPLATE_FIELD_NAME not in data:
+        if cls.TEMPLATE_REFERENCE_FIELD_NAME in data:
+            template_string = cls.get_referenced_template_string(data[cls.TEMPLATE_REFERENCE_FIELD_NAME])
+        elif cls.TEMPLATE_FIELD_NAME in data:
+            template_string = data[cls.TEMPLATE_FIELD_NAME]
+        else:
             raise KeyError((
-                f'The subject dictionary does not contain the necessary key "{cls.TEMPLATE_FIELD_NAME}", which is '
-                f'required to compile it as a html string! Make sure that the dictionary was created by invoking the '
-                f'"to_dict" method of a class inheriting from {cls.__class__.__name__}!'
+                f'The subject dictionary does not contain the necessary key "{cls.TEMPLATE_REFERENCE_FIELD_NAME}" or '
+                f'"{cls.TEMPLATE_FIELD_NAME}", which is required to compile it as a html string! Make sure that the '
+                f'dictionary was created by invoking the "to_dict" method of a class inheriting from {cls.__name__}!'
             ))
 
-        template_string = data[cls.TEMPLATE_FIELD_NAME]
-        CONFIG.template_environment.filters['html_from_dict'] = cls.html_from_dict
-        template = CONFIG.template_environment.from_string(template_string)
+        template = cls.get_compiled_template(template_string)
         return template.render({'this': data})
 
+    @classmethod
+    def get_referenced_template_string(cls, reference: dict) -> str:
+        """
+        Returns the template string of the class, which is referenced by the given template *reference* dict.
+
+        If the version of the reference is different from the current version of the class, the current template is
+        used anyways. Dicts with the fields required by an older version should be migrated instead.
+
+        :raises KeyError: If there is no class with the referenced template name
+
+        :returns: The template string
+        """
+        name = reference['name']
+        if name not in HTML_TEMPLATE_CLASSES:
+            raise KeyError(
+                f'There is no class for the html template "{name}". If the class is defined by a plugin, make sure '
+                f'that the plugin is loaded!'
+            )
+
+        return HTML_TEMPLATE_CLASSES[name].get_class_html_template_string()
+
+    @classmethod
+    def compact_dict(cls, data: dict) -> dict:
+        """
+        Returns a copy of the given *data* dict, in which the template strings of the dict itself and all the nested
+        dicts are replaced by references to the template of a class, if that class still uses the exact same template.
+        The pre-rendered "html" fields are removed as well. All other fields are left as they are, which means that the
+        compact dict renders exactly the same html as the original one.
+
+        This is used to migrate the dicts, which were saved by older versions.
+
+        :returns: The compact dict
+        """
+        class_references = {}
+        for template_class in HTML_TEMPLATE_CLASSES.values():
+            template_string = template_class.get_class_html_template_string()
+            if template_string is not None:
+                class_references.setdefault(template_string, template_class.get_template_reference())
+
+        def compact(value):
+            if isinstance(value, list):
+                return [compact(element) for element in value]
+
+            if not isinstance(value, dict):
+                return value
+
+            result = {key: compact(element) for key, element in value.items()}
+            if cls.TEMPLATE_FIELD_NAME in result:
+                result.pop('html', None)
+                if result[cls.TEMPLATE_FIELD_NAME] in class_references:
+                    result[cls.TEMPLATE_REFERENCE_FIELD_NAME] = class_references[result.pop(cls.TEMPLATE_FIELD_NAME)]
+
+            return result
+
+        return compact(data)
+
+    @classmethod
+    def get_compiled_template(cls, template_string: str) -> Template:
+        """
+        Returns the template compiled from the given *template_string* within the ufotest template environment. The
+        compiled templates are cached in TEMPLATE_CACHE.
+
+        :returns: The compiled template
+        """
+        environment = CONFIG.template_environment
+        # The filter only has to be registered once for every environment and not with every render
+        if 'html_from_dict' not in environment.filters:
+            environment.filters['html_from_dict'] = HTMLTemplateMixin.html_from_dict
+
+        return TEMPLATE_CACHE.get(environment, template_string)
+
+
+def get_template_fingerprint(environment: Environment) -> str:
+    """
+    Returns a hash of all the templates, which may be used to render the html of a dict with "html_from_dict": The
+    sources of all the template files of the given jinja *environment* and the template strings of all the classes
+    implementing "HTMLTemplateMixin". If any of them changes, the fingerprint changes.
+
+    :returns: The hex digest of the hash
+    """
+    digest = hashlib.sha256()
+    for name in sorted(environment.list_templates()):
+        source, _, _ = environment.loader.get_source(environment, name)
+        digest.update(name.encode())
+        digest.update(source.encode())
+
+    for name, template_class in sorted(HTML_TEMPLATE_CLASSES.items()):
+        digest.update(f'{name}@{template_class.HTML_TEMPLATE_VERSION}'.encode())
+        digest.update((template_class.get_class_html_template_string() or '').encode())
+
+    return digest.hexdigest()
+